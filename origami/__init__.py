@@ -1,7 +1,19 @@
 import functools
-from origami.crafter import Crafter, OrigamiException, UnfoldingException
+import sys
+import types
+from origami.compiler import compile_flatten_multi, record_class
+from origami.crafter import (
+    Crafter, InvalidFoldFormatException, OrigamiException, UnfoldingException)
+from origami.cache import FoldCache
+from origami.decoder import FoldDecoder
+from origami.records import RecordFile
+from origami.util import multidelim_generator
 
-__all__ = ['Crafter', 'pattern', 'fold', 'unfold', 'OrigamiException']
+__all__ = ['Crafter', 'pattern', 'record', 'fold', 'unfold', 'fold_many',
+           'unfold_many', 'fold_multi', 'fold_tagged', 'unfold_tagged',
+           'FoldCache', 'FoldDecoder', 'RecordFile', 'OrigamiException']
+
+_constructions = ('init', 'new')
 
 
 def fold(obj, crafter='global'):
@@ -12,16 +24,77 @@ def fold(obj, crafter='global'):
     return Crafter(crafter).fold(obj)
 
 
-def unfold(data, type, crafter='global'):
+def unfold(data, type, crafter='global', into=None):
     '''
     Convenience method for unfolding data according to a
     given class pattern or into a given object.
     Default Crafter is 'global'
     '''
-    return Crafter(crafter).unfold(data, type)
+    return Crafter(crafter).unfold(data, type, into=into)
+
+
+def fold_many(iterable, crafter='global', workers=None):
+    '''
+    Convenience method for folding many objects back-to-back
+    with a specific Crafter, optionally in `workers` processes.
+    Default Crafter is 'global'
+    '''
+    return Crafter(crafter).fold_many(iterable, workers=workers)
+
+
+def unfold_many(data, type, count=None, crafter='global', into=None,
+                workers=None):
+    '''
+    Convenience method for unfolding consecutive instances of a
+    given class pattern, optionally in `workers` processes.  If count
+    is None, unfolds until the data is exhausted.
+    Default Crafter is 'global'
+    '''
+    return Crafter(crafter).unfold_many(
+        data, type, count, into=into, workers=workers)
+
+
+# Compiled flatten functions for fold_multi, by class and Crafter names
+_multi_flattens = {}
+
+
+def fold_multi(obj, crafters=('global',)):
+    '''
+    Fold an object with several Crafters at once, returning a tuple with
+    the BitString from each Crafter in order.  Each attribute is read once,
+    and each crease applied to it once, even when the Crafters' patterns
+    share fields.
+    '''
+    crafters = tuple(Crafter(name) for name in crafters)
+    metas = [crafter._fold_meta(obj) for crafter in crafters]
+    key = (obj.__class__,) + tuple(crafter.name for crafter in crafters)
+    flatten = _multi_flattens.get(key)
+    if flatten is None:
+        flatten = _multi_flattens[key] = compile_flatten_multi(
+            crafters, obj.__class__)
+    return tuple(crafter._fold(obj, meta, values) for crafter, meta, values
+                 in zip(crafters, metas, flatten(obj)))
+
+
+def fold_tagged(obj, crafter='global'):
+    '''
+    Convenience method for folding an object prefixed with its
+    pattern's tag with a specific Crafter.
+    Default Crafter is 'global'
+    '''
+    return Crafter(crafter).fold_tagged(obj)
+
+
+def unfold_tagged(data, crafter='global'):
+    '''
+    Convenience method for unfolding an object of any tagged
+    pattern, folded with fold_tagged.
+    Default Crafter is 'global'
+    '''
+    return Crafter(crafter).unfold_tagged(data)
 
 
-def pattern(cls=None, *, crafter='global', unfold=True):
+def pattern(cls=None, *, crafter='global', unfold=True, construct='init'):
     '''
     Class decorator that handles most of the pattern-learning machinery
     for a class.  The decorated class should have the attribute `folds`,
@@ -32,16 +105,29 @@ def pattern(cls=None, *, crafter='global', unfold=True):
     constructs instances of the class from data unfolded by the Crafter.  The
     attributes that will be set are pulled from the class's `folds` string.
 
+    `construct` controls how that function builds instances.  With 'init',
+    the default, it calls the class with no arguments and sets each
+    attribute with setattr.  With 'new', it allocates instances with
+    `cls.__new__` without calling `__init__`, and sets attributes directly,
+    bypassing any `__setattr__`: slots through their descriptors and the
+    rest with a single update of the instance `__dict__` (properties and
+    other data descriptors are still set with setattr).  'new' works with
+    classes whose `__init__` has required arguments, and is the fastest way
+    to unfold many instances, especially of classes with `__slots__`.
+
     If the class's _folds attribute is a dictionary, uses the string found
     at `folds`[`creator`].  Passes _creases to the Crafter if defined,
     otherwise an empty dictionary.
     '''
+    if construct not in _constructions:
+        raise ValueError("construct must be 'init' or 'new'")
     if not cls:
-        return functools.partial(pattern, crafter=crafter, unfold=unfold)
+        return functools.partial(pattern, crafter=crafter, unfold=unfold,
+                                 construct=construct)
 
     c = Crafter(crafter)
     if unfold:
-        _make_unfold_func(cls)
+        _make_unfold_func(cls, construct)
     unfold_func = cls.unfold
     folds = getattr(cls, 'folds', '')
     creases = getattr(cls, 'creases', {})
@@ -49,9 +135,116 @@ def pattern(cls=None, *, crafter='global', unfold=True):
     return cls
 
 
-def _make_unfold_func(cls):
+def record(name, folds, crafter='global', creases=None, module=None):
+    '''
+    Creates a pattern class from a fold string and learns it with the given
+    Crafter, for classes that only hold the folded values:
+
+        Point = record('Point', 'x=uint:9, y=uint:9')
+        data = fold(Point(3, 4))
+
+    The class has a slot for each fold, an __init__ that takes them
+    positionally in order, and an __eq__ and __repr__ over all of them.
+    Unfolding calls that __init__ directly from the compiled unfold, which
+    is the fastest way to build instances.  Fold names must be valid
+    identifiers that don't start with '__'.  `creases` are passed to the
+    Crafter as for `pattern`.  `module` sets the class's __module__, by
+    default the caller's module, so instances can be pickled when the
+    class is assigned to a module-level name of the same name.
+    '''
+    if not folds:
+        raise InvalidFoldFormatException(folds, 'Nothing to fold!')
+    if module is None:
+        module = sys._getframe(1).f_globals.get('__name__', '__main__')
+    attrs = [attr for attr, _ in multidelim_generator(folds, ',', '=')]
+    cls = record_class(name, attrs, module)
+    # Not set on the class, where it could shadow a field named 'unfold'
+    unfold_func = _unfold_method('new').__get__(None, cls)
+    Crafter(crafter).learn_pattern(
+        cls, unfold_func, folds, creases or {}, constructor=cls)
+    return cls
+
+
+def _unfold_attrs(cls, name):
+    return [attr for attr, fmt in Crafter(name).patterns[cls]['folds']]
+
+
+def _class_attr(cls, attr):
+    for klass in cls.__mro__:
+        if attr in vars(klass):
+            return vars(klass)[attr]
+    return None
+
+
+def _direct_plan(cls, name):
+    '''
+    Splits the attrs unfolded by a Crafter into those stored in slots,
+    paired with their descriptor's __set__, those stored in the instance
+    __dict__, and those that have to be set with setattr.
+    '''
+    has_dict = any('__dict__' in vars(klass) for klass in cls.__mro__)
+    slots, stored, others = [], [], []
+    for attr in _unfold_attrs(cls, name):
+        descriptor = _class_attr(cls, attr)
+        if isinstance(descriptor, types.MemberDescriptorType):
+            slots.append((attr, descriptor.__set__))
+        elif has_dict and not hasattr(descriptor, '__set__'):
+            stored.append(attr)
+        else:
+            others.append(attr)
+    return slots, stored, others
+
+
+def _missing_attr(instance, error):
+    return UnfoldingException(
+        instance, "missing expected attribute '{}'".format(error.args[0]))
+
+
+def _make_unfold_func(cls, construct='init'):
+    cls.unfold = _unfold_method(construct)
+
+
+def _unfold_method(construct):
+    # The attrs to set, by class and Crafter name, are found the first time
+    # each is unfolded rather than on every call.  The Crafter name and
+    # instance are taken positionally so no fold name can clash with them.
+    # Methods can't be pickled, so each is marked with its construct mode
+    # for worker processes to make their own (see origami.parallel).
+    plans = {}
+
+    if construct == 'new':
+        @classmethod
+        def cls_unfold(cls, *args, **kwargs):
+            name, instance = args
+            plan = plans.get((cls, name))
+            if plan is None:
+                plan = plans[cls, name] = _direct_plan(cls, name)
+            slots, stored, others = plan
+            if instance is None:
+                instance = cls.__new__(cls)
+            try:
+                for attr, set_slot in slots:
+                    set_slot(instance, kwargs[attr])
+                if stored:
+                    if len(stored) == len(kwargs) and not (slots or others):
+                        instance.__dict__.update(kwargs)
+                    else:
+                        instance.__dict__.update(
+                            {attr: kwargs[attr] for attr in stored})
+                for attr in others:
+                    setattr(instance, attr, kwargs[attr])
+            except KeyError as e:
+                raise _missing_attr(instance, e)
+            return instance
+        cls_unfold.__func__.construct = construct
+        return cls_unfold
+
     @classmethod
-    def cls_unfold(cls, name, instance, **kwargs):
+    def cls_unfold(cls, *args, **kwargs):
+        name, instance = args
+        attrs = plans.get((cls, name))
+        if attrs is None:
+            attrs = plans[cls, name] = _unfold_attrs(cls, name)
         if instance is None:
             try:
                 instance = cls()
@@ -59,10 +252,10 @@ def _make_unfold_func(cls):
                 raise UnfoldingException(
                     cls, '__init__ method has 1 or more required arguments')
         try:
-            for attr, fmt in Crafter(name).patterns[cls]['folds']:
+            for attr in attrs:
                 setattr(instance, attr, kwargs[attr])
-        except KeyError:
-            raise UnfoldingException(
-                instance, "missing expected attribute '{}'".format(attr))
+        except KeyError as e:
+            raise _missing_attr(instance, e)
         return instance
-    cls.unfold = cls_unfold
+    cls_unfold.__func__.construct = construct
+    return cls_unfold
@@ -0,0 +1,127 @@
+'''
+Folding over asyncio streams.
+
+Each object is sent as a frame of whole bytes.  Fixed-size patterns use
+fixed-size frames: the folded object padded with zero bits to a byte
+boundary.  Variable-size patterns prefix each padded object with its length
+in bytes as a 4-byte big-endian unsigned int.
+'''
+from .crafter import Crafter
+from .exceptions import UnfoldingException
+from .packing import iter_records
+import asyncio
+import struct
+
+_length = struct.Struct('>I')
+# Bytes requested from a reader at a time for fixed-size frames
+_chunk = 65536
+# Objects framed into one write (and drained once) by write_folded_many
+_batch = 1024
+
+
+def _frames(crafter, objs):
+    '''Returns the frames of objs joined into a single bytes object.'''
+    if not objs:
+        return b''
+    metas = [crafter._fold_meta(obj) for obj in objs]
+    sizes = set(meta['size'] for meta in metas)
+    if len(sizes) == 1 and None not in sizes and not sizes.pop() % 8:
+        # Every object is a whole number of bytes, so no frame is padded
+        return crafter.fold_many(objs).tobytes()
+    frames = []
+    for obj, meta in zip(objs, metas):
+        data = crafter.fold(obj).tobytes()
+        if meta['size'] is None:
+            frames.append(_length.pack(len(data)))
+        frames.append(data)
+    return b''.join(frames)
+
+
+async def write_folded(writer, obj, crafter='global'):
+    '''
+    Fold obj with the given Crafter, write it to an asyncio StreamWriter as
+    a single frame, and wait for the writer to drain.
+    '''
+    writer.write(_frames(Crafter(crafter), [obj]))
+    await writer.drain()
+
+
+async def write_folded_many(writer, iterable, crafter='global',
+                            batch_size=_batch):
+    '''
+    Fold each object in iterable and write them to an asyncio StreamWriter
+    as consecutive frames.  Frames are written `batch_size` objects at a
+    time, with a single write and drain per batch.
+    '''
+    crafter = Crafter(crafter)
+    batch = []
+    for obj in iterable:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            writer.write(_frames(crafter, batch))
+            await writer.drain()
+            batch = []
+    if batch:
+        writer.write(_frames(crafter, batch))
+        await writer.drain()
+
+
+async def read_folded(reader, type, crafter='global'):
+    '''
+    Asynchronous generator that reads frames written by write_folded (or
+    write_folded_many) from an asyncio StreamReader and yields unfolded
+    instances of a pattern class, until the stream ends:
+
+        async for action in read_folded(reader, Action):
+            ...
+
+    Fixed-size frames are read in large chunks and every complete frame in
+    a chunk is unfolded at once.  Raises UnfoldingException if the stream
+    ends partway through a frame.
+    '''
+    crafter = Crafter(crafter)
+    cls, instance = crafter._get_cls_obj(type)
+    if instance is not None:
+        raise UnfoldingException(
+            type, 'read_folded requires a pattern class, not an instance.')
+    meta = crafter.patterns[cls]
+    layout, expand = meta['layout'], meta['expand']
+
+    if layout is None:
+        while True:
+            try:
+                header = await reader.readexactly(_length.size)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise _truncated(type)
+                return
+            try:
+                data = await reader.readexactly(_length.unpack(header)[0])
+            except asyncio.IncompleteReadError:
+                raise _truncated(type)
+            yield crafter.unfold_from(data, 0, cls)
+
+    frame = (layout.size + 7) >> 3
+    pad = frame * 8 - layout.size
+    buffer = bytearray()
+    while True:
+        chunk = await reader.read(_chunk)
+        if not chunk:
+            break
+        buffer += chunk
+        n = len(buffer) // frame
+        if pad:
+            unpack = layout.unpack
+            records = [unpack(x >> pad)
+                       for x in iter_records(buffer, frame * 8, n)]
+        else:
+            records = layout.unpack_many(buffer, 0, n)
+        del buffer[:n * frame]
+        for values in records:
+            yield expand(values, None)
+    if buffer:
+        raise _truncated(type)
+
+
+def _truncated(type):
+    return UnfoldingException(type, 'Stream ended partway through a frame.')
@@ -0,0 +1,123 @@
+'''
+Caching the folds of unchanged objects.
+'''
+from .packing import PACK_ERRORS
+import bitstring
+import collections
+import operator
+
+_keys = ('identity', 'values')
+
+
+def _exact(values):
+    '''
+    A key for flat values that only equal values folding to the same bits
+    share: 1, 1.0 and True compare equal, as do 0.0 and -0.0.
+    '''
+    return tuple((value.__class__, value.hex())
+                 if value.__class__ is float else (value.__class__, value)
+                 for value in values)
+
+
+class FoldCache(object):
+    '''
+    A bounded, least-recently-used cache of folded objects for a Crafter.
+    Enable it by assigning it to the Crafter's `fold_cache`; `fold` then
+    returns the cached result for an object that hasn't changed since it
+    was last folded.  With a cache, `fold` returns an immutable
+    bitstring.Bits rather than a BitStream, so a hit is returned as it is,
+    without packing or copying anything.
+
+    With key='identity', the default, objects are cached by identity and
+    `version`, either an attribute name or a function of the object
+    returning any value that changes whenever the object does (a counter,
+    for example).  A version is required, since nothing else tells the
+    cache an object has changed.  A hit only reads the version.  The cache
+    holds a reference to each cached object.
+
+        Crafter('client').fold_cache = FoldCache(4096, version='version')
+
+    With key='values', objects are cached by their class and folded values,
+    so equal objects share an entry and changes are always seen.  Values
+    are compared by the bits they fold to, so 0.0 and -0.0 don't share an
+    entry.  A hit still reads every attribute (and packs the values of
+    fixed-size patterns, to key them), so this mainly helps variable-size
+    patterns, which bitstring packs slowly.  Objects with unhashable values
+    (such as repeated fields) aren't cached.
+
+    A cache may be shared by several Crafters; entries are kept per Crafter.
+    `hits` and `misses` count lookups since the cache was created.
+    '''
+    def __init__(self, maxsize=1024, key='identity', version=None):
+        if key not in _keys:
+            raise ValueError("key must be 'identity' or 'values'")
+        if key == 'identity' and version is None:
+            raise ValueError("key='identity' requires a version")
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if isinstance(version, str):
+            version = operator.attrgetter(version)
+        self.maxsize = maxsize
+        self.key = key
+        self.version = version
+        self.hits = self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __repr__(self):
+        return 'FoldCache(maxsize={}, key={!r})'.format(
+            self.maxsize, self.key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        '''Remove every entry.  Counters are kept.'''
+        self._entries.clear()
+
+    def fold(self, crafter, obj, meta):
+        '''Returns the folded obj, from the cache if possible.'''
+        entries = self._entries
+        if self.key == 'identity':
+            key = (crafter.name, id(obj))
+            version = self.version(obj)
+            entry = entries.get(key)
+            if entry is not None and entry[1] == version:
+                return self._hit(key, entry)
+            values = meta['flatten'](obj)
+            # Keep obj so its id can't be reused while it's cached
+            stored = (obj, version)
+        else:
+            values = meta['flatten'](obj)
+            key = (crafter.name, obj.__class__, self._values_key(meta, values))
+            try:
+                entry = entries.get(key)
+            except TypeError:
+                self.misses += 1
+                return bitstring.Bits(crafter._fold(obj, meta, values))
+            if entry is not None:
+                return self._hit(key, entry)
+            stored = ()
+
+        self.misses += 1
+        data = bitstring.Bits(crafter._fold(obj, meta, values))
+        entries[key] = stored + (data,)
+        entries.move_to_end(key)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return data
+
+    def _hit(self, key, entry):
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[-1]
+
+    def _values_key(self, meta, values):
+        # Fixed-size values are keyed by their bits; others by their exact
+        # values, as they may still need coercing by bitstring
+        layout = meta['layout']
+        if layout is not None:
+            try:
+                return layout.pack(values)
+            except PACK_ERRORS:
+                pass
+        return _exact(values)
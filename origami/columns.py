@@ -0,0 +1,256 @@
+'''
+Vectorized packing between NumPy columns and fixed-size folded records.
+
+Byte-aligned records whose layout maps onto struct codes are read (or
+written) as a NumPy structured array with the same fields.  Other records
+go through uint64 words: the 64 bits starting at each record (or, for
+records over 64 bits, at each field) are gathered from the bytes at once,
+and every field is shifted and masked out of them for all records with
+array operations.  Packing builds the words and ORs their bytes into place.
+Records are processed in blocks to bound the size of those arrays.
+'''
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from .packing import _floats, _ints
+
+# Records per block; a multiple of 8 so every block ends on a byte boundary
+_block = 1 << 15
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError('numpy is required for columnar folding')
+
+
+def column_dtype(field):
+    '''
+    Returns the NumPy dtype used for a field's column, or None if the field
+    has no numeric column type (hex, oct, bin, bits, or ints over 64 bits).
+    '''
+    kind, n = field.kind, field.length
+    if kind == 'bool':
+        return numpy.dtype(bool)
+    if kind in _floats:
+        return numpy.dtype('f{}'.format(n // 8))
+    if kind in _ints and n <= 64:
+        width = next(w for w in (8, 16, 32, 64) if n <= w)
+        code = 'u' if kind.startswith('u') else 'i'
+        return numpy.dtype('{}{}'.format(code, width // 8))
+    return None
+
+
+def _swap_bytes(bits, n):
+    # Reverse the n // 8 bytes in the low bits of a uint64 column
+    swapped = numpy.zeros_like(bits)
+    for i in range(n // 8):
+        byte = (bits >> numpy.uint64(8 * i)) & numpy.uint64(0xff)
+        swapped |= byte << numpy.uint64(n - 8 - 8 * i)
+    return swapped
+
+
+def _is_little(field):
+    if field.kind in _floats:
+        return _floats[field.kind] == '<'
+    return field.kind in _ints and _ints[field.kind] == 'little' and \
+        field.length > 8
+
+
+def _checked(field, column):
+    '''Returns a column as an array, checking it fits its field.'''
+    kind, n = field.kind, field.length
+    if kind in _floats:
+        return numpy.asarray(column, dtype='f{}'.format(n // 8))
+    if kind == 'bool':
+        return numpy.asarray(column, dtype=bool)
+    column = numpy.asarray(column)
+    if column.dtype.kind not in 'biu':
+        raise ValueError("column for '{}' is not integral".format(
+            field.token))
+    if kind.startswith('u'):
+        low, high = 0, (1 << n) - 1
+    else:
+        low, high = -(1 << (n - 1)), (1 << (n - 1)) - 1
+    if len(column) and (column.min() < low or column.max() > high):
+        raise ValueError("column out of range for '{}'".format(field.token))
+    return column
+
+
+def _to_bits(field, column):
+    '''Converts a column to the uint64 bit patterns of its field.'''
+    kind, n = field.kind, field.length
+    column = _checked(field, column)
+    if kind in _floats:
+        bits = column.view('u{}'.format(n // 8)).astype(numpy.uint64)
+    elif kind == 'bool':
+        bits = column.astype(numpy.uint64)
+    else:
+        bits = column.astype(numpy.int64).view(numpy.uint64)
+        if n < 64:
+            bits = bits & numpy.uint64((1 << n) - 1)
+    if _is_little(field):
+        bits = _swap_bytes(bits, n)
+    return bits
+
+
+def _from_bits(field, bits):
+    '''Converts uint64 bit patterns of a field to its column type.'''
+    kind, n = field.kind, field.length
+    if _is_little(field):
+        bits = _swap_bytes(bits, n)
+    if kind in _floats:
+        width = 'u{}'.format(n // 8)
+        return bits.astype(width).view('f{}'.format(n // 8))
+    if kind == 'bool':
+        return bits.astype(bool)
+    dtype = column_dtype(field)
+    if kind.startswith('u'):
+        return bits.astype(dtype)
+    values = bits.view(numpy.int64)
+    if n < 64:
+        values = values - ((values >> (n - 1)) << n)
+    return values.astype(dtype)
+
+
+def _struct_dtype(layout):
+    '''Returns the structured dtype matching a layout's struct format.'''
+    order = layout.struct.format[0]
+    return numpy.dtype([
+        ('f{}'.format(i), column_dtype(field).newbyteorder(order))
+        for i, field in enumerate(layout.fields)])
+
+
+def _spans(positions):
+    # Indices of the 9 bytes holding the 64 bits from each bit position
+    return (positions >> numpy.uint64(3)).astype(numpy.intp)[:, None] + \
+        numpy.arange(9)
+
+
+def _gather(raw, positions):
+    '''
+    Returns the 64 bits starting at each bit position of raw as uint64s.
+    raw must extend at least 9 bytes past the last position.
+    '''
+    gathered = raw[_spans(positions)]
+    words = gathered[:, :8].copy().view('>u8').ravel().astype(numpy.uint64)
+    shift = positions & numpy.uint64(7)
+    spill = gathered[:, 8].astype(numpy.uint64) >> (numpy.uint64(8) - shift)
+    return (words << shift) | spill
+
+
+def _scatter(out, positions, words, size):
+    '''
+    ORs the 64 bits of each uint64 word into out starting at each bit
+    position, where positions are `size` bits apart.  out must extend at
+    least 9 bytes past the last position.
+    '''
+    shift = positions & numpy.uint64(7)
+    high = (words >> shift).astype('>u8').view(numpy.uint8).reshape(-1, 8)
+    low = (words << (numpy.uint64(8) - shift)) & numpy.uint64(0xff)
+    spans = numpy.column_stack((high, low.astype(numpy.uint8)))
+    index = _spans(positions)
+    # Words every `step` positions apart don't share a byte, so each of
+    # those runs is ORed in at once
+    step = -(-72 // size)
+    for first in range(step):
+        out[index[first::step]] |= spans[first::step]
+
+
+def _positions(start, stop, size, bit_offset=0):
+    return numpy.arange(start, stop, dtype=numpy.uint64) * \
+        numpy.uint64(size) + numpy.uint64(bit_offset)
+
+
+def pack_columns(layout, columns, count):
+    '''
+    Returns `count` records packed back-to-back as bytes, where `columns`
+    is a list with one array per field of the layout.
+    '''
+    require_numpy()
+    if layout.struct is not None:
+        records = numpy.empty(count, dtype=_struct_dtype(layout))
+        for name, field, column in zip(
+                records.dtype.names, layout.fields, columns):
+            records[name] = _checked(field, column)
+        return records.tobytes()
+
+    size = layout.size
+    bits = [_to_bits(field, column)
+            for field, column in zip(layout.fields, columns)]
+    chunks = []
+    for start in range(0, count, _block):
+        stop = min(start + _block, count)
+        length = ((stop - start) * size + 7) >> 3
+        out = numpy.zeros(length + 9, dtype=numpy.uint8)
+        positions = _positions(0, stop - start, size)
+        if size <= 64:
+            # Build each record's word, left-aligned, and write it once
+            words = numpy.zeros(stop - start, dtype=numpy.uint64)
+            for field, values in zip(layout.fields, bits):
+                shift = numpy.uint64(64 - field.offset - field.length)
+                words |= values[start:stop] << shift
+            _scatter(out, positions, words, size)
+        else:
+            for field, values in zip(layout.fields, bits):
+                shift = numpy.uint64(64 - field.length)
+                _scatter(out, positions + numpy.uint64(field.offset),
+                         values[start:stop] << shift, size)
+        chunks.append(out[:length].tobytes())
+    return b''.join(chunks)
+
+
+def unpack_columns(layout, data, bit_offset, count):
+    '''
+    Returns a list with one array per field of the layout, holding the
+    values of `count` records read back-to-back from the bytes-like `data`
+    starting `bit_offset` bits in.
+    '''
+    require_numpy()
+    if layout.struct is not None and not bit_offset & 7:
+        records = numpy.frombuffer(
+            data, _struct_dtype(layout), count, bit_offset >> 3)
+        return [records[name].astype(column_dtype(field))
+                for name, field in zip(records.dtype.names, layout.fields)]
+
+    size = layout.size
+    columns = [[] for _ in layout.fields]
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    for start in range(0, count, _block):
+        stop = min(start + _block, count)
+        first = bit_offset + start * size
+        last = bit_offset + stop * size
+        chunk = numpy.zeros(((last + 7) >> 3) - (first >> 3) + 9,
+                            dtype=numpy.uint8)
+        chunk[:-9] = raw[first >> 3:(last + 7) >> 3]
+        positions = _positions(0, stop - start, size, first & 7)
+        if size <= 64:
+            words = _gather(chunk, positions)
+        for column, field in zip(columns, layout.fields):
+            n = numpy.uint64(field.length)
+            if size <= 64:
+                values = (words << numpy.uint64(field.offset)) >> \
+                    (numpy.uint64(64) - n)
+            else:
+                values = _gather(
+                    chunk, positions + numpy.uint64(field.offset)) >> \
+                    (numpy.uint64(64) - n)
+            column.append(values)
+    result = []
+    for field, blocks in zip(layout.fields, columns):
+        bits = numpy.concatenate(blocks) if blocks else \
+            numpy.zeros(0, dtype=numpy.uint64)
+        result.append(_from_bits(field, bits))
+    return result
+
+
+def to_structured(names, layout, columns):
+    '''Returns a structured array with one named field per column.'''
+    dtype = [(name, column_dtype(field))
+             for name, field in zip(names, layout.fields)]
+    count = len(columns[0]) if columns else 0
+    array = numpy.empty(count, dtype=dtype)
+    for name, column in zip(names, columns):
+        array[name] = column
+    return array
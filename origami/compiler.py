@@ -0,0 +1,453 @@
+'''
+Generates specialized fold/unfold functions for learned patterns.
+
+Instead of walking a pattern's folds on every call, each pattern is compiled
+once into straight-line Python: nested patterns are inlined, and crease
+functions and unfold callbacks are bound as globals of the generated code.
+'''
+from .exceptions import FoldingException, InvalidFoldFormatException
+from .repeat import Repeat, builder, flattener
+import collections
+import collections.abc
+import keyword
+
+
+def _missing(obj, attr):
+    return FoldingException(
+        obj, "missing expected attribute '{}'".format(attr))
+
+
+def _wrong_count(obj, attr, count):
+    return FoldingException(
+        obj, "expected {} elements in attribute '{}'".format(count, attr))
+
+
+def _missing_value(row, attr):
+    return FoldingException(row, "missing value for '{}'".format(attr))
+
+
+def _wrong_length(row, count):
+    return FoldingException(
+        row, 'expected {} values, got {}'.format(count, len(row)))
+
+
+def _is_identifier(name):
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def _crease_for(meta, attr, fmt, direction):
+    '''
+    Name creases take priority over format creases.  Creases on repeated
+    fields apply to each element.
+    '''
+    if isinstance(fmt, Repeat):
+        if not isinstance(fmt.fmt, str):
+            return None
+        fmt = fmt.fmt
+    if attr in meta['name_creases']:
+        return meta['name_creases'][attr][direction]
+    if fmt in meta['format_creases']:
+        return meta['format_creases'][fmt][direction]
+    return None
+
+
+class _Source(object):
+    '''Accumulates generated source and the globals it refers to.'''
+    def __init__(self, crafter):
+        self.crafter = crafter
+        self.lines = []
+        self.namespace = {'_name': crafter.name, '_missing': _missing,
+                          '_wrong_count': _wrong_count}
+        self.counts = {}
+
+    def var(self, prefix):
+        n = self.counts.get(prefix, 0)
+        self.counts[prefix] = n + 1
+        return '{}{}'.format(prefix, n)
+
+    def bind(self, value, prefix):
+        name = self.var('_' + prefix)
+        self.namespace[name] = value
+        return name
+
+    def line(self, text, indent=1):
+        self.lines.append('    ' * indent + text)
+
+    def build(self, header, func_name, filename):
+        source = '\n'.join([header] + self.lines) + '\n'
+        exec(compile(source, filename, 'exec'), self.namespace)
+        func = self.namespace[func_name]
+        func.__source__ = source
+        return func
+
+
+def _getattr_expr(obj_var, attr):
+    if _is_identifier(attr):
+        return '{}.{}'.format(obj_var, attr)
+    return 'getattr({}, {!r})'.format(obj_var, attr)
+
+
+def _call_expr(func, instance, kwargs):
+    if all(_is_identifier(attr) for attr, _ in kwargs):
+        args = ', '.join('{}={}'.format(a, e) for a, e in kwargs)
+    else:
+        args = '**{' + ', '.join(
+            '{!r}: {}'.format(a, e) for a, e in kwargs) + '}'
+    if args:
+        return '{}(_name, {}, {})'.format(func, instance, args)
+    return '{}(_name, {})'.format(func, instance)
+
+
+def _emit_flatten(src, crafter, cls, obj_var, out, seen, path=()):
+    # seen maps attribute paths (and creases applied to them) to the
+    # variables already holding their values, so that each is only computed
+    # once when flattening for several crafters
+    meta = crafter.patterns[cls]
+    for attr, fmt in meta['folds']:
+        key = path + (attr,)
+        var = seen.get(key)
+        if var is None:
+            var = seen[key] = src.var('v')
+            src.line('try:')
+            src.line('{} = {}'.format(var, _getattr_expr(obj_var, attr)), 2)
+            src.line('except AttributeError:')
+            src.line('raise _missing({}, {!r})'.format(obj_var, attr), 2)
+        if isinstance(fmt, Repeat):
+            flatten = src.bind(flattener(
+                crafter, fmt, _crease_for(meta, attr, fmt, 'fold')), 'f')
+            if fmt.count is None:
+                out.append('{}({})'.format(flatten, var))
+                continue
+            src.line('if len({}) != {}:'.format(var, fmt.count))
+            src.line('raise _wrong_count({}, {!r}, {})'.format(
+                obj_var, attr, fmt.count), 2)
+            out.append('*{}({})'.format(flatten, var))
+            continue
+        if not isinstance(fmt, str):
+            _emit_flatten(src, crafter, fmt, var, out, seen, key)
+            continue
+        crease = _crease_for(meta, attr, fmt, 'fold')
+        if crease is not None:
+            creased = seen.get((key, crease))
+            if creased is None:
+                creased = seen[key, crease] = src.var('v')
+                src.line('{} = {}({})'.format(
+                    creased, src.bind(crease, 'c'), var))
+            var = creased
+        out.append(var)
+
+
+def _value_exprs(src, crafter, cls, values, nested, element=None):
+    '''
+    Returns (attr, expr) pairs that unfold each fold of cls from the names
+    of its flat values, which are consumed from `values`.  nested(subcls,
+    values) returns the expression for a nested pattern; element, if given,
+    builds each element of a repeated pattern from its flat values.
+    '''
+    meta = crafter.patterns[cls]
+    exprs = []
+    for attr, fmt in meta['folds']:
+        if isinstance(fmt, Repeat):
+            crease = _crease_for(meta, attr, fmt, 'unfold')
+            elements = element(fmt.fmt) if element is not None and \
+                not isinstance(fmt.fmt, str) else None
+            build = src.bind(builder(crafter, fmt, crease, elements), 'b')
+            if fmt.count is None:
+                expr = '{}({})'.format(build, values.pop(0))
+            else:
+                width = _width(crafter, fmt)
+                expr = '{}([{}])'.format(build, ', '.join(values[:width]))
+                del values[:width]
+        elif not isinstance(fmt, str):
+            expr = nested(fmt, values)
+        else:
+            expr = values.pop(0)
+            crease = _crease_for(meta, attr, fmt, 'unfold')
+            if crease is not None:
+                expr = '{}({})'.format(src.bind(crease, 'c'), expr)
+        exprs.append((attr, expr))
+    return exprs
+
+
+def _unfold_expr(src, cls, instance, values):
+    kwargs = _value_exprs(
+        src, src.crafter, cls, values,
+        lambda subcls, values: _unfold_expr(src, subcls, 'None', values))
+    meta = src.crafter.patterns[cls]
+    call = _call_expr(src.bind(meta['unfold'], 'u'), instance, kwargs)
+    if meta['constructor'] is None:
+        return call
+    # New instances are built by calling the constructor with the values in
+    # fold order; only unfolding into an existing instance needs the callback
+    new = '{}({})'.format(src.bind(meta['constructor'], 'k'),
+                          ', '.join(expr for _, expr in kwargs))
+    if instance == 'None':
+        return new
+    return '({} if {} is None else {})'.format(new, instance, call)
+
+
+def _container_expr(src, crafter, cls, into, values):
+    exprs = _value_exprs(
+        src, crafter, cls, values,
+        lambda subcls, values: _container_expr(
+            src, crafter, subcls, into, values),
+        lambda subcls: container_builder(crafter, subcls, into))
+    if into == 'dict':
+        return '{' + ', '.join(
+            '{!r}: {}'.format(attr, expr) for attr, expr in exprs) + '}'
+    args = ', '.join(expr for _, expr in exprs)
+    if into == 'tuple':
+        return '({},)'.format(args)
+    return '{}({})'.format(
+        src.bind(container_class(crafter, cls), 'nt'), args)
+
+
+def compile_flatten(crafter, cls):
+    '''
+    Returns a function that takes an instance of cls and returns the flat
+    list of (creased) values to pack with the pattern's bitstring format.
+    '''
+    src = _Source(crafter)
+    out = []
+    _emit_flatten(src, crafter, cls, 'obj', out, {})
+    src.line('return [{}]'.format(', '.join(out)))
+    filename = '<origami fold {} {}>'.format(crafter.name, cls.__name__)
+    return src.build('def flatten(obj):', 'flatten', filename)
+
+
+def _compile_flatten_row(crafter, cls, mapping):
+    meta = crafter.patterns[cls]
+    src = _Source(crafter)
+    src.namespace.update(
+        _missing_value=_missing_value, _wrong_length=_wrong_length)
+    folds, out = meta['folds'], []
+    if not mapping:
+        src.line('if len(row) != {}:'.format(len(folds)))
+        src.line('raise _wrong_length(row, {})'.format(len(folds)), 2)
+    for i, (attr, fmt) in enumerate(folds):
+        var = src.var('v')
+        src.line('try:')
+        src.line('{} = row[{!r}]'.format(var, attr if mapping else i), 2)
+        src.line('except (KeyError, IndexError):')
+        src.line('raise _missing_value(row, {!r})'.format(attr), 2)
+        if isinstance(fmt, Repeat):
+            element = row_flattener(crafter, fmt.fmt) \
+                if not isinstance(fmt.fmt, str) else None
+            flatten = src.bind(flattener(
+                crafter, fmt, _crease_for(meta, attr, fmt, 'fold'),
+                element), 'f')
+            if fmt.count is None:
+                out.append('{}({})'.format(flatten, var))
+                continue
+            src.line('if len({}) != {}:'.format(var, fmt.count))
+            src.line('raise _wrong_count(row, {!r}, {})'.format(
+                attr, fmt.count), 2)
+            out.append('*{}({})'.format(flatten, var))
+        elif not isinstance(fmt, str):
+            flatten = src.bind(row_flattener(crafter, fmt), 'f')
+            out.append('*{}({})'.format(flatten, var))
+        else:
+            crease = _crease_for(meta, attr, fmt, 'fold')
+            if crease is not None:
+                var = '{}({})'.format(src.bind(crease, 'c'), var)
+            out.append(var)
+    src.line('return [{}]'.format(', '.join(out)))
+    filename = '<origami fold {} {} {}>'.format(
+        crafter.name, cls.__name__, 'mapping' if mapping else 'sequence')
+    return src.build('def flatten(row):', 'flatten', filename)
+
+
+def row_flattener(crafter, cls):
+    '''
+    Returns a function like the pattern's flatten function that takes the
+    values of the pattern's folds instead of an instance: a sequence of
+    them in the order of the fold string, or a mapping of fold names to
+    them.  Values of nested patterns may be instances or values in either
+    form.
+    '''
+    meta = crafter.patterns[cls]
+    if meta['flatten_row'] is None:
+        flatten = meta['flatten']
+        sequence = _compile_flatten_row(crafter, cls, False)
+        mapping = _compile_flatten_row(crafter, cls, True)
+
+        def flatten_row(row):
+            if isinstance(row, cls):
+                return flatten(row)
+            if isinstance(row, collections.abc.Mapping):
+                return mapping(row)
+            return sequence(row)
+        meta['flatten_row'] = flatten_row
+    return meta['flatten_row']
+
+
+def compile_flatten_multi(crafters, cls):
+    '''
+    Returns a function that takes an instance of cls and returns a tuple
+    with the flat list of values for each crafter, in order.  Each attribute
+    is read once, and each crease is applied to it once, however many of
+    the crafters' patterns use it.
+    '''
+    src = _Source(crafters[0])
+    seen, outs = {}, []
+    for crafter in crafters:
+        out = []
+        _emit_flatten(src, crafter, cls, 'obj', out, seen)
+        outs.append('[{}]'.format(', '.join(out)))
+    src.line('return ({},)'.format(', '.join(outs)))
+    filename = '<origami fold {} {}>'.format(
+        '+'.join(crafter.name for crafter in crafters), cls.__name__)
+    return src.build('def flatten(obj):', 'flatten', filename)
+
+
+def compile_expand(crafter, cls):
+    '''
+    Returns a function that takes the flat list of values read with the
+    pattern's bitstring format and an instance (or None), and returns the
+    unfolded instance.
+    '''
+    src = _Source(crafter)
+    count = crafter.patterns[cls]['flat_count']
+    values = ['v{}'.format(i) for i in range(count)]
+    src.line('{}, = values'.format(', '.join(values)))
+    src.line('return ' + _unfold_expr(src, cls, 'instance', list(values)))
+    filename = '<origami unfold {} {}>'.format(crafter.name, cls.__name__)
+    return src.build('def expand(values, instance):', 'expand', filename)
+
+
+def container_class(crafter, cls):
+    '''
+    Returns the namedtuple class that a pattern unfolds into with
+    into='namedtuple'.  Fold names that aren't valid field names are
+    replaced by positional names (_0, _1, ...).
+    '''
+    meta = crafter.patterns[cls]
+    if meta['namedtuple'] is None:
+        meta['namedtuple'] = collections.namedtuple(
+            cls.__name__, [attr for attr, _ in meta['folds']], rename=True)
+    return meta['namedtuple']
+
+
+def container_builder(crafter, cls, into):
+    '''
+    Returns a function that takes the flat list of values read with the
+    pattern's format and returns them in a tuple, dict or namedtuple
+    (`into`), with nested patterns in the same form.  No instance is
+    created and the unfold callback isn't called.
+    '''
+    containers = crafter.patterns[cls]['containers']
+    if into not in containers:
+        src = _Source(crafter)
+        count = crafter.patterns[cls]['flat_count']
+        values = ['v{}'.format(i) for i in range(count)]
+        src.line('{}, = values'.format(', '.join(values)))
+        src.line('return ' + _container_expr(src, crafter, cls, into, values))
+        filename = '<origami unfold {} {} {}>'.format(
+            crafter.name, cls.__name__, into)
+        containers[into] = src.build('def build(values):', 'build', filename)
+    return containers[into]
+
+
+def record_class(name, attrs, module=None):
+    '''
+    Returns a new class with a slot for each attr, an __init__ taking them
+    positionally in order, and an __eq__ and __repr__ over all of them.
+    '''
+    # Fields can't start with '__', so they can't clash with the arguments
+    for attr in [name] + attrs:
+        if not _is_identifier(attr) or attr.startswith('__'):
+            raise InvalidFoldFormatException(
+                attr, 'Record names must be valid identifiers.')
+    if len(set(attrs)) != len(attrs):
+        raise InvalidFoldFormatException(
+            attrs, 'Record fields must have unique names.')
+    fields = ', '.join('__self.{}'.format(attr) for attr in attrs)
+    others = ', '.join('__other.{}'.format(attr) for attr in attrs)
+    template = '{}({})'.format(
+        name, ', '.join(attr + '={!r}' for attr in attrs))
+    lines = ['def __init__(__self, {}):'.format(', '.join(attrs))]
+    lines.extend('    __self.{0} = {0}'.format(attr) for attr in attrs)
+    lines.extend([
+        'def __eq__(__self, __other):',
+        '    if __other.__class__ is not __self.__class__:',
+        '        return NotImplemented',
+        '    return ({},) == ({},)'.format(fields, others),
+        'def __repr__(__self):',
+        '    return {!r}.format({})'.format(template, fields)])
+    source = '\n'.join(lines) + '\n'
+    namespace = {}
+    exec(compile(source, '<origami record {}>'.format(name), 'exec'),
+         namespace)
+    body = {'__slots__': tuple(attrs), '__source__': source}
+    for method in ('__init__', '__eq__', '__repr__'):
+        func = body[method] = namespace[method]
+        func.__qualname__ = '{}.{}'.format(name, method)
+    if module is not None:
+        body['__module__'] = module
+    return type(name, (object,), body)
+
+
+def flat_names(crafter, cls, prefix=''):
+    '''
+    Returns the names of a pattern's flattened values in packing order.
+    Values of nested patterns are named with dots, as in 'point.x'.
+    '''
+    names = []
+    for attr, fmt in crafter.patterns[cls]['folds']:
+        if isinstance(fmt, str) or \
+                isinstance(fmt, Repeat) and fmt.count is None:
+            names.append(prefix + attr)
+        elif isinstance(fmt, Repeat):
+            for i in range(fmt.count):
+                element = '{}{}[{}]'.format(prefix, attr, i)
+                if isinstance(fmt.fmt, str):
+                    names.append(element)
+                else:
+                    names.extend(flat_names(crafter, fmt.fmt, element + '.'))
+        else:
+            names.extend(flat_names(crafter, fmt, prefix + attr + '.'))
+    return names
+
+
+def _width(crafter, fmt):
+    '''Number of flat values a fold format spans.'''
+    if isinstance(fmt, str):
+        return 1
+    if isinstance(fmt, Repeat):
+        if fmt.count is None:
+            return 1
+        return fmt.count * _width(crafter, fmt.fmt)
+    return crafter.patterns[fmt]['flat_count']
+
+
+def resolve_field(crafter, cls, name):
+    '''
+    Locates a (possibly dotted) fold name within a pattern's flattened
+    values.  Returns (start, count, crease, subcls): the index of its first
+    flat value and how many flat values it spans, its unfold crease (or
+    None), and the nested pattern class if the name refers to one (or None).
+    For a repeated field subcls is its Repeat, and the crease applies to
+    each element.
+    '''
+    meta, index = crafter.patterns[cls], 0
+    parts = name.split('.')
+    for depth, part in enumerate(parts):
+        for attr, fmt in meta['folds']:
+            width = _width(crafter, fmt)
+            if attr == part:
+                break
+            index += width
+        else:
+            raise InvalidFoldFormatException(
+                name, "No fold named '{}' in pattern '{}'.".format(
+                    part, cls.__name__))
+        if isinstance(fmt, (str, Repeat)):
+            if depth != len(parts) - 1:
+                raise InvalidFoldFormatException(
+                    name, "'{}' is not a nested pattern.".format(part))
+            crease = _crease_for(meta, attr, fmt, 'unfold')
+            if isinstance(fmt, Repeat):
+                return index, width, crease, fmt
+            return index, 1, crease, None
+        meta = crafter.patterns[fmt]
+    return index, width, None, fmt
@@ -1,42 +1,36 @@
+from .exceptions import (
+    OrigamiException,
+    InvalidPatternClassException,
+    InvalidFoldFormatException,
+    InvalidCreaseFormatException,
+    FoldingException,
+    UnfoldingException
+)
+from .compiler import (
+    compile_flatten, compile_expand, container_builder, flat_names,
+    row_flattener)
+from .columns import (
+    column_dtype, pack_columns, require_numpy, to_structured, unpack_columns)
+from .delta import Delta
+from .lazy import view_class
+from . import parallel
+from .projection import Projection
+from .parse import compile_steps, read as read_steps
+from .packing import (
+    Layout, BitWriter, GOLOMB_TOKENS, PACK_ERRORS, parse_token, read_bits,
+    write_bits, byte_view, iter_records)
+from .repeat import (
+    flat_width, join_segments, packer, parse_repeat, reader)
+from .scan import compile_predicate
 from .util import multidelim_generator, validate_bitstring_format
 import bitstring
-import collections
+import collections.abc
+import functools
+import struct
 
 
-class OrigamiException(Exception):
-    pass
-
-
-class InvalidPatternClassException(OrigamiException):
-    def __init__(self, cls, reason):
-        message = "Invalid pattern class '{}': ".format(cls) + reason
-        OrigamiException.__init__(self, message)
-
-
-class InvalidFoldFormatException(OrigamiException):
-    def __init__(self, fold, reason):
-        message = "Invalid fold '{}': ".format(fold) + reason
-        OrigamiException.__init__(self, message)
-
-
-class InvalidCreaseFormatException(OrigamiException):
-    def __init__(self, crease, reason):
-        message = "Invalid crease '{}': ".format(crease) + reason
-        OrigamiException.__init__(self, message)
-
-
-class FoldingException(OrigamiException):
-    def __init__(self, obj, reason):
-        message = "Failed to fold '{}': ".format(obj) + reason
-        OrigamiException.__init__(self, message)
-
-
-class UnfoldingException(OrigamiException):
-    def __init__(self, obj, reason):
-        message = "Failed to unfold '{}': ".format(obj) + reason
-        OrigamiException.__init__(self, message)
-
 _crafters = {}
+_containers = ('tuple', 'dict', 'namedtuple')
 
 
 class Crafter(object):
@@ -51,12 +45,15 @@ class Crafter(object):
             c = _crafters[name] = super(Crafter, cls).__new__(cls)
             c.name = name
             c.patterns = {}
+            c._tagging = None
+            c.fold_cache = None
         return _crafters[name]
 
     def __repr__(self, *args, **kwargs):
         return "Crafter('{}')".format(self.name)
 
-    def learn_pattern(self, cls, unfold_func, folds, creases):
+    def learn_pattern(self, cls, unfold_func, folds, creases,
+                      constructor=None):
         '''
         cls - The class to learn
         unfold_func - A function that takes (crafter_name, instance, **kwargs)
@@ -68,6 +65,11 @@ class Crafter(object):
             corresponding value a fold string.  If there is no key for the name
             of the Crafter that is learning the pattern, raises
             InvalidFoldFormatException.
+            A format may be repeated with a fixed count, as in
+            'samples=uint:12[16]', or with a count folded before the
+            elements, as in 'points=Point[*]' (a 16-bit count) or
+            'points=Point[*:8]'.  Repeated attributes are sequences, and
+            unfold as lists.
         creases - creases is an optional dictionary whose keys are a mix of
             fold keys and fold formats.  If the key is a fold format, it may be
             a literal bitstring format, or a custom format that maps to a
@@ -100,13 +102,17 @@ class Crafter(object):
                         {'fmt': 'bool',
                          'fold': my_bool_fold_func,
                          'unfold': my_bool_unfold_func}}
+        constructor - An optional function that takes the unfolded value of
+            each fold positionally, in order, and returns a new instance of
+            cls.  If given, it's called instead of unfold_func whenever no
+            instance is passed in.
         '''
         if not cls:
             raise InvalidPatternClassException(cls, "Must be class object.")
         if cls.__name__ in self.patterns:
             raise InvalidPatternClassException(
                 cls, "Crafter {} already learned it.".format(self.name))
-        processed_folds, bitstring_chunks = [], []
+        processed_folds, segments = [], []
 
         creases = creases or {}
         name_creases = {}
@@ -114,7 +120,7 @@ class Crafter(object):
 
         if not folds:
             raise InvalidFoldFormatException(folds, 'Nothing to fold!')
-        if isinstance(folds, collections.Mapping):
+        if isinstance(folds, collections.abc.Mapping):
             try:
                 folds = folds[self.name]
             except KeyError:
@@ -128,6 +134,12 @@ class Crafter(object):
                     name, "Custom creases must specify an unfold method")
 
         for name, fmt in multidelim_generator(folds, ',', '='):
+            repeat = parse_repeat(fmt)
+            if repeat is not None:
+                if repeat[1].count is None and repeat[1].width < 1:
+                    raise InvalidFoldFormatException(
+                        fmt, 'A count must be at least 1 bit wide.')
+                fmt, repeat = repeat
             if name in creases:
                 name_creases[name] = creases[name]
             if fmt in creases:
@@ -135,127 +147,796 @@ class Crafter(object):
 
             if fmt in self.patterns:
                 subcls = self.patterns[fmt]
-                subcls_fmt = self.patterns[subcls]['bitstring_format']
-                bitstring_chunks.append(subcls_fmt)
-                processed_folds.append((name, subcls))
+                chunk = self.patterns[subcls]['segments']
+                if isinstance(chunk, str):
+                    chunk = [chunk]
+                fold = subcls
             elif validate_bitstring_format(fmt):
-                bitstring_chunks.append(fmt)
-                processed_folds.append((name, fmt))
+                chunk, fold = [fmt], fmt
             elif fmt in format_creases:
                 # This crease must have a 'fmt' key that defines a
                 # valid bitstring format. This cannot refer to learned patterns
                 # because only one value is passed to the crease's fold/unfold
                 # methods, and that wouldn't make since for a pattern with
                 # (potentially) more than one bitstring value.  Put the crease
-                # value for 'fmt' in the bitstring_chunks instead of the
-                # literal fmt string.
+                # value for 'fmt' in the segments instead of the literal fmt
+                # string.
                 try:
                     real_fmt = format_creases[fmt]['fmt']
                 except KeyError:
                     raise InvalidCreaseFormatException(fmt, "Custom creases require a valid bistring format under the key 'fmt'.")
                 if not validate_bitstring_format(real_fmt):
                     raise InvalidCreaseFormatException(fmt, 'Custom creases fmt not a known pattern or valid bitstring format.')
-                bitstring_chunks.append(real_fmt)
-                processed_folds.append((name, fmt))
+                chunk, fold = [real_fmt], fmt
             else:
                 raise InvalidFoldFormatException(
                     fmt, 'Not a known pattern or valid bitstring format.')
 
-        bitstring_format = ','.join(bitstring_chunks)
-        # We have to do this after bitstring is joined because some
-        # pieces will be more than one piece (nested folding)
-        flat_count = len(bitstring_format.split(','))
+            if repeat is not None:
+                repeat.fmt = fold
+                if isinstance(fold, str):
+                    # Only a token with a known end can be read repeatedly
+                    if parse_token(chunk[0]) is None and \
+                            chunk[0] not in GOLOMB_TOKENS:
+                        raise InvalidFoldFormatException(
+                            fmt, 'Repeated tokens must have a fixed width '
+                                 '(or be ue, se, uie or sie).')
+                    repeat.token = chunk[0]
+                else:
+                    repeat.read_element = self.patterns[fold]['read']
+                    repeat.pack_element = self.patterns[fold]['pack']
+                if repeat.count is None:
+                    chunk = [repeat]
+                else:
+                    chunk = chunk * repeat.count
+                fold = repeat
+            segments.extend(chunk)
+            processed_folds.append((name, fold))
+
+        # Nested patterns and fixed repeats expand to more than one token, so
+        # count flat values once the segments are joined
+        segments = join_segments(segments)
+        flat_count = flat_width(segments)
+        if isinstance(segments, str):
+            bitstring_format = segments
+            # Every token but ue, se, uie, sie (and hex/oct/bin/bits without
+            # a length) has a static width, so most patterns have a fixed
+            # size
+            layout = Layout.from_format(bitstring_format)
+        else:
+            # Counted repeats make the format depend on the values
+            bitstring_format, layout = None, None
 
         fold_metadata = {
             'bitstring_format': bitstring_format,
+            'segments': segments,
+            'read': reader(segments),
+            'pack': packer(segments),
             'folds': processed_folds,
             'unfold': unfold_func,
+            'constructor': constructor,
+            'description': (folds, creases),
             'flat_count': flat_count,
             'name_creases': name_creases,
-            'format_creases': format_creases
+            'format_creases': format_creases,
+            'layout': layout,
+            'size': layout.size if layout is not None else None,
+            'view': None,
+            'projections': {},
+            'delta': None,
+            'containers': {},
+            'namedtuple': None,
+            'flatten_row': None
         }
         self.patterns[cls] = fold_metadata
         self.patterns[cls.__name__] = cls
+        fold_metadata['flatten'] = compile_flatten(self, cls)
+        fold_metadata['expand'] = compile_expand(self, cls)
+        fold_metadata['flat_names'] = flat_names(self, cls)
+        # How to parse a variable-size pattern straight from bytes
+        fold_metadata['steps'] = (
+            compile_steps(self, cls) if layout is None else None)
+        if self._tagging is not None and not self._tagging['explicit']:
+            # Default tags cover every learned pattern, so reassign them
+            self._tagging = None
 
     def fold(self, obj):
         '''
         Fold the object into a BitString according to its
-        pattern's folds and creases.
+        pattern's folds and creases.  If the Crafter has a fold_cache, an
+        unchanged object may be returned from it, and the result is an
+        immutable bitstring.Bits.  See FoldCache.
         '''
-        try:
-            fmt = self.patterns[obj.__class__]['bitstring_format']
-        except KeyError:
-            raise FoldingException(
-                obj, "Unknown pattern class '{}'.".format(obj.__class__))
+        meta = self._fold_meta(obj)
+        if self.fold_cache is not None:
+            return self.fold_cache.fold(self, obj, meta)
+        return self._fold(obj, meta, meta['flatten'](obj))
+
+    def _fold(self, obj, meta, values):
+        layout = meta['layout']
+        if layout is not None:
+            try:
+                if layout.struct is not None:
+                    return bitstring.BitStream(
+                        bytes=layout.struct.pack(*values))
+                return bitstring.BitStream(
+                    uint=layout.pack(values), length=layout.size)
+            except PACK_ERRORS:
+                # Let bitstring coerce the values or report why it can't
+                pass
+        return self._bitstring_pack(obj, meta, values)
+
+    def fold_many(self, iterable, workers=None):
+        '''
+        Fold each object in iterable and return a single BitString with the
+        folded objects packed back-to-back, with no padding between them.
+
+        If workers is given, the objects are split into that many runs,
+        folded in a pool of as many processes, and joined.  Objects are
+        pickled to the workers, so their classes must be importable; see
+        origami.parallel for how workers learn the Crafter's patterns.
+        '''
+        objs = iterable
+        if workers is not None:
+            if not isinstance(objs, collections.abc.Sequence):
+                objs = list(objs)
+            return parallel.fold_many(self, objs, workers)
+        if not isinstance(objs, collections.abc.Sized):
+            objs = list(objs)
+
+        size = 0
+        for obj in objs:
+            obj_size = self._fold_meta(obj)['size']
+            if obj_size is None:
+                size = 0
+                break
+            size += obj_size
+        writer = BitWriter((size + 7) // 8)
+
+        for obj in objs:
+            meta = self._fold_meta(obj)
+            self._write(writer, obj, meta, meta['flatten'](obj))
+        return writer.getvalue()
+
+    def fold_values(self, type, *values):
+        '''
+        Fold the values of a pattern's folds, in the order of its fold
+        string, into a BitString as if they were the attributes of an
+        instance.  A single mapping of fold names to values may be passed
+        instead.  Values of nested patterns may be instances, or their own
+        values as a sequence or mapping.  Creases are applied as usual.
 
-        values = self._get_flat_values(obj)
+            crafter.fold_values(Block, 3, 4, 1)
+        '''
+        cls, _ = self._get_cls_obj(type)
+        meta = self.patterns[cls]
+        row = values
+        if len(values) == 1 and \
+                isinstance(values[0], collections.abc.Mapping):
+            row = values[0]
+        return self._fold(row, meta, row_flattener(self, cls)(row))
 
+    def fold_rows(self, type, rows):
+        '''
+        Fold each row of values (a sequence or mapping, as for fold_values)
+        and return a single BitString with the folded rows packed
+        back-to-back, as fold_many does for instances.  Rows such as those
+        from a database cursor can be folded without creating instances.
+        '''
+        cls, _ = self._get_cls_obj(type)
+        meta = self.patterns[cls]
+        if not isinstance(rows, collections.abc.Sized):
+            rows = list(rows)
+        size = meta['size'] * len(rows) if meta['size'] is not None else 0
+        writer = BitWriter((size + 7) // 8)
+        flatten = row_flattener(self, cls)
+        for row in rows:
+            self._write(writer, row, meta, flatten(row))
+        return writer.getvalue()
+
+    def fold_delta(self, obj, baseline):
+        '''
+        Fold only the values of obj that differ from baseline, an instance
+        of the same pattern class, into a BitString.  The result starts with
+        a bitmask with one bit per flattened value of the pattern (nested
+        patterns included), set for each value that changed, followed by
+        the changed values.  Values are compared after creases are applied.
+        '''
+        meta = self._fold_meta(obj)
+        if baseline.__class__ is not obj.__class__:
+            raise FoldingException(
+                obj, 'Baseline must be an instance of the same pattern class.')
+        delta = self._delta(obj.__class__)
+        flatten = meta['flatten']
         try:
-            return bitstring.pack(fmt, *values)
+            mask, changes = delta.changes(flatten(obj), flatten(baseline))
         except bitstring.CreationError as e:
             raise FoldingException(obj, str(e))
         except ValueError as e:
             raise FoldingException(obj, str(e))
+        writer = BitWriter()
+        writer.write(mask, delta.count)
+        for x, length in changes:
+            writer.write(x, length)
+        return writer.getvalue()
+
+    def unfold_delta(self, data, baseline):
+        '''
+        Read a delta folded with fold_delta from a BitString, and return a
+        new instance of the baseline's pattern class with the baseline's
+        values where they didn't change.  The baseline isn't modified.
+        '''
+        cls, _ = self._get_cls_obj(baseline)
+        meta = self.patterns[cls]
+        delta = self._delta(cls)
+        try:
+            values = delta.apply(data, meta['flatten'](baseline))
+        except bitstring.ReadError as e:
+            raise UnfoldingException(cls, e.msg)
+        return meta['expand'](values, None)
+
+    def _delta(self, cls):
+        meta = self.patterns[cls]
+        if meta['delta'] is None:
+            meta['delta'] = Delta(self, cls)
+        return meta['delta']
+
+    def fold_into(self, obj, buffer, bit_offset=0):
+        '''
+        Fold the object directly into a writable buffer such as a bytearray,
+        memoryview or mmap, starting `bit_offset` bits in.  Bits around the
+        folded object are left untouched.  Returns the bit offset just past
+        the folded object.
+        '''
+        meta = self._fold_meta(obj)
+        values = meta['flatten'](obj)
+        buffer = byte_view(buffer)
+        if bit_offset < 0:
+            raise FoldingException(obj, 'bit_offset must not be negative.')
+
+        layout = meta['layout']
+        if layout is not None and layout.struct is not None and \
+                not bit_offset & 7:
+            try:
+                layout.struct.pack_into(buffer, bit_offset >> 3, *values)
+                return bit_offset + layout.size
+            except PACK_ERRORS:
+                pass
+        value, length = self._pack_int(obj, meta, values)
+        try:
+            write_bits(buffer, bit_offset, length, value)
+        except IndexError as e:
+            raise FoldingException(obj, str(e))
+        except TypeError:
+            raise FoldingException(obj, 'Buffer is not writable.')
+        return bit_offset + length
 
-    def unfold(self, data, type):
+    def unfold(self, data, type, fields=None, into=None):
         '''
         Unfold the object (or return a new instance)
         from a BitString according to its pattern's folds and creases.
+
+        If into is 'tuple', 'dict' or 'namedtuple', returns the unfolded
+        values in that form instead, with nested patterns in the same form,
+        without creating an instance or calling the unfold callback.
+
+        If fields is given, only those fields are unfolded, and the result
+        is a dict (the default) or a partially populated instance depending
+        on `into`.  See Crafter.projection.
         '''
         cls, instance = self._get_cls_obj(type)
-        fmt = self.patterns[cls]['bitstring_format']
+        meta = self.patterns[cls]
+        if not isinstance(data, bitstring.ConstBitStream):
+            # Immutable Bits (as returned with a fold_cache) are read from
+            # the start
+            data = bitstring.ConstBitStream(data)
+        if fields is not None:
+            return self.projection(cls, fields, into or 'dict').unfold(
+                data, instance)
+        container = self._container(cls, into)
+        layout = meta['layout']
         try:
-            values = data.readlist(fmt)
+            if layout is None:
+                values = meta['read'](data)
+            elif layout.struct is not None:
+                values = layout.struct.unpack(data.read(layout.bytes_token))
+            else:
+                values = layout.unpack(data.read(layout.token))
         except bitstring.ReadError as e:
             raise UnfoldingException(type, e.msg)
-        return self._obj_from_values(cls, instance, values, pos=0)
+        if container is not None:
+            return container(values)
+        return meta['expand'](values, instance)
+
+    def assign_tags(self, types=None, width=None):
+        '''
+        Assign each pattern class in `types` a numeric tag for fold_tagged
+        and unfold_tagged, from 0 in the order given.  If types is None,
+        every pattern learned so far is tagged in the order it was learned.
+        Tags are folded as a uint of `width` bits, by default the fewest
+        that hold every tag.  Returns a dict of pattern class to tag.
+
+        Without a call to assign_tags, every learned pattern is tagged in
+        the order learned, and tags are reassigned as patterns are learned.
+        Call it once all patterns are learned to fix the tags (for example,
+        when they must stay stable for data on disk or on the wire).
+        '''
+        self._tagging = self._make_tagging(types, width, explicit=True)
+        return dict(self._tagging['tags'])
 
-    def _get_flat_values(self, obj):
-        values = []
+    def fold_tagged(self, obj):
+        '''
+        Fold the object into a BitString prefixed with its pattern's tag,
+        so that unfold_tagged can unfold it without knowing its type.
+        '''
+        tagging = self._tags()
+        meta = self._fold_meta(obj)
+        try:
+            tag = tagging['tags'][obj.__class__]
+        except KeyError:
+            raise FoldingException(
+                obj, "No tag assigned to pattern class '{}'.".format(
+                    obj.__class__))
+        x, length = self._pack_int(obj, meta, meta['flatten'](obj))
+        width = tagging['width']
+        return bitstring.BitStream(
+            uint=tag << length | x, length=width + length)
+
+    def unfold_tagged(self, data):
+        '''
+        Read a tag from a BitString, then unfold and return a new instance
+        of the pattern class it was assigned to.  See fold_tagged.
+        '''
+        tagging = self._tags()
+        try:
+            tag = data.read(tagging['token']) if tagging['width'] else 0
+            decode = tagging['decoders'][tag]
+        except bitstring.ReadError as e:
+            raise UnfoldingException(data, e.msg)
+        except IndexError:
+            raise UnfoldingException(data, 'Unknown tag {}.'.format(tag))
+        return decode(data)
+
+    def _tags(self):
+        if self._tagging is None:
+            self._tagging = self._make_tagging(None, None, explicit=False)
+        return self._tagging
+
+    def _make_tagging(self, types, width, explicit):
+        if types is None:
+            classes = [cls for cls in self.patterns
+                       if not isinstance(cls, str)]
+        else:
+            classes = [self._get_cls_obj(type)[0] for type in types]
+        if len(set(classes)) != len(classes):
+            raise ValueError('Each pattern class can only have one tag.')
+        needed = (len(classes) - 1).bit_length() if classes else 0
+        if width is None:
+            width = needed
+        elif width < needed:
+            raise ValueError('{} tags need at least {} bits.'.format(
+                len(classes), needed))
+        return {
+            'tags': {cls: tag for tag, cls in enumerate(classes)},
+            'decoders': [self._decoder(cls) for cls in classes],
+            'width': width,
+            'token': 'uint:{}'.format(width),
+            'explicit': explicit
+        }
 
-        meta = self.patterns[obj.__class__]
-        name_creases = meta['name_creases']
-        format_creases = meta['format_creases']
+    def _decoder(self, cls):
+        '''Returns a function that unfolds a new instance of cls.'''
+        meta = self.patterns[cls]
+        layout, expand, read = meta['layout'], meta['expand'], meta['read']
+        if layout is None:
+            token, unpack = None, None
+        elif layout.struct is not None:
+            token, unpack = layout.bytes_token, layout.struct.unpack
+        else:
+            token, unpack = layout.token, layout.unpack
 
-        for attr, fmt in meta['folds']:
+        def decode(data):
+            try:
+                if unpack is None:
+                    values = read(data)
+                else:
+                    values = unpack(data.read(token))
+            except bitstring.ReadError as e:
+                raise UnfoldingException(cls, e.msg)
+            return expand(values, None)
+        return decode
+
+    def unfold_from(self, buffer, bit_offset, type, into=None):
+        '''
+        Unfold the object (or return a new instance) from any bytes-like
+        buffer, including an mmap, starting `bit_offset` bits in.  Only the
+        bytes spanned by the object are read, unless its pattern has a token
+        that reads to the end of the data (hex/oct/bin/bits without a
+        length).
+        See Crafter.unfold for `into`.
+        '''
+        cls, instance = self._get_cls_obj(type)
+        meta = self.patterns[cls]
+        container = self._container(cls, into)
+        layout = meta['layout']
+        buffer = byte_view(buffer)
+        if bit_offset < 0:
+            raise UnfoldingException(type, 'bit_offset must not be negative.')
+
+        if layout is None:
+            if meta['steps'] is None:
+                # A token reads to the end of the data, so bitstring has to
+                # find the end of the object
+                data = bitstring.BitStream(
+                    bytes=bytes(buffer[bit_offset >> 3:]),
+                    offset=bit_offset & 7)
+                return self.unfold(data, type, into=into)
             try:
-                data = getattr(obj, attr)
-            except AttributeError:
-                raise FoldingException(
-                    obj, "missing expected attribute '{}'".format(attr))
+                values, _ = read_steps(meta['steps'], buffer, bit_offset)
+            except bitstring.ReadError as e:
+                raise UnfoldingException(type, e.msg)
+        else:
+            try:
+                if layout.struct is not None and not bit_offset & 7:
+                    values = layout.struct.unpack_from(
+                        buffer, bit_offset >> 3)
+                else:
+                    values = layout.unpack(
+                        read_bits(buffer, bit_offset, layout.size))
+            except (IndexError, struct.error) as e:
+                raise UnfoldingException(type, str(e))
+        if container is not None:
+            return container(values)
+        return meta['expand'](values, instance)
+
+    def projection(self, type, fields, into='dict'):
+        '''
+        Returns a precompiled Projection that unfolds only the named fields
+        of a pattern class.  Fields are fold names, with dots for fields of
+        nested patterns ('point.x').  Naming a nested pattern unfolds all of
+        it.  With into='dict' each result maps names to values; with
+        into='instance' each result is a partially populated instance.
+        Projections are cached per pattern, fields and into.
+        '''
+        cls, _ = self._get_cls_obj(type)
+        if isinstance(fields, str):
+            fields = (fields,)
+        key = (tuple(fields), into)
+        projections = self.patterns[cls]['projections']
+        if key not in projections:
+            projections[key] = Projection(self, cls, key[0], into)
+        return projections[key]
+
+    def unfold_lazy(self, data, type, bit_offset=0):
+        '''
+        Returns a lazy view of a folded instance of a fixed-size pattern
+        class.  Each attribute (including nested patterns, which are views
+        themselves) is decoded the first time it's read, then cached.  Call
+        `_unfold()` on the view to get a real instance.
+
+        `data` may be a BitString stream (the view's bits are read from, and
+        advance, its position) or any bytes-like buffer, which the view
+        reads from `bit_offset` bits in without copying.
+        '''
+        cls, _ = self._get_cls_obj(type)
+        layout = self.patterns[cls]['layout']
+        if layout is None:
+            raise InvalidPatternClassException(
+                cls, 'Lazy unfolding requires a fixed-size pattern.')
+        size = layout.size
+        try:
+            if isinstance(data, bitstring.ConstBitStream):
+                data, bit_offset = data.read(size).tobytes(), 0
+            elif isinstance(data, bitstring.Bits):
+                data = data[bit_offset:bit_offset + size].tobytes()
+                bit_offset = 0
+        except (bitstring.ReadError, ValueError) as e:
+            raise UnfoldingException(type, str(e))
+        data = byte_view(data)
+        if bit_offset < 0 or bit_offset + size > len(data) * 8:
+            raise UnfoldingException(
+                type, 'Not enough data at bit offset {}.'.format(bit_offset))
+        return view_class(self, cls)(data, bit_offset)
 
-            if fmt in self.patterns:
-                values.extend(self._get_flat_values(data))
-            else:
-                if attr in name_creases:
-                    data = name_creases[attr]['fold'](data)
-                elif fmt in format_creases:
-                    data = format_creases[fmt]['fold'](data)
-                values.append(data)
-        return values
+    def unfold_many(self, data, type, count=None, into=None, workers=None):
+        '''
+        Unfold `count` consecutive instances of a pattern class from a
+        BitString, such as one returned by fold_many.  If count is None,
+        unfolds until the data is exhausted.  Returns a list of instances,
+        or of tuples, dicts or namedtuples (see Crafter.unfold for `into`).
+
+        If workers is given, the pattern must be fixed-size.  The records
+        are split into that many runs and unfolded in a pool of as many
+        processes, which send the results back pickled.  `data` may then
+        also be a bytes-like buffer, such as an mmap of a file.  See
+        origami.parallel for how workers learn the Crafter's patterns.
+        '''
+        cls, instance = self._get_cls_obj(type)
+        if instance is not None:
+            raise UnfoldingException(
+                type, 'unfold_many requires a pattern class, not an instance.')
+        build = self._unfolder(cls, into)
+        layout = self.patterns[cls]['layout']
+
+        if workers is not None:
+            if layout is None:
+                raise InvalidPatternClassException(
+                    cls, 'Parallel unfolding requires a fixed-size pattern.')
+            buffer, offset, count = self._read_records(
+                data, type, layout.size, count)
+            return parallel.unfold_many(
+                self, cls, into, buffer, offset, count, workers)
+
+        if layout is None:
+            objs = []
+            while len(objs) != count and (count is not None or
+                                          data.pos < data.len):
+                objs.append(self.unfold(data, cls, into=into))
+            return objs
+
+        buffer, offset, count = self._read_records(
+            data, type, layout.size, count)
+        return [build(values)
+                for values in layout.unpack_many(buffer, offset, count)]
+
+    def scan(self, data, type, where, instances=False, bit_offset=0,
+             count=None):
+        '''
+        Scan consecutive folded records of a fixed-size pattern class and
+        yield the index of each record whose fields satisfy every condition
+        in `where`, or the unfolded record itself if instances is True.
+        Only matching records are unfolded.
+
+        `where` maps (dotted) fold names to conditions, which are checked
+        against folded values (creases are not applied).  A condition may be
+        a value to compare for equality, a range, a set or sequence of
+        values, or a function that takes the value and returns a bool:
+
+            crafter.scan(data, Block, where={'type': 3, 'x': range(0, 64)})
+
+        `data` may be a BitString (scanned from its current position, which
+        is advanced past the scanned records) or a bytes-like buffer such as
+        an mmap, scanned from `bit_offset`.  If count is None, scans every
+        complete record.
+        '''
+        cls, _ = self._get_cls_obj(type)
+        meta = self.patterns[cls]
+        layout = meta['layout']
+        if layout is None:
+            raise InvalidPatternClassException(
+                cls, 'Scanning requires a fixed-size pattern.')
+        match = compile_predicate(self, cls, where)
+        buffer, offset, count = self._read_records(
+            data, type, layout.size, count, bit_offset)
+        records = iter_records(buffer, layout.size, count, offset)
+        if not instances:
+            return (index for index, x in enumerate(records) if match(x))
+        expand, unpack = meta['expand'], layout.unpack
+        return (expand(unpack(x), None) for x in records if match(x))
+
+    def fold_array(self, columns, type):
+        '''
+        Fold columns of values for a fixed-size pattern class, packing them
+        back-to-back as fold_many would.  `columns` is a NumPy structured
+        array, or a mapping of column arrays, keyed by the pattern's fold
+        names.  Values of nested patterns are keyed with dots, as in
+        'point.x'.  Columns hold folded values: creases are not applied.
+        Packing is vectorized over whole columns.  Requires NumPy.
+        '''
+        cls, layout, names = self._columnar(type)
+        try:
+            arrays = [columns[name] for name in names]
+        except (KeyError, ValueError) as e:
+            raise FoldingException(type, 'Missing column {}'.format(e))
+        count = len(arrays[0])
+        if any(len(array) != count for array in arrays):
+            raise FoldingException(type, 'Columns differ in length.')
+        try:
+            data = pack_columns(layout, arrays, count)
+        except ValueError as e:
+            raise FoldingException(type, str(e))
+        return bitstring.BitStream(bytes=data, length=count * layout.size)
+
+    def unfold_array(self, data, type, count=None):
+        '''
+        Unfold `count` consecutive instances of a fixed-size pattern class
+        into a NumPy structured array with one field per fold name (see
+        fold_array), without constructing any instances.  `data` may be a
+        BitString (read from its current position) or a bytes-like buffer.
+        If count is None, unfolds every complete record.  Creases are not
+        applied.  Requires NumPy.
+        '''
+        cls, layout, names = self._columnar(type)
+        buffer, offset, count = self._read_records(
+            data, type, layout.size, count)
+        return to_structured(
+            names, layout, unpack_columns(layout, buffer, offset, count))
+
+    def iter_unfold(self, stream, type, chunk_size=65536, count=None,
+                    into=None):
+        '''
+        Generator that reads a binary file-like object `chunk_size` bytes at
+        a time and yields unfolded instances of a pattern class as soon as
+        they're complete.  Objects may straddle chunk boundaries at any bit.
+        If count is None, reads until the stream is exhausted; otherwise
+        stops after yielding `count` objects (the stream may have been read
+        past the last of them).  See Crafter.unfold for `into`.
+        '''
+        cls, instance = self._get_cls_obj(type)
+        if instance is not None:
+            raise UnfoldingException(
+                type, 'iter_unfold requires a pattern class, not an instance.')
+        build = self._unfolder(cls, into)
+        layout = self.patterns[cls]['layout']
+        if layout is None:
+            for obj in self._iter_unfold_variable(
+                    stream, cls, into, chunk_size, count):
+                yield obj
+            return
+
+        buffer, bit_offset, size = bytearray(), 0, layout.size
+        while count != 0:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            n = (len(buffer) * 8 - bit_offset) // size
+            if count is not None:
+                n = min(n, count)
+                count -= n
+            records = layout.unpack_many(buffer, bit_offset, n)
+            consumed = bit_offset + n * size
+            del buffer[:consumed >> 3]
+            bit_offset = consumed & 7
+            for values in records:
+                yield build(values)
+        if count is None and len(buffer) * 8 - bit_offset >= 8:
+            raise UnfoldingException(
+                type, 'Stream ended partway through an object.')
+
+    def _iter_unfold_variable(self, stream, cls, into, chunk_size, count):
+        # Variable-size objects are parsed by a FoldDecoder as chunks arrive
+        from .decoder import FoldDecoder
+        decoder = FoldDecoder(cls, self.name, into)
+        while count != 0:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            objs = decoder.feed(chunk)
+            if count is not None:
+                objs = objs[:count]
+                count -= len(objs)
+            for obj in objs:
+                yield obj
+        if count is None:
+            decoder.close()
+
+    def size_of(self, type, in_bytes=False):
+        '''
+        Returns the exact size in bits of every folded instance of a pattern
+        class (or instance), or None if the pattern is variable-size because
+        it uses ue, se, uie, sie, or a hex/oct/bin/bits token without a length.
+
+        If in_bytes is True, returns the number of bytes needed to hold one
+        folded instance instead.
+        '''
+        cls, _ = self._get_cls_obj(type)
+        size = self.patterns[cls]['size']
+        if size is None or not in_bytes:
+            return size
+        return (size + 7) // 8
+
+    def struct_format(self, cls):
+        '''
+        Returns the struct format string that folding and unfolding the
+        pattern goes through, or None if the pattern isn't byte-aligned
+        (or mixes byte orders) and uses bit packing instead.
+        '''
+        cls, _ = self._get_cls_obj(cls)
+        layout = self.patterns[cls]['layout']
+        if layout is None or layout.struct is None:
+            return None
+        return layout.struct.format
 
-    def _obj_from_values(self, cls, instance, values, pos=0):
-        kwargs = {}
+    def _container(self, cls, into):
+        '''
+        Returns the function building a tuple, dict or namedtuple from a
+        pattern's flat values, or None if into is None or 'instance'.
+        '''
+        if into is None or into == 'instance':
+            return None
+        if into not in _containers:
+            raise ValueError('into must be one of {}'.format(
+                ('instance',) + _containers))
+        return container_builder(self, cls, into)
+
+    def _unfolder(self, cls, into):
+        '''Returns a function of flat values returning a new object.'''
+        container = self._container(cls, into)
+        if container is not None:
+            return container
+        return functools.partial(self.patterns[cls]['expand'], instance=None)
+
+    def _fold_meta(self, obj):
+        try:
+            return self.patterns[obj.__class__]
+        except KeyError:
+            raise FoldingException(
+                obj, "Unknown pattern class '{}'.".format(obj.__class__))
 
+    def _read_records(self, data, type, size, count, bit_offset=0):
+        '''
+        Returns a bytes-like buffer holding `count` records of `size` bits
+        starting `bit_offset` bits in, along with the offset and count.  A
+        BitString stream is read from (and advanced past) its current
+        position; other BitStrings and bytes-like data from `bit_offset`.
+        '''
+        if isinstance(data, bitstring.ConstBitStream):
+            available = (data.len - data.pos) // size
+        elif isinstance(data, bitstring.Bits):
+            available = (data.len - bit_offset) // size
+        else:
+            data = byte_view(data)
+            available = (len(data) * 8 - bit_offset) // size
+        if count is None:
+            count = max(available, 0)
+        elif count > available:
+            raise UnfoldingException(
+                type, 'Expected {} records but only {} remain.'.format(
+                    count, available))
+        if isinstance(data, bitstring.ConstBitStream):
+            return data.read(count * size).tobytes(), 0, count
+        if isinstance(data, bitstring.Bits):
+            end = bit_offset + count * size
+            return data[bit_offset:end].tobytes(), 0, count
+        return data, bit_offset, count
+
+    def _columnar(self, type):
+        cls, _ = self._get_cls_obj(type)
         meta = self.patterns[cls]
-        format = meta['folds']
-        name_creases = meta['name_creases']
-        format_creases = meta['format_creases']
-
-        for attr, fmt in format:
-            if isinstance(fmt, str):
-                value = values[pos]
-                if attr in name_creases:
-                    value = name_creases[attr]['unfold'](value)
-                elif fmt in format_creases:
-                    value = format_creases[fmt]['unfold'](value)
-                offset = 1
-            elif fmt in self.patterns:
-                value = self._obj_from_values(fmt, None, values, pos=pos)
-                offset = self.patterns[fmt]['flat_count']
-            kwargs[attr] = value
-            pos += offset
-        return self.patterns[cls]['unfold'](self.name, instance, **kwargs)
+        layout = meta['layout']
+        if layout is None:
+            raise InvalidPatternClassException(
+                cls, 'Columnar folding requires a fixed-size pattern.')
+        require_numpy()
+        for name, field in zip(meta['flat_names'], layout.fields):
+            if column_dtype(field) is None:
+                raise InvalidPatternClassException(
+                    cls, "'{}' ({}) has no numeric column type.".format(
+                        name, field.token))
+        return cls, layout, meta['flat_names']
+
+    def _write(self, writer, obj, meta, values):
+        '''Write the folded values to a BitWriter.'''
+        layout = meta['layout']
+        if layout is not None and layout.struct is not None:
+            try:
+                if writer.pack_into(layout.struct, values):
+                    return
+            except PACK_ERRORS:
+                pass
+        writer.write(*self._pack_int(obj, meta, values))
+
+    def _pack_int(self, obj, meta, values):
+        '''
+        Returns the folded values as an int, along with its width in bits.
+        '''
+        layout = meta['layout']
+        if layout is not None:
+            try:
+                return layout.pack(values), layout.size
+            except PACK_ERRORS:
+                pass
+        data = self._bitstring_pack(obj, meta, values)
+        return data.uint if data.len else 0, data.len
+
+    def _bitstring_pack(self, obj, meta, values):
+        try:
+            return meta['pack'](values)
+        except bitstring.CreationError as e:
+            raise FoldingException(obj, str(e))
+        except ValueError as e:
+            raise FoldingException(obj, str(e))
 
     def _get_cls_obj(self, cls_or_obj):
         # Instance
@@ -0,0 +1,114 @@
+'''
+Incremental unfolding of objects as their bytes arrive.
+'''
+from .crafter import Crafter
+from .exceptions import UnfoldingException
+from .parse import Cursor
+
+
+class FoldDecoder(object):
+    '''
+    Push parser for a stream of consecutive folded instances of one pattern
+    class, such as the bytes arriving on a non-blocking socket.  Each call to
+    `feed` takes the next chunk of bytes, of any size, and returns the list
+    of objects completed by it.  Objects may straddle chunks at any bit:
+
+        decoder = FoldDecoder(Action)
+        while True:
+            for action in decoder.feed(sock.recv(4096)):
+                ...
+
+    Only the bytes of the object still in progress are kept between calls,
+    along with the bit offset it starts at.  Fixed-size objects are only
+    decoded once they're complete.  Variable-size objects are parsed as
+    their bytes arrive, keeping the values read so far between calls: a run
+    of fixed-width values (including every element of a counted field) is
+    read once all of its bits have arrived, so no bit is read twice.  Only
+    exp-Golomb tokens (ue, se, uie, sie), whose length isn't known until
+    they're read, are tried again when a chunk ends partway through one.
+
+    See Crafter.unfold for `into`.
+    '''
+    def __init__(self, cls, crafter='global', into=None):
+        self.crafter = Crafter(crafter)
+        self.cls, instance = self.crafter._get_cls_obj(cls)
+        if instance is not None:
+            raise UnfoldingException(
+                cls, 'FoldDecoder requires a pattern class, not an instance.')
+        meta = self.crafter.patterns[self.cls]
+        self._layout = meta['layout']
+        self._build = self.crafter._unfolder(self.cls, into)
+        if self._layout is None:
+            self._steps = meta['steps']
+            if self._steps is None:
+                raise UnfoldingException(
+                    cls, 'A stream has no end for a token without a length '
+                    'to read to.')
+        self._buffer = bytearray()
+        self._offset = 0
+        # The parser of the object in progress, reading the buffer at the
+        # cursor, and the buffer length in bits it's waiting for
+        self._parser = None
+        self._cursor = Cursor(self._buffer)
+        self._wanted = 0
+
+    def __repr__(self):
+        return 'FoldDecoder({}, {!r})'.format(
+            self.cls.__name__, self.crafter.name)
+
+    @property
+    def pending(self):
+        '''Number of bits received that aren't part of a returned object.'''
+        return len(self._buffer) * 8 - self._offset
+
+    def feed(self, data):
+        '''
+        Append a bytes-like chunk and return a list of the objects that are
+        now complete, in order.
+        '''
+        self._buffer += data
+        if self._layout is not None:
+            layout = self._layout
+            n = self.pending // layout.size
+            if not n:
+                return []
+            records = layout.unpack_many(self._buffer, self._offset, n)
+            self._consume(n * layout.size)
+            build = self._build
+            return [build(values) for values in records]
+
+        objs, build = [], self._build
+        while len(self._buffer) * 8 >= self._wanted:
+            if self._parser is None:
+                if not self.pending:
+                    break
+                self._cursor.pos = self._offset
+                self._parser = self._cursor.parse(self._steps)
+            try:
+                need = next(self._parser)
+            except StopIteration as e:
+                self._parser, self._wanted = None, 0
+                self._consume(self._cursor.pos - self._offset)
+                objs.append(build(e.value))
+            else:
+                self._wanted = len(self._buffer) * 8 + need
+        return objs
+
+    def close(self):
+        '''
+        Signal the end of the stream.  Raises UnfoldingException if a byte
+        or more of an incomplete object was received; fewer bits are taken
+        to be padding.
+        '''
+        pending = self.pending
+        self._buffer, self._offset = bytearray(), 0
+        self._parser, self._wanted = None, 0
+        self._cursor = Cursor(self._buffer)
+        if pending >= 8:
+            raise UnfoldingException(
+                self.cls, 'Stream ended partway through an object.')
+
+    def _consume(self, bits):
+        consumed = self._offset + bits
+        del self._buffer[:consumed >> 3]
+        self._offset = consumed & 7
@@ -0,0 +1,93 @@
+'''
+Delta folding: only the flat values that differ from a baseline object.
+
+A delta is a presence bitmask with one bit per flat value of the pattern
+(nested patterns included, first value first), followed by each value whose
+bit is set, folded with its own format.
+'''
+from .packing import Layout, PACK_ERRORS, parse_token
+from .repeat import Repeat
+import bitstring
+
+
+def _slot_formats(segments):
+    '''Returns the format (a token or counted Repeat) of each flat value.'''
+    if isinstance(segments, str):
+        return [token.strip() for token in segments.split(',')]
+    formats = []
+    for segment in segments:
+        if isinstance(segment, Repeat):
+            formats.append(segment)
+        else:
+            formats.extend(_slot_formats(segment))
+    return formats
+
+
+def _packer(fmt):
+    '''
+    Returns a function that folds a single flat value, returning it as an
+    int along with its width in bits.
+    '''
+    if isinstance(fmt, Repeat):
+        def pack(value):
+            data = bitstring.BitStream().join(fmt.pack(value))
+            return data.uint if data.len else 0, data.len
+        return pack
+
+    def pack_bitstring(value):
+        data = bitstring.pack(fmt, value)
+        return data.uint, data.len
+
+    field = parse_token(fmt)
+    if field is None:
+        return pack_bitstring
+    layout = Layout([field])
+
+    def pack(value):
+        try:
+            return layout.pack([value]), layout.size
+        except PACK_ERRORS:
+            # Let bitstring coerce the value or report why it can't
+            return pack_bitstring(value)
+    return pack
+
+
+def _reader(fmt):
+    if isinstance(fmt, Repeat):
+        return fmt.read
+    return lambda data: data.read(fmt)
+
+
+class Delta(object):
+    '''Folds and unfolds deltas of one pattern class.'''
+    def __init__(self, crafter, cls):
+        meta = crafter.patterns[cls]
+        formats = _slot_formats(meta['segments'])
+        self.count = len(formats)
+        self.mask_token = 'uint:{}'.format(self.count)
+        self.packers = [_packer(fmt) for fmt in formats]
+        self.readers = [_reader(fmt) for fmt in formats]
+
+    def changes(self, values, baseline):
+        '''Returns the presence mask and the ints and widths to write.'''
+        mask, packed = 0, []
+        for value, base, pack in zip(values, baseline, self.packers):
+            mask <<= 1
+            if value != base:
+                mask |= 1
+                packed.append(pack(value))
+        return mask, packed
+
+    def apply(self, data, baseline):
+        '''
+        Reads a delta from a BitString and returns the baseline's flat
+        values with the changed ones replaced.
+        '''
+        values = list(baseline)
+        mask = data.read(self.mask_token)
+        bit = 1 << self.count
+        for i, read in enumerate(self.readers):
+            bit >>= 1
+            if mask & bit:
+                values[i] = read(data)
+        return values
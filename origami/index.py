@@ -0,0 +1,237 @@
+'''
+Secondary indexes over the fields of a RecordFile.
+'''
+from .compiler import resolve_field
+from .exceptions import InvalidFoldFormatException, UnfoldingException
+from .packing import BitWriter, Field, Layout, iter_records, read_bits
+import bisect
+import os
+import struct
+
+# Records covered, the record file's stamp, entry size in bits, index
+# kind, and the length of the signature that follows it
+_header = struct.Struct('>QQQcI')
+_kinds = {'sorted': b's', 'hash': b'h'}
+
+
+class RecordIndex(object):
+    '''
+    An index from the values of one or more fields of the records in a
+    RecordFile to the positions of the records holding them.  Keys are
+    folded values (creases are not applied); with one field the key is its
+    value, with several it's a tuple of their values in order.
+
+    kind is 'sorted' (supporting lookups and range queries) or 'hash'
+    (lookups only).  If path is given the index is saved there, and loaded
+    from there when it already exists; records appended since it was saved
+    are indexed as it loads, and it's rebuilt if any record has been
+    overwritten since.  The index is kept up to date as records are
+    appended to or overwritten in the file it was created from, and saved
+    when that file is flushed or closed.
+    '''
+    def __init__(self, records, fields, kind='sorted', path=None):
+        if kind not in _kinds:
+            raise ValueError("kind must be 'sorted' or 'hash'")
+        if isinstance(fields, str):
+            fields = (fields,)
+        self.records = records
+        self.fields = tuple(fields)
+        self.kind = kind
+        self.path = path
+
+        crafter, cls = records.crafter, records.cls
+        layout = crafter.patterns[cls]['layout']
+        indices = []
+        for name in self.fields:
+            start, _, _, subcls = resolve_field(crafter, cls, name)
+            if subcls is not None:
+                raise InvalidFoldFormatException(
+                    name, 'Index keys must name a single field, not a pattern.')
+            indices.append(start)
+        self._unpack_key = layout.unpacker(indices)
+        # Entries on disk are the key's fields followed by the position
+        fields, offset = [], 0
+        for i in indices:
+            fields.append(Field(layout.fields[i].kind,
+                                layout.fields[i].length, offset))
+            offset += layout.fields[i].length
+        fields.append(Field('uint', 64, offset))
+        self._entry = Layout(fields)
+        self._single = len(self.fields) == 1
+        # Identifies the record format and the key's fields within it, so a
+        # saved index is only reused for the same fields of the same records
+        self._signature = '{};{};{}'.format(
+            records.size,
+            ','.join(field.token for field in layout.fields),
+            ','.join('{}:{}'.format(layout.fields[i].offset,
+                                    layout.fields[i].token)
+                     for i in indices)).encode('ascii')
+
+        self._keys, self._positions, self._table = [], [], {}
+        self._count = 0
+        self._dirty = False
+        if path is not None and os.path.exists(path):
+            self._load()
+        if self._count < len(records):
+            self._build(self._count)
+            self.save()
+
+    def __repr__(self):
+        return 'RecordIndex({}, {!r}, {!r})'.format(
+            self.records.cls.__name__, self.fields, self.kind)
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, key, instances=False):
+        '''
+        Returns the positions of the records whose key equals `key` in
+        ascending order, or the unfolded records if instances is True.
+        '''
+        if self.kind == 'hash':
+            positions = list(self._table.get(key, ()))
+        else:
+            lo = bisect.bisect_left(self._keys, key)
+            hi = bisect.bisect_right(self._keys, key, lo)
+            positions = self._positions[lo:hi]
+        return self._result(positions, instances)
+
+    def range(self, low=None, high=None, instances=False):
+        '''
+        Returns the positions of the records with low <= key < high in key
+        order, or the unfolded records if instances is True.  Either bound
+        may be None.  Tuple keys compare element by element, so a shorter
+        tuple bounds by a prefix: range((3,), (4,)) finds every key whose
+        first field is 3.  Only sorted indexes support range queries.
+        '''
+        if self.kind != 'sorted':
+            raise ValueError('Range queries require a sorted index.')
+        lo = 0 if low is None else bisect.bisect_left(self._keys, low)
+        hi = len(self._keys) if high is None else \
+            bisect.bisect_left(self._keys, high, lo)
+        return self._result(self._positions[lo:hi], instances)
+
+    def save(self):
+        '''
+        Write the index to its path, if it has one and has changed since it
+        was loaded or last saved.
+        '''
+        if self.path is None or not self._dirty:
+            return
+        if self.kind == 'sorted':
+            entries = zip(self._keys, self._positions)
+        else:
+            entries = ((key, position)
+                       for key, positions in self._table.items()
+                       for position in positions)
+        size = self._entry.size
+        writer = BitWriter((self._count * size + 7) >> 3)
+        pack = self._entry.pack
+        for key, position in entries:
+            values = [key] if self._single else list(key)
+            values.append(position)
+            writer.write(pack(values), size)
+        with open(self.path, 'wb') as f:
+            f.write(_header.pack(self._count, self.records.stamp, size,
+                                 _kinds[self.kind], len(self._signature)))
+            f.write(self._signature)
+            f.write(writer.getvalue().tobytes())
+        self._dirty = False
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        try:
+            count, stamp, size, kind, length = _header.unpack_from(data)
+        except struct.error:
+            raise UnfoldingException(self.path, 'Not an index file.')
+        start = _header.size + length
+        signature = data[_header.size:start]
+        if signature != self._signature or size != self._entry.size or \
+                kind != _kinds[self.kind] or count > len(self.records) or \
+                stamp != self.records.stamp or \
+                len(data) < start + (count * size + 7) // 8:
+            # Built for other fields, for a different file, or before records
+            # were overwritten without it; rebuild
+            return
+        unpack, single = self._entry.unpack, self._single
+        entries = iter_records(data, size, count, start * 8)
+        for x in entries:
+            values = unpack(x)
+            key = values[0] if single else tuple(values[:-1])
+            if self.kind == 'sorted':
+                self._keys.append(key)
+                self._positions.append(values[-1])
+            else:
+                self._table.setdefault(key, []).append(values[-1])
+        self._count = count
+
+    def _build(self, start):
+        '''Index the records from position `start` to the end of the file.'''
+        records = self.records
+        count = len(records) - start
+        xs = iter_records(records._mmap, records.size, count,
+                          records._offset(start))
+        key = self._key
+        entries = [(key(x), start + i) for i, x in enumerate(xs)]
+        if self.kind == 'sorted':
+            if start:
+                entries.extend(zip(self._keys, self._positions))
+            entries.sort()
+            self._keys = [key for key, _ in entries]
+            self._positions = [position for _, position in entries]
+        else:
+            for key, position in entries:
+                self._table.setdefault(key, []).append(position)
+        self._count = len(records)
+        self._dirty = True
+
+    def _key(self, x):
+        values = self._unpack_key(x)
+        return values[0] if self._single else tuple(values)
+
+    def _key_at(self, position):
+        records = self.records
+        return self._key(read_bits(
+            records._mmap, records._offset(position), records.size))
+
+    def _insert(self, key, position):
+        if self.kind == 'hash':
+            bisect.insort(self._table.setdefault(key, []), position)
+            return
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        i = bisect.bisect_left(self._positions, position, lo, hi)
+        self._keys.insert(i, key)
+        self._positions.insert(i, position)
+
+    def _remove(self, key, position):
+        if self.kind == 'hash':
+            positions = self._table[key]
+            positions.remove(position)
+            if not positions:
+                del self._table[key]
+            return
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        i = bisect.bisect_left(self._positions, position, lo, hi)
+        del self._keys[i]
+        del self._positions[i]
+
+    def _appended(self, position):
+        '''Called by the record file after it appends a record.'''
+        self._insert(self._key_at(position), position)
+        self._count += 1
+        self._dirty = True
+
+    def _replaced(self, position, old_key):
+        '''Called by the record file after it overwrites a record.'''
+        self._remove(old_key, position)
+        self._insert(self._key_at(position), position)
+        self._dirty = True
+
+    def _result(self, positions, instances):
+        if not instances:
+            return positions
+        records = self.records
+        return [records[position] for position in positions]
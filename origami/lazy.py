@@ -0,0 +1,111 @@
+'''
+Lazy views over folded fixed-size patterns.
+
+A view holds a buffer and the bit offset of a folded object in it.  Each
+attribute is decoded from its precomputed offset the first time it's read,
+then cached on the view, so later reads are plain attribute lookups.
+'''
+from .compiler import _crease_for, _width
+from .packing import Field, Layout, read_bits
+from .repeat import Repeat, builder
+
+
+class LazyView(object):
+    '''
+    Base class of generated views.  `_decoders` maps each fold name to a
+    function of (buffer, bit_offset) returning the attribute's value.
+    '''
+    __slots__ = ('_buffer', '_offset', '__dict__')
+    _decoders = {}
+    _crafter = None
+    _cls = None
+
+    def __init__(self, buffer, bit_offset):
+        self._buffer = buffer
+        self._offset = bit_offset
+
+    def __getattr__(self, name):
+        # Only called when name isn't cached in __dict__ yet
+        try:
+            decode = self._decoders[name]
+        except KeyError:
+            raise AttributeError(name)
+        value = self.__dict__[name] = decode(self._buffer, self._offset)
+        return value
+
+    def __repr__(self):
+        return '<lazy {} at bit {}>'.format(self._cls.__name__, self._offset)
+
+    def _unfold(self):
+        '''Unfold every attribute into a new instance of the pattern class.'''
+        meta = self._crafter.patterns[self._cls]
+        layout = meta['layout']
+        x = read_bits(self._buffer, self._offset, layout.size)
+        return meta['expand'](layout.unpack(x), None)
+
+
+def _primitive_decoder(field, crease):
+    unpack = Layout([Field(field.kind, field.length, 0)]).unpack
+    offset, length = field.offset, field.length
+    if crease is None:
+        def decode(buffer, bit_offset):
+            return unpack(read_bits(buffer, bit_offset + offset, length))[0]
+    else:
+        def decode(buffer, bit_offset):
+            value = unpack(read_bits(buffer, bit_offset + offset, length))[0]
+            return crease(value)
+    return decode
+
+
+def _repeat_decoder(fields, build):
+    first = fields[0].offset
+    layout = Layout([Field(field.kind, field.length, field.offset - first)
+                     for field in fields])
+
+    def decode(buffer, bit_offset):
+        x = read_bits(buffer, bit_offset + first, layout.size)
+        return build(layout.unpack(x))
+    return decode
+
+
+def _nested_decoder(view_cls, offset):
+    def decode(buffer, bit_offset):
+        return view_cls(buffer, bit_offset + offset)
+    return decode
+
+
+def view_class(crafter, cls):
+    '''
+    Returns the LazyView subclass for a fixed-size pattern, generating it
+    the first time it's needed.  Nested patterns use their own view class.
+    '''
+    meta = crafter.patterns[cls]
+    if meta.get('view') is not None:
+        return meta['view']
+    fields = meta['layout'].fields
+    decoders, index = {}, 0
+    for attr, fmt in meta['folds']:
+        if isinstance(fmt, str):
+            crease = _crease_for(meta, attr, fmt, 'unfold')
+            decoders[attr] = _primitive_decoder(fields[index], crease)
+            index += 1
+        elif isinstance(fmt, Repeat):
+            # Fixed-size patterns only have repeats with a fixed count
+            width = _width(crafter, fmt)
+            crease = _crease_for(meta, attr, fmt, 'unfold')
+            build = builder(crafter, fmt, crease)
+            decoders[attr] = _repeat_decoder(
+                fields[index:index + width], build)
+            index += width
+        else:
+            nested = view_class(crafter, fmt)
+            decoders[attr] = _nested_decoder(nested, fields[index].offset)
+            index += crafter.patterns[fmt]['flat_count']
+    namespace = {
+        '__slots__': (),
+        '_decoders': decoders,
+        '_crafter': crafter,
+        '_cls': cls
+    }
+    meta['view'] = type('Lazy' + cls.__name__, (LazyView,), namespace)
+    return meta['view']
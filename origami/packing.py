@@ -0,0 +1,422 @@
+'''
+Native bit packing for fixed-width bitstring formats.
+
+A Layout precomputes the bit offset and width of every token in a pattern's
+bitstring format, and generates functions that pack a flat list of values
+into a single int (and back) using shifts and masks.  Packing produces the
+same bits that bitstring.pack would for the same values.
+'''
+import bitstring
+import math
+import operator
+import re
+import struct
+import sys
+
+_token_re = re.compile(r'^(?P<name>\w+)(:(?P<length>\d+))?$')
+
+_ints = {
+    'uint': 'big', 'uintbe': 'big', 'uintle': 'little', 'uintne': sys.byteorder,
+    'int': 'big', 'intbe': 'big', 'intle': 'little', 'intne': sys.byteorder
+}
+_floats = {
+    'float': '>', 'floatbe': '>', 'floatle': '<',
+    'floatne': '<' if sys.byteorder == 'little' else '>'
+}
+_whole_byte = {'uintbe', 'uintle', 'uintne', 'intbe', 'intle', 'intne'}
+_strings = {'hex': ('x', 4, 16), 'oct': ('o', 3, 8), 'bin': ('b', 1, 2)}
+_struct_ints = {8: 'b', 16: 'h', 32: 'i', 64: 'q'}
+_struct_floats = {32: 'f', 64: 'd'}
+
+
+class _Fallback(ValueError):
+    '''Raised when a value can't be packed natively.'''
+    pass
+
+# Errors that mean "let bitstring.pack handle (or reject) these values"
+PACK_ERRORS = (_Fallback, TypeError, ValueError, OverflowError,
+               KeyError, AttributeError, struct.error)
+
+_bools = {True: 1, False: 0, 'True': 1, 'False': 0, '1': 1, '0': 0}
+
+# Exp-Golomb tokens: variable width, but each reads to a known end
+GOLOMB_TOKENS = ('ue', 'se', 'uie', 'sie')
+
+
+def _string_packer(digits, base):
+    def pack(value):
+        if len(value) != digits or not (value.isascii() and value.isalnum()):
+            raise _Fallback(value)
+        return int(value, base)
+    return pack
+
+
+def _bits_packer(length):
+    def pack(value):
+        if isinstance(value, bitstring.Bits) and value.len == length:
+            return value.uint
+        if isinstance(value, (bytes, bytearray)) and len(value) * 8 == length:
+            return int.from_bytes(value, 'big')
+        raise _Fallback(value)
+    return pack
+
+
+def _bits_unpacker(length):
+    def unpack(value):
+        return bitstring.BitStream(uint=value, length=length)
+    return unpack
+
+
+class Field(object):
+    '''A single fixed-width token at a known bit offset.'''
+    def __init__(self, kind, length, offset):
+        self.kind = kind
+        self.length = length
+        self.offset = offset
+
+    def __repr__(self):
+        return 'Field({!r}, {}, {})'.format(self.kind, self.length, self.offset)
+
+    @property
+    def token(self):
+        if self.kind == 'bool':
+            return 'bool'
+        return '{}:{}'.format(self.kind, self.length)
+
+
+def parse_token(token, offset=0):
+    '''
+    Returns a Field for a fixed-width bitstring token, or None if the token
+    has no static width (ue, se, uie, sie, hex/oct/bin/bits without a length)
+    or a width that bitstring would reject.
+    '''
+    match = _token_re.match(token.strip())
+    if not match:
+        return None
+    kind, length = match.group('name'), match.group('length')
+    if length is None:
+        return Field(kind, 1, offset) if kind == 'bool' else None
+    length = int(length)
+    if length <= 0:
+        return None
+    if kind in _ints:
+        if kind in _whole_byte and length % 8:
+            return None
+    elif kind in _floats:
+        if length not in (32, 64):
+            return None
+    elif kind in _strings:
+        if length % _strings[kind][1]:
+            return None
+    elif kind != 'bits':
+        return None
+    return Field(kind, length, offset)
+
+
+def struct_format(fields):
+    '''
+    Returns the struct format equivalent to a list of Fields, or None if
+    they don't map exactly onto struct codes.  That requires every field to
+    be a whole-byte int (8, 16, 32 or 64 bits) or float (32 or 64 bits), and
+    all multi-byte fields to share one byte order.
+    '''
+    order, codes = None, []
+    for field in fields:
+        kind, n = field.kind, field.length
+        if kind in _ints and n in _struct_ints:
+            code = _struct_ints[n]
+            if kind.startswith('u'):
+                code = code.upper()
+            field_order = _ints[kind]
+        elif kind in _floats and n in _struct_floats:
+            code = _struct_floats[n]
+            field_order = 'big' if _floats[kind] == '>' else 'little'
+        else:
+            return None
+        if n > 8:
+            if order not in (None, field_order):
+                return None
+            order = field_order
+        codes.append(code)
+    return ('<' if order == 'little' else '>') + ''.join(codes)
+
+
+class Layout(object):
+    '''
+    Bit layout of a fixed-width bitstring format.  `size` is the total
+    width in bits.  `pack` takes a flat list of values and returns them
+    packed into an int of `size` bits; `unpack` reverses it.  When the
+    layout is byte-aligned and maps onto struct codes, `struct` is the
+    equivalent struct.Struct (otherwise None).
+    '''
+    def __init__(self, fields):
+        self.fields = fields
+        self.size = sum(field.length for field in fields)
+        self.token = 'uint:{}'.format(self.size)
+        self.pack = _compile_pack(self)
+        self.unpack = _compile_unpack(self)
+        fmt = struct_format(fields)
+        self.struct = struct.Struct(fmt) if fmt else None
+        self.bytes_token = 'bytes:{}'.format(self.size // 8)
+
+    def __repr__(self):
+        return 'Layout({!r})'.format(self.fields)
+
+    @classmethod
+    def from_format(cls, bitstring_format):
+        '''Returns a Layout, or None if any token isn't fixed-width.'''
+        fields, offset = [], 0
+        for token in bitstring_format.split(','):
+            field = parse_token(token, offset)
+            if field is None:
+                return None
+            fields.append(field)
+            offset += field.length
+        return cls(fields)
+
+    def unpacker(self, indices):
+        '''
+        Returns a function like `unpack` that only extracts the fields at
+        the given indices, returning their values in the same order.
+        '''
+        return _compile_unpack(self, [self.fields[i] for i in indices])
+
+    def unpack_many(self, data, bit_offset, count):
+        '''
+        Returns a list of the unpacked values of `count` records stored
+        back-to-back in the bytes-like `data`, starting `bit_offset` bits in.
+        '''
+        if self.struct is not None and not bit_offset & 7:
+            start = bit_offset >> 3
+            end = start + count * self.struct.size
+            with memoryview(data)[start:end] as view:
+                return list(self.struct.iter_unpack(view))
+        unpack = self.unpack
+        return [unpack(x)
+                for x in iter_records(data, self.size, count, bit_offset)]
+
+    def shift(self, field):
+        '''Distance from the field's least significant bit to bit 0.'''
+        return self.size - field.offset - field.length
+
+
+def _compile_pack(layout):
+    namespace = {'_Fallback': _Fallback, '_bools': _bools,
+                 '_index': operator.index}
+    lines = ['def pack(values):']
+    names = ['v{}'.format(i) for i in range(len(layout.fields))]
+    lines.append('    {}, = values'.format(', '.join(names)))
+    terms = []
+    for i, (v, field) in enumerate(zip(names, layout.fields)):
+        kind, n = field.kind, field.length
+        limit, half, mask = 1 << n, 1 << (n - 1), (1 << n) - 1
+        if kind in _ints:
+            # Fixed-width ints such as NumPy scalars would overflow in their
+            # own type when shifted, so pack the int they stand for
+            lines.append('    {0} = _index({0})'.format(v))
+            if kind.startswith('u'):
+                check = '0 <= {} < {}'.format(v, limit)
+                term = v
+            else:
+                check = '{} <= {} < {}'.format(-half, v, half)
+                term = '({} & {})'.format(v, mask)
+            lines.append('    if not {}: raise _Fallback({})'.format(check, v))
+            if _ints[kind] == 'little' and n > 8:
+                term = "int.from_bytes({}.to_bytes({}, 'little'), 'big')".format(
+                    term, n // 8)
+        elif kind in _floats:
+            fn = '_f{}'.format(i)
+            namespace[fn] = struct.Struct(
+                _floats[kind] + ('f' if n == 32 else 'd')).pack
+            term = "int.from_bytes({}({}), 'big')".format(fn, v)
+        elif kind == 'bool':
+            term = '_bools[{}]'.format(v)
+        else:
+            fn = '_s{}'.format(i)
+            if kind == 'bits':
+                namespace[fn] = _bits_packer(n)
+            else:
+                _, bits, base = _strings[kind]
+                namespace[fn] = _string_packer(n // bits, base)
+            term = '{}({})'.format(fn, v)
+        shift = layout.shift(field)
+        terms.append('{} << {}'.format(term, shift) if shift else term)
+    # A lone uint term is returned as-is, so make sure it's really an int
+    if len(terms) == 1:
+        terms.append('0')
+    lines.append('    return ' + ' | '.join(terms))
+    exec(compile('\n'.join(lines) + '\n', '<origami pack>', 'exec'), namespace)
+    return namespace['pack']
+
+
+def _compile_unpack(layout, fields=None):
+    namespace = {}
+    lines = ['def unpack(x):']
+    names = []
+    if fields is None:
+        fields = layout.fields
+    for i, field in enumerate(fields):
+        kind, n = field.kind, field.length
+        half, mask = 1 << (n - 1), (1 << n) - 1
+        shift = layout.shift(field)
+        raw = '(x >> {} & {})'.format(shift, mask) if shift else \
+            '(x & {})'.format(mask)
+        v = 'v{}'.format(i)
+        if kind in _ints:
+            signed = not kind.startswith('u')
+            if _ints[kind] == 'little' and n > 8:
+                lines.append(
+                    "    {} = int.from_bytes({}.to_bytes({}, 'big'), "
+                    "'little', signed={})".format(v, raw, n // 8, signed))
+            else:
+                lines.append('    {} = {}'.format(v, raw))
+                if signed:
+                    lines.append('    if {0} >= {1}: {0} -= {2}'.format(
+                        v, half, 1 << n))
+        elif kind in _floats:
+            fn = '_f{}'.format(i)
+            namespace[fn] = struct.Struct(
+                _floats[kind] + ('f' if n == 32 else 'd')).unpack
+            lines.append("    {} = {}({}.to_bytes({}, 'big'))[0]".format(
+                v, fn, raw, n // 8))
+        elif kind == 'bool':
+            lines.append('    {} = {} == 1'.format(v, raw))
+        elif kind == 'bits':
+            fn = '_s{}'.format(i)
+            namespace[fn] = _bits_unpacker(n)
+            lines.append('    {} = {}({})'.format(v, fn, raw))
+        else:
+            char, bits, _ = _strings[kind]
+            lines.append("    {} = format({}, '0{}{}')".format(
+                v, raw, n // bits, char))
+        names.append(v)
+    lines.append('    return [{}]'.format(', '.join(names)))
+    exec(compile('\n'.join(lines) + '\n', '<origami unpack>', 'exec'),
+         namespace)
+    return namespace['unpack']
+
+
+class BitWriter(object):
+    '''
+    Appends runs of bits to a bytearray, writing whole bytes as soon as they
+    fill.  If the total size is known up front, pass it in bytes so that the
+    buffer is allocated once; otherwise the buffer grows as needed.
+    '''
+    def __init__(self, size=0):
+        self.buffer = bytearray(size)
+        self.index = 0
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value, length):
+        '''Append the low `length` bits of the int `value`.'''
+        acc = self.acc << length | value
+        bits = self.bits + length
+        if bits >= 8:
+            rem = bits & 7
+            n = bits >> 3
+            end = self.index + n
+            self.buffer[self.index:end] = (acc >> rem).to_bytes(n, 'big')
+            self.index = end
+            acc &= (1 << rem) - 1
+            bits = rem
+        self.acc, self.bits = acc, bits
+
+    def pack_into(self, packer, values):
+        '''
+        Append a byte-aligned record with a struct.Struct, straight into the
+        buffer.  Returns False (without writing) if the writer isn't on a
+        byte boundary or the buffer wasn't allocated large enough.
+        '''
+        end = self.index + packer.size
+        if self.bits or end > len(self.buffer):
+            return False
+        packer.pack_into(self.buffer, self.index, *values)
+        self.index = end
+        return True
+
+    @property
+    def length(self):
+        '''Number of bits written so far.'''
+        return self.index * 8 + self.bits
+
+    def getvalue(self):
+        '''Returns everything written as a BitStream.'''
+        data = self.buffer[:self.index]
+        if self.bits:
+            data.append(self.acc << (8 - self.bits))
+        return bitstring.BitStream(bytes=bytes(data), length=self.length)
+
+
+def iter_records(data, size, count, bit_offset=0):
+    '''
+    Yields `count` ints of `size` bits each, read back-to-back from the
+    bytes-like `data` starting `bit_offset` bits in.  Records are decoded a
+    group at a time, where a group is the smallest run of records that spans
+    a whole number of bytes.
+    '''
+    group = 8 // math.gcd(size, 8)
+    group_bytes = size * group // 8
+    lead = bit_offset & 7
+    window = group_bytes + (1 if lead else 0)
+    mask = (1 << size) - 1
+    shifts = [window * 8 - lead - size * (i + 1) for i in range(group)]
+    from_bytes = int.from_bytes
+    first, last = bit_offset >> 3, (bit_offset + count * size + 7) >> 3
+    for start in range(first, last, group_bytes):
+        chunk = data[start:start + window]
+        x = from_bytes(chunk, 'big') << (8 * (window - len(chunk)))
+        for shift in shifts:
+            if not count:
+                return
+            count -= 1
+            yield x >> shift & mask
+
+
+_overrun = '{} {} bits at offset {} overruns buffer of {} bytes.'
+
+
+def read_bits(buffer, bit_offset, length):
+    '''
+    Returns the `length` bits starting `bit_offset` bits into a bytes-like
+    buffer as an unsigned int.  Only the bytes spanned by the bits are read.
+    '''
+    start = bit_offset >> 3
+    end = (bit_offset + length + 7) >> 3
+    if bit_offset < 0 or end > len(buffer):
+        raise IndexError(_overrun.format(
+            'Reading', length, bit_offset, len(buffer)))
+    x = int.from_bytes(buffer[start:end], 'big')
+    return x >> ((end << 3) - bit_offset - length) & ((1 << length) - 1)
+
+
+def write_bits(buffer, bit_offset, length, value):
+    '''
+    Writes the low `length` bits of the int `value` into a writable
+    bytes-like buffer, starting `bit_offset` bits in.  Bits outside the
+    written range keep their current values.
+    '''
+    start = bit_offset >> 3
+    end = (bit_offset + length + 7) >> 3
+    if bit_offset < 0 or end > len(buffer):
+        raise IndexError(_overrun.format(
+            'Writing', length, bit_offset, len(buffer)))
+    trail = (end << 3) - bit_offset - length
+    if trail or bit_offset & 7:
+        mask = ((1 << length) - 1) << trail
+        x = int.from_bytes(buffer[start:end], 'big')
+        value = x & ~mask | value << trail
+    buffer[start:end] = value.to_bytes(end - start, 'big')
+
+
+def byte_view(buffer):
+    '''
+    Returns buffer itself if it's indexed by byte, otherwise a byte-indexed
+    memoryview of it (for example, of an array.array or a cast memoryview).
+    '''
+    if isinstance(buffer, (bytes, bytearray)):
+        return buffer
+    view = memoryview(buffer)
+    if view.format == 'B' and view.ndim == 1:
+        return buffer
+    return view.cast('B')
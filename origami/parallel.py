@@ -0,0 +1,163 @@
+'''
+Folding and unfolding in a pool of worker processes.
+
+Worker processes don't share the parent's Crafters: unless they're forked,
+they start with only the patterns learned when their classes' modules are
+imported.  So each task carries a description of the patterns it uses, and
+a worker learns any it doesn't already know before starting.  A pattern is
+described by its class, pickled by reference (so it must be importable from
+its module), and the folds, creases and unfold function it was learned
+with.  Unfold functions made by `pattern` and `record` are made again by the
+worker.  Creases and unfold functions defined at module level can be
+pickled; lambdas and closures can't, so patterns using them can't be folded
+or unfolded in parallel.  That's checked before any worker is started.
+'''
+from .exceptions import InvalidPatternClassException
+from .repeat import Repeat
+import bitstring
+import concurrent.futures
+import pickle
+
+_PICKLE_ERRORS = (pickle.PicklingError, AttributeError, TypeError)
+
+
+def describe(crafter, classes):
+    '''
+    Returns a picklable description of the patterns a Crafter has learned
+    that workers need for `classes`: those classes and the patterns nested
+    in them, in the order learned, so nested patterns come before their
+    users.  Raises InvalidPatternClassException if one can't be described.
+    '''
+    needed = set()
+    for cls in classes:
+        _add_nested(crafter, cls, needed)
+    return [_describe(cls, meta) for cls, meta in crafter.patterns.items()
+            if cls in needed]
+
+
+def _add_nested(crafter, cls, needed):
+    if cls in needed or cls not in crafter.patterns:
+        return
+    needed.add(cls)
+    for _, fold in crafter.patterns[cls]['folds']:
+        if isinstance(fold, Repeat):
+            fold = fold.fmt
+        if not isinstance(fold, str):
+            _add_nested(crafter, fold, needed)
+
+
+def _describe(cls, meta):
+    try:
+        cls_data = pickle.dumps(cls)
+    except _PICKLE_ERRORS as e:
+        raise InvalidPatternClassException(
+            cls, "Worker processes can't be sent it, as the class can't be "
+                 "pickled ({}).".format(e))
+    unfold = meta['unfold']
+    construct = getattr(unfold, 'construct', None)
+    if construct is not None:
+        unfold = None
+    folds, creases = meta['description']
+    parts = [('unfold function', unfold),
+             ('constructor', meta['constructor']), ('folds', folds)]
+    parts.extend(("crease '{}'".format(name), crease)
+                 for name, crease in (creases or {}).items())
+    for part, value in parts:
+        try:
+            pickle.dumps(value)
+        except _PICKLE_ERRORS as e:
+            raise InvalidPatternClassException(
+                cls, "Worker processes can't learn it, as its {} can't be "
+                     "pickled ({}).".format(part, e))
+    source = pickle.dumps(
+        (unfold, construct, folds, creases, meta['constructor']))
+    return cls_data, source
+
+
+def _learn(name, entries):
+    '''Returns the named Crafter, having learned any described pattern.'''
+    from . import Crafter, _unfold_method
+    crafter = Crafter(name)
+    for cls_data, source in entries:
+        cls = pickle.loads(cls_data)
+        if cls in crafter.patterns:
+            continue
+        unfold, construct, folds, creases, constructor = pickle.loads(source)
+        if unfold is None:
+            unfold = _unfold_method(construct).__get__(None, cls)
+        crafter.learn_pattern(cls, unfold, folds, creases, constructor)
+    return crafter
+
+
+def _unfold_shard(name, entries, cls, into, data, bit_offset, count):
+    crafter = _learn(name, entries)
+    layout = crafter.patterns[cls]['layout']
+    build = crafter._unfolder(cls, into)
+    return [build(values)
+            for values in layout.unpack_many(data, bit_offset, count)]
+
+
+def _fold_shard(name, entries, objs):
+    data = _learn(name, entries).fold_many(objs)
+    return data.tobytes(), data.len
+
+
+def _shards(count, workers, step=1):
+    '''
+    Splits `count` items into (start, count) runs, one per worker, each
+    but the last a multiple of `step` items long.
+    '''
+    size = -(-count // workers)
+    size = max(-(-size // step) * step, step)
+    return [(start, min(size, count - start))
+            for start in range(0, count, size)]
+
+
+def _check_workers(workers):
+    if workers < 1:
+        raise ValueError('workers must be at least 1')
+
+
+def unfold_many(crafter, cls, into, buffer, bit_offset, count, workers):
+    '''
+    Unfold `count` records of a fixed-size pattern from a bytes-like buffer,
+    starting `bit_offset` bits in, in `workers` processes.  Each worker is
+    sent a copy of only the bytes spanned by its records.
+    '''
+    _check_workers(workers)
+    layout = crafter.patterns[cls]['layout']
+    if layout is None:
+        raise InvalidPatternClassException(
+            cls, 'Parallel unfolding requires a fixed-size pattern.')
+    size, entries = layout.size, describe(crafter, [cls])
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = []
+        for start, n in _shards(count, workers):
+            first = bit_offset + start * size
+            end = (first + n * size + 7) >> 3
+            futures.append(executor.submit(
+                _unfold_shard, crafter.name, entries, cls, into,
+                bytes(buffer[first >> 3:end]), first & 7, n))
+        objs = []
+        for future in futures:
+            objs.extend(future.result())
+    return objs
+
+
+def fold_many(crafter, objs, workers):
+    '''
+    Fold a sequence of objects back-to-back in `workers` processes, each
+    folding a contiguous run of them, and join the results.
+    '''
+    _check_workers(workers)
+    entries = describe(crafter, {obj.__class__ for obj in objs})
+    # Runs of a multiple of 8 fixed-size objects fill whole bytes
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_fold_shard, crafter.name, entries,
+                                   objs[start:start + n])
+                   for start, n in _shards(len(objs), workers, 8)]
+        parts = [future.result() for future in futures]
+    if all(not length & 7 for _, length in parts):
+        return bitstring.BitStream(bytes=b''.join(data for data, _ in parts))
+    return bitstring.BitStream().join(
+        bitstring.Bits(bytes=data, length=length) for data, length in parts)
@@ -0,0 +1,169 @@
+'''
+Resumable parsing of variable-size patterns.
+
+A variable-size pattern is read in steps: ('fixed', layout) for a run of
+fixed-width tokens, ('token', token) for an exp-Golomb token, and ('repeat',
+count layout, kind, element) for a counted field.  kind is 'tokens' or
+'records' for elements of a fixed-width token or pattern (element is its
+Layout), 'token' for an exp-Golomb token, and 'pattern' for a variable-size
+pattern (element is its steps).
+
+A Cursor reads steps from a bytes-like buffer as a generator.  When the
+buffer ends too soon, it yields how many more bits it needs at least, and
+carries on from where it stopped once they've been appended.  A run of
+fixed-width values (including every element of a counted field) is read
+once all of its bits are there, so no bit is read twice, except those of an
+exp-Golomb token (ue, se, uie, sie), whose length isn't known until it's
+read.  Those are tried again as bits arrive.
+'''
+from .packing import GOLOMB_TOKENS, Layout, parse_token
+from .repeat import Repeat
+import bitstring
+
+# Bits first tried for an exp-Golomb token, doubled until it fits
+_window = 256
+
+
+class _Unbounded(Exception):
+    '''Raised for a token that reads to the end of the data.'''
+    pass
+
+
+def compile_steps(crafter, cls):
+    '''
+    Returns the steps of a variable-size pattern, or None if it has a token
+    without a known end (such as hex without a length), which can only be
+    read by bitstring.
+    '''
+    try:
+        return _steps(crafter, crafter.patterns[cls]['segments'])
+    except _Unbounded:
+        return None
+
+
+def _steps(crafter, segments):
+    if isinstance(segments, str):
+        segments = [segments]
+    steps, run = [], []
+    for segment in segments:
+        if isinstance(segment, Repeat):
+            if run:
+                steps.append(('fixed', Layout.from_format(','.join(run))))
+                run = []
+            steps.append(_repeat_step(crafter, segment))
+            continue
+        for token in segment.split(','):
+            token = token.strip()
+            if parse_token(token) is not None:
+                run.append(token)
+                continue
+            if run:
+                steps.append(('fixed', Layout.from_format(','.join(run))))
+                run = []
+            steps.append(('token', _golomb_token(token)))
+    if run:
+        steps.append(('fixed', Layout.from_format(','.join(run))))
+    return steps
+
+
+def _repeat_step(crafter, repeat):
+    count = Layout.from_format('uint:{}'.format(repeat.width))
+    if repeat.token is not None:
+        layout = Layout.from_format(repeat.token)
+        if layout is None:
+            return ('repeat', count, 'token', _golomb_token(repeat.token))
+        return ('repeat', count, 'tokens', layout)
+    meta = crafter.patterns[repeat.fmt]
+    if meta['layout'] is not None:
+        return ('repeat', count, 'records', meta['layout'])
+    return ('repeat', count, 'pattern', _steps(crafter, meta['segments']))
+
+
+def _golomb_token(token):
+    if token not in GOLOMB_TOKENS:
+        raise _Unbounded(token)
+    return token
+
+
+def read(steps, buffer, bit_offset):
+    '''
+    Returns the flat values of the object starting `bit_offset` bits into a
+    bytes-like buffer, and the bit offset just past it.  Only the bits of
+    the object are read.  Raises bitstring.ReadError if the buffer ends
+    first.
+    '''
+    cursor = Cursor(buffer, bit_offset)
+    parser = cursor.parse(steps)
+    try:
+        next(parser)
+    except StopIteration as e:
+        return e.value, cursor.pos
+    raise bitstring.ReadError('Reading off the end of the data.')
+
+
+class Cursor(object):
+    '''
+    A bit position in a bytes-like buffer, which may be appended to (but
+    not otherwise changed) while a parser is waiting for more bits.
+    '''
+    def __init__(self, buffer, pos=0):
+        self.buffer = buffer
+        self.pos = pos
+
+    def parse(self, steps):
+        '''Generator returning the flat values of an object.'''
+        values = []
+        for step in steps:
+            if step[0] == 'fixed':
+                values.extend((yield from self._unpack(step[1], 1))[0])
+            elif step[0] == 'token':
+                values.append((yield from self._token(step[1])))
+            else:
+                values.append((yield from self._repeat(*step[1:])))
+        return values
+
+    def _repeat(self, count, kind, element):
+        n = (yield from self._unpack(count, 1))[0][0]
+        if kind == 'tokens':
+            return [r[0] for r in (yield from self._unpack(element, n))]
+        if kind == 'records':
+            return [list(r) for r in (yield from self._unpack(element, n))]
+        values = []
+        for _ in range(n):
+            if kind == 'token':
+                values.append((yield from self._token(element)))
+            else:
+                values.append((yield from self.parse(element)))
+        return values
+
+    def _unpack(self, layout, count):
+        '''Returns count records of layout, once their bits are there.'''
+        size = layout.size * count
+        available = len(self.buffer) * 8 - self.pos
+        if available < size:
+            yield size - available
+        records = layout.unpack_many(self.buffer, self.pos, count)
+        self.pos += size
+        return records
+
+    def _token(self, token):
+        '''Reads an exp-Golomb token, trying again as bits arrive.'''
+        window = _window
+        while True:
+            available = len(self.buffer) * 8 - self.pos
+            n = min(window, available)
+            if n:
+                start = self.pos
+                data = bitstring.BitStream(
+                    bytes=bytes(self.buffer[start >> 3:(start + n + 7) >> 3]),
+                    offset=start & 7, length=n)
+                try:
+                    value = data.read(token)
+                except bitstring.ReadError:
+                    if n < available:
+                        window *= 2
+                        continue
+                else:
+                    self.pos += data.pos
+                    return value
+            yield 1
@@ -0,0 +1,159 @@
+'''
+Projections: unfold only a named subset of a pattern's fields.
+'''
+from .compiler import _Source, _is_identifier, resolve_field
+from .exceptions import UnfoldingException
+from .packing import byte_view, read_bits
+from .parse import read as read_steps
+from .repeat import Repeat, builder
+import bitstring
+
+_modes = ('dict', 'instance')
+
+
+def _new(cls):
+    return cls.__new__(cls)
+
+
+class Projection(object):
+    '''
+    Precompiled unfolding of a subset of a pattern's fields.  `fields` are
+    fold names, with dots for fields of nested patterns ('point.x').  Naming
+    a nested pattern ('point') unfolds all of it into an instance.
+
+    With into='dict' the result maps each requested name to its value.  With
+    into='instance' the result is an instance of the pattern class (built
+    without calling __init__ or the unfold callback) with only the requested
+    attributes set, and nested instances created as needed.
+
+    For fixed-size patterns only the requested fields are extracted, found
+    by their bit offsets; everything else is skipped.
+    '''
+    def __init__(self, crafter, cls, fields, into='dict'):
+        if into not in _modes:
+            raise ValueError('into must be one of {}'.format(_modes))
+        self.crafter = crafter
+        self.cls = cls
+        self.fields = tuple(fields)
+        self.into = into
+        meta = crafter.patterns[cls]
+        self._meta = meta
+        self._layout = meta['layout']
+
+        resolved = [resolve_field(crafter, cls, name) for name in self.fields]
+        indices = sorted(set(
+            i for start, count, _, _ in resolved
+            for i in range(start, start + count)))
+        if self._layout is not None:
+            self._unpack = self._layout.unpacker(indices)
+        else:
+            self._unpack = None
+        self._indices = indices
+        self._build = _compile_build(crafter, cls, self.fields, resolved,
+                                     {index: i for i, index in
+                                      enumerate(indices)}, into)
+
+    def __repr__(self):
+        return 'Projection({}, {!r})'.format(self.cls.__name__, self.fields)
+
+    def unfold(self, data, instance=None):
+        '''
+        Unfold the requested fields from a BitString, advancing it past the
+        whole object.  With into='instance', sets the fields on `instance`
+        if one is given.
+        '''
+        try:
+            if self._unpack is not None:
+                values = self._unpack(data.read(self._layout.token))
+            else:
+                values = self._meta['read'](data)
+                values = [values[i] for i in self._indices]
+        except bitstring.ReadError as e:
+            raise UnfoldingException(self.cls, e.msg)
+        return self._build(values, instance)
+
+    def unfold_from(self, buffer, bit_offset=0, instance=None):
+        '''
+        Unfold the requested fields of an object folded into a bytes-like
+        buffer `bit_offset` bits in.
+        '''
+        if self._unpack is None:
+            steps = self._meta['steps']
+            if steps is None:
+                data = bitstring.BitStream(
+                    bytes=bytes(buffer[bit_offset >> 3:]),
+                    offset=bit_offset & 7)
+                return self.unfold(data, instance)
+            try:
+                values, _ = read_steps(steps, byte_view(buffer), bit_offset)
+            except bitstring.ReadError as e:
+                raise UnfoldingException(self.cls, e.msg)
+            values = [values[i] for i in self._indices]
+            return self._build(values, instance)
+        try:
+            x = read_bits(buffer, bit_offset, self._layout.size)
+        except IndexError as e:
+            raise UnfoldingException(self.cls, str(e))
+        return self._build(self._unpack(x), instance)
+
+
+def _compile_build(crafter, cls, fields, resolved, positions, into):
+    src = _Source(crafter)
+    src.namespace['_new'] = _new
+    exprs = []
+    for name, (start, count, crease, subcls) in zip(fields, resolved):
+        if subcls is None:
+            expr = 'values[{}]'.format(positions[start])
+            if crease is not None:
+                expr = '{}({})'.format(src.bind(crease, 'c'), expr)
+        elif isinstance(subcls, Repeat):
+            build = src.bind(builder(crafter, subcls, crease), 'b')
+            if subcls.count is None:
+                expr = '{}(values[{}])'.format(build, positions[start])
+            else:
+                expr = '{}([{}])'.format(build, ', '.join(
+                    'values[{}]'.format(positions[i])
+                    for i in range(start, start + count)))
+        else:
+            expand = src.bind(crafter.patterns[subcls]['expand'], 'e')
+            expr = '{}([{}], None)'.format(expand, ', '.join(
+                'values[{}]'.format(positions[i])
+                for i in range(start, start + count)))
+        exprs.append((name, expr))
+
+    if into == 'dict':
+        src.line('return {' + ', '.join(
+            '{!r}: {}'.format(name, expr) for name, expr in exprs) + '}')
+    else:
+        src.line('obj = instance if instance is not None else _new({})'
+                 .format(src.bind(cls, 'cls')))
+        objs = {'': 'obj'}
+        for name, expr in exprs:
+            path = name.split('.')
+            parent = _emit_parents(src, crafter, cls, path[:-1], objs)
+            src.line(_setattr(parent, path[-1], expr))
+        src.line('return obj')
+    filename = '<origami projection {} {}>'.format(
+        crafter.name, cls.__name__)
+    return src.build('def build(values, instance):', 'build', filename)
+
+
+def _emit_parents(src, crafter, cls, path, objs):
+    '''Creates (once) the nested partial instances along a dotted path.'''
+    var = objs['']
+    for depth in range(len(path)):
+        key = '.'.join(path[:depth + 1])
+        if key not in objs:
+            _, _, _, subcls = resolve_field(crafter, cls, key)
+            objs[key] = src.var('o')
+            src.line('{} = _new({})'.format(
+                objs[key], src.bind(subcls, 'cls')))
+            src.line(_setattr(var, path[depth], objs[key]))
+        var = objs[key]
+    return var
+
+
+def _setattr(obj, attr, expr):
+    if _is_identifier(attr):
+        return '{}.{} = {}'.format(obj, attr, expr)
+    return 'setattr({}, {!r}, {})'.format(obj, attr, expr)
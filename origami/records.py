@@ -0,0 +1,207 @@
+'''
+Memory-mapped files of fixed-size folded records.
+'''
+from .crafter import Crafter
+from .index import RecordIndex
+from .exceptions import (
+    FoldingException,
+    InvalidPatternClassException,
+    UnfoldingException
+)
+import mmap
+import os
+import struct
+
+# Record count, record size in bits, and a stamp that changes whenever a
+# record is overwritten (so saved indexes can tell they're stale)
+_header = struct.Struct('>QQQ')
+_header_bits = _header.size * 8
+_modes = {'r': 'rb', 'r+': 'r+b', 'w': 'w+b'}
+# Records decoded at a time when iterating
+_chunk = 4096
+
+
+def _new_stamp():
+    return int.from_bytes(os.urandom(8), 'big')
+
+
+class RecordFile(object):
+    '''
+    A file of folded instances of one fixed-size pattern class, stored
+    back-to-back (at bit granularity) after a small header.  The file is
+    memory mapped, so reading or overwriting record i only touches the pages
+    that hold it.
+
+    mode is 'r' (read-only), 'r+' (read and write an existing file) or 'w'
+    (create or truncate, then read and write).  Supports len(), indexing,
+    slicing, iteration, assignment to an index, and append.
+    '''
+    def __init__(self, path, type, mode='r', crafter='global'):
+        if mode not in _modes:
+            raise ValueError("mode must be one of 'r', 'r+' or 'w'")
+        self.crafter = Crafter(crafter)
+        self.cls, _ = self.crafter._get_cls_obj(type)
+        self.size = self.crafter.size_of(self.cls)
+        if self.size is None:
+            raise InvalidPatternClassException(
+                self.cls, 'Record files require a fixed-size pattern.')
+        meta = self.crafter.patterns[self.cls]
+        self._layout, self._expand = meta['layout'], meta['expand']
+        self.path = path
+        self.writable = mode != 'r'
+        self._count = None
+        self._indexes = []
+        # Whether the stamp has been changed since the file was opened
+        self._restamped = False
+
+        self._file = open(path, _modes[mode])
+        if mode == 'w':
+            self._file.write(_header.pack(0, self.size, _new_stamp()))
+            self._file.flush()
+            self._restamped = True
+        try:
+            self._map()
+            count, size, self.stamp = _header.unpack_from(self._mmap)
+        except (ValueError, struct.error):
+            self.close()
+            raise UnfoldingException(path, 'Not a record file.')
+        if size != self.size:
+            self.close()
+            raise InvalidPatternClassException(
+                self.cls, "'{}' holds {}-bit records, not {}-bit.".format(
+                    path, size, self.size))
+        self._count = count
+
+    def __repr__(self):
+        return 'RecordFile({!r}, {})'.format(self.path, self.cls.__name__)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            count = max(stop - start, 0)
+            expand = self._expand
+            return [expand(values, None) for values in
+                    self._layout.unpack_many(
+                        self._mmap, self._offset(start), count)]
+        return self.crafter.unfold_from(
+            self._mmap, self._offset(self._index(index)), self.cls)
+
+    def __setitem__(self, index, obj):
+        self._check_write(obj)
+        index = self._index(index)
+        if not self._restamped:
+            self.stamp = _new_stamp()
+            self._restamped = True
+            self._write_header()
+        old_keys = [i._key_at(index) for i in self._indexes]
+        self.crafter.fold_into(obj, self._mmap, self._offset(index))
+        for i, key in zip(self._indexes, old_keys):
+            i._replaced(index, key)
+
+    def __iter__(self):
+        for start in range(0, self._count, _chunk):
+            for obj in self[start:start + _chunk]:
+                yield obj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, obj):
+        '''Fold obj into a new record at the end of the file.'''
+        self._check_write(obj)
+        end = self._offset(self._count + 1)
+        if (end + 7) >> 3 > len(self._mmap):
+            # Grow geometrically so appends are amortized O(1)
+            self._resize(max((end + 7) >> 3, 2 * len(self._mmap)))
+        self.crafter.fold_into(obj, self._mmap, self._offset(self._count))
+        self._count += 1
+        self._write_header()
+        for index in self._indexes:
+            index._appended(self._count - 1)
+
+    def index(self, fields, kind='sorted', path=None):
+        '''
+        Returns a RecordIndex of the records by the values of `fields`,
+        which is kept up to date as records are appended or overwritten
+        through this file.  kind is 'sorted' or 'hash'.  If path is given the
+        index is persisted there (and reused by later calls with the same
+        path), and saved again whenever this file is flushed or closed.  A
+        saved index is rebuilt if records were overwritten without it
+        attached; records appended without it are indexed as it loads.
+
+            by_position = blocks.index(('x', 'y'), path='blocks.xy.idx')
+            for block in by_position.lookup((3, 4), instances=True):
+                ...
+        '''
+        index = RecordIndex(self, fields, kind, path)
+        self._indexes.append(index)
+        return index
+
+    def scan(self, where, instances=False):
+        '''
+        Yields the index of each record (or, if instances is True, the
+        unfolded record) whose fields satisfy every condition in `where`.
+        See Crafter.scan.
+        '''
+        return self.crafter.scan(
+            self._mmap, self.cls, where, instances=instances,
+            bit_offset=_header_bits, count=self._count)
+
+    def flush(self):
+        if self.writable:
+            self._mmap.flush()
+        for index in self._indexes:
+            index.save()
+
+    def close(self):
+        '''
+        Unmap and close the file, trimming any space reserved by append.
+        '''
+        mapped = getattr(self, '_mmap', None)
+        if mapped is not None and not mapped.closed:
+            self.flush()
+            mapped.close()
+            if self.writable and self._count is not None:
+                self._file.truncate((self._offset(self._count) + 7) >> 3)
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def _map(self):
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=access)
+
+    def _resize(self, length):
+        self._mmap.close()
+        self._file.truncate(length)
+        self._map()
+
+    def _write_header(self):
+        _header.pack_into(self._mmap, 0, self._count, self.size, self.stamp)
+
+    def _offset(self, index):
+        return _header_bits + index * self.size
+
+    def _index(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('record index out of range')
+        return index
+
+    def _check_write(self, obj):
+        if not self.writable:
+            raise FoldingException(obj, 'Record file is read-only.')
+        if obj.__class__ is not self.cls:
+            raise FoldingException(
+                obj, "Record file holds '{}' records.".format(self.cls))
@@ -0,0 +1,188 @@
+'''
+Repeated fields: a run of values of one format folded back-to-back.
+
+In a fold string, 'samples=uint:12[16]' folds exactly 16 values and
+'points=Point[*]' folds a count followed by that many values.  The count is
+a uint of 16 bits unless a width is given, as in 'points=Point[*:8]'.
+
+A fixed count repeats the element's format that many times, so the pattern
+keeps a static bitstring format.  A counted field makes the pattern (and any
+pattern it's nested in) variable-size: its format is then a list of
+segments, each either a bitstring format or a counted Repeat, and it's read
+and packed segment by segment.  A counted field occupies a single flat
+value, the list of its elements' values (or, for a nested pattern, of each
+element's list of flat values).
+'''
+import bitstring
+import re
+
+_repeat_re = re.compile(
+    r'^(?P<fmt>.+?)\s*\[\s*(?P<count>[1-9]\d*|\*(:\d+)?)\s*\]$')
+_default_width = 16
+
+
+class Repeat(object):
+    '''
+    A repeated fold format.  `fmt` is the element's format as written (or
+    its pattern class), `count` the fixed number of elements or None if it's
+    folded with the field, and `width` the bits of that count.
+    '''
+    def __init__(self, fmt, count, width):
+        self.fmt = fmt
+        self.count = count
+        self.width = width
+        # Set when the pattern is learned: the element's bitstring token, or
+        # its pattern's read and pack functions
+        self.token = None
+        self.read_element = None
+        self.pack_element = None
+
+    def __repr__(self):
+        fmt = self.fmt if isinstance(self.fmt, str) else self.fmt.__name__
+        if self.count is not None:
+            return '{}[{}]'.format(fmt, self.count)
+        return '{}[*:{}]'.format(fmt, self.width)
+
+    def read(self, data):
+        '''Read a counted field's flat value from a BitString.'''
+        n = data.read('uint:{}'.format(self.width))
+        if self.token is not None:
+            return data.readlist(','.join([self.token] * n)) if n else []
+        read = self.read_element
+        return [read(data) for _ in range(n)]
+
+    def pack(self, values):
+        '''Pack a counted field's flat value into a list of BitStrings.'''
+        n = len(values)
+        if n >> self.width:
+            raise ValueError('{} elements is too many for a {}-bit count.'
+                             .format(n, self.width))
+        parts = [bitstring.pack('uint:{}'.format(self.width), n)]
+        if self.token is not None:
+            if n:
+                parts.append(bitstring.pack(
+                    ','.join([self.token] * n), *values))
+        else:
+            parts.extend(map(self.pack_element, values))
+        return parts
+
+
+def parse_repeat(fmt):
+    '''
+    Returns (element format, Repeat) for a repeated fold format, or None
+    if fmt isn't repeated.
+    '''
+    match = _repeat_re.match(fmt)
+    if not match:
+        return None
+    element, count = match.group('fmt'), match.group('count')
+    if count.startswith('*'):
+        width = int(count[2:]) if ':' in count else _default_width
+        return element, Repeat(element, None, width)
+    return element, Repeat(element, int(count), None)
+
+
+def join_segments(segments):
+    '''
+    Merges adjacent bitstring formats in a list of segments.  Returns a
+    single bitstring format if there's no counted field.
+    '''
+    merged = []
+    for segment in segments:
+        if isinstance(segment, str) and merged and \
+                isinstance(merged[-1], str):
+            merged[-1] += ',' + segment
+        else:
+            merged.append(segment)
+    if all(isinstance(segment, str) for segment in merged):
+        return ','.join(merged)
+    return merged
+
+
+def flat_width(segments):
+    '''Number of flat values in a bitstring format or list of segments.'''
+    if isinstance(segments, str):
+        return len(segments.split(','))
+    return sum(flat_width(segment) if isinstance(segment, str) else 1
+               for segment in segments)
+
+
+def reader(segments):
+    '''Returns a function that reads flat values from a BitString.'''
+    if isinstance(segments, str):
+        def read(data):
+            return data.readlist(segments)
+        return read
+
+    def read(data):
+        values = []
+        for segment in segments:
+            if isinstance(segment, str):
+                values.extend(data.readlist(segment))
+            else:
+                values.append(segment.read(data))
+        return values
+    return read
+
+
+def packer(segments):
+    '''Returns a function that packs flat values into a BitStream.'''
+    if isinstance(segments, str):
+        def pack(values):
+            return bitstring.pack(segments, *values)
+        return pack
+
+    widths = [flat_width(segment) if isinstance(segment, str) else None
+              for segment in segments]
+
+    def pack(values):
+        parts, i = [], 0
+        for segment, width in zip(segments, widths):
+            if width is None:
+                parts.extend(segment.pack(values[i]))
+                i += 1
+            else:
+                parts.append(bitstring.pack(segment, *values[i:i + width]))
+                i += width
+        return bitstring.BitStream().join(parts)
+    return pack
+
+
+def flattener(crafter, repeat, crease, element=None):
+    '''
+    Returns a function that takes a repeated attribute's sequence and
+    returns its flat values: all of them for a fixed count, otherwise the
+    single flat value of a counted field.  Elements of a nested pattern are
+    flattened by `element`, by default the pattern's flatten function.
+    '''
+    if isinstance(repeat.fmt, str):
+        if crease is None:
+            return list
+        return lambda values: [crease(value) for value in values]
+    flatten = element or crafter.patterns[repeat.fmt]['flatten']
+    if repeat.count is None:
+        return lambda objs: [flatten(obj) for obj in objs]
+    return lambda objs: [value for obj in objs for value in flatten(obj)]
+
+
+def builder(crafter, repeat, crease, element=None):
+    '''
+    Returns a function that reverses flattener, returning the list of
+    elements of a repeated attribute.  Elements of a nested pattern are
+    built from their flat values by `element`, by default a function that
+    unfolds a new instance.
+    '''
+    if isinstance(repeat.fmt, str):
+        if crease is None:
+            return list
+        return lambda values: [crease(value) for value in values]
+    if element is None:
+        expand = crafter.patterns[repeat.fmt]['expand']
+
+        def element(values):
+            return expand(values, None)
+    if repeat.count is None:
+        return lambda values: [element(value) for value in values]
+    step = crafter.patterns[repeat.fmt]['flat_count']
+    return lambda values: [element(values[i:i + step])
+                           for i in range(0, len(values), step)]
@@ -0,0 +1,78 @@
+'''
+Predicates evaluated directly on the bits of folded fixed-size records.
+'''
+from .compiler import _Source, resolve_field
+from .exceptions import InvalidFoldFormatException
+from .packing import Field, Layout, PACK_ERRORS, _ints
+
+
+def _raw_bits(field, value):
+    '''The bits `value` folds to in `field`, or None if it can't fold.'''
+    try:
+        return Layout([Field(field.kind, field.length, 0)]).pack([value])
+    except PACK_ERRORS:
+        return None
+
+
+def _test(condition):
+    '''Returns a function testing a single value against a condition.'''
+    if callable(condition):
+        return condition
+    if isinstance(condition, (range, set, frozenset)):
+        return condition.__contains__
+    if isinstance(condition, (list, tuple)):
+        values = frozenset(condition)
+        return values.__contains__
+    return lambda value: value == condition
+
+
+def compile_predicate(crafter, cls, where):
+    '''
+    Returns a function that takes a folded record of a fixed-size pattern as
+    an int, and returns whether its fields satisfy every condition in
+    `where`.  Keys are (dotted) fold names.  Values are compared against
+    folded values (creases are not applied) and may be a value to compare
+    for equality, a range, a set or sequence of values, or a function that
+    takes the value and returns a bool.
+
+    Equality on int and bool fields is checked for all such fields at once
+    by masking the record; ranges on big-endian unsigned fields compare the
+    masked bits directly.  Other conditions decode only their own field.
+    '''
+    layout = crafter.patterns[cls]['layout']
+    src = _Source(crafter)
+    mask = expected = 0
+    for name, condition in where.items():
+        start, _, _, subcls = resolve_field(crafter, cls, name)
+        if subcls is not None:
+            raise InvalidFoldFormatException(
+                name, 'Conditions must name a single field, not a pattern.')
+        field = layout.fields[start]
+        shift, field_mask = layout.shift(field), (1 << field.length) - 1
+        raw = '(x >> {} & {})'.format(shift, field_mask)
+        simple = field.kind == 'bool' or field.kind in _ints
+        unsigned = field.kind in _ints and field.kind.startswith('u') and \
+            (_ints[field.kind] == 'big' or field.length <= 8)
+
+        if simple and not callable(condition) and \
+                not isinstance(condition, (range, set, frozenset, list, tuple)):
+            bits = _raw_bits(field, condition)
+            if bits is None:
+                # Nothing folds to this value, so no record can match
+                src.line('return False')
+                break
+            mask |= field_mask << shift
+            expected |= bits << shift
+        elif unsigned and isinstance(condition, range) and condition.step == 1:
+            src.line('if not {} <= {} < {}: return False'.format(
+                condition.start, raw, condition.stop))
+        else:
+            unpack = src.bind(layout.unpacker([start]), 'u')
+            test = src.bind(_test(condition), 't')
+            src.line('if not {}({}(x)[0]): return False'.format(test, unpack))
+    if mask:
+        src.lines.insert(0, '    if x & {} != {}: return False'.format(
+            mask, expected))
+    src.line('return True')
+    filename = '<origami scan {} {}>'.format(crafter.name, cls.__name__)
+    return src.build('def match(x):', 'match', filename)
@@ -1,17 +1,44 @@
 from origami import (
     fold,
     unfold,
+    fold_many,
+    unfold_many,
+    fold_multi,
+    fold_tagged,
+    unfold_tagged,
     pattern,
+    record,
     Crafter,
+    FoldCache,
+    FoldDecoder,
+    RecordFile,
     OrigamiException
 )
+from origami.aio import read_folded, write_folded, write_folded_many
+from origami.exceptions import InvalidFoldFormatException
+from origami.packing import Layout
+from origami import parallel
 
+import asyncio
 import collections
+import concurrent.futures
+import functools
+import io
+import os
+import mmap
+import multiprocessing
 import bitstring
 import unittest
+import unittest.mock
 import pytest
+import tempfile
 import uuid
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def init(*attrs):
     def fn(self, *args):
@@ -46,6 +73,27 @@ def count_creases(fold, unfold):
 unique_id = lambda: str(uuid.uuid4())
 
 
+# Worker processes are handed instances and classes by pickling them, so
+# the patterns for parallel tests are defined at module level
+_parallel = 'parallel-tests'
+ParallelPoint = record('ParallelPoint', 'x=uint:9, y=uint:9',
+                       crafter=_parallel)
+
+
+@pattern(crafter=_parallel)
+class ParallelBlock(object):
+    folds = 'id=uint:5, pos=ParallelPoint, tag=uint:3'
+    __init__ = init('id', 'pos', 'tag')
+    __eq__ = equals('id', 'pos', 'tag')
+
+
+class ParallelReading(object):
+    # Learned by tests, with creases workers can't be sent
+    folds = 'v=uint:8'
+    creases = {'v': {'fold': lambda v: v // 2, 'unfold': lambda v: v * 2}}
+    __init__ = init('v')
+
+
 class CrafterTests(unittest.TestCase):
     def setUp(self):
         self.id = unique_id()
@@ -474,6 +522,73 @@ class PatternTests(unittest.TestCase):
         other_bar = Bar.unfold(self.id, bar, **kwargs)
         assert bar == other_bar
 
+    def testFoldsNamedLikeUnfoldArguments(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'name=uint:8, instance=uint:8'
+            __init__ = init('name', 'instance')
+            __eq__ = equals('name', 'instance')
+
+        foo = Foo(3, 4)
+        assert unfold(fold(foo, crafter=self.id), Foo, crafter=self.id) == foo
+
+    def testConstructNewWithSlots(self):
+        @pattern(crafter=self.id, construct='new')
+        class Foo(object):
+            __slots__ = ('a', 'b')
+            folds = 'a=uint:8, b=uint:8'
+
+            def __init__(self, a, b):
+                self.a, self.b = a, b
+            __eq__ = equals('a', 'b')
+
+        foo = Foo(1, 2)
+        other_foo = unfold(fold(foo, crafter=self.id), Foo, crafter=self.id)
+        assert other_foo == foo
+        assert not hasattr(other_foo, '__dict__')
+
+    def testConstructNewSkipsInit(self):
+        @pattern(crafter=self.id, construct='new')
+        class Foo(object):
+            folds = 'a=uint:8, b=uint:8'
+            __eq__ = equals('a', 'b')
+
+            def __init__(self, a, b):
+                raise AssertionError('__init__ called')
+
+        foo = Foo.unfold(self.id, None, a=1, b=2)
+        assert (foo.a, foo.b) == (1, 2)
+        assert vars(foo) == {'a': 1, 'b': 2}
+
+    def testConstructNewMixedStorage(self):
+        class Base(object):
+            __slots__ = ('a',)
+
+        @pattern(crafter=self.id, construct='new')
+        class Foo(Base):
+            folds = 'a=uint:8, b=uint:8, c=uint:8'
+
+            @property
+            def c(self):
+                return self._c
+
+            @c.setter
+            def c(self, value):
+                self._c = value
+
+        foo = Foo.unfold(self.id, None, a=1, b=2, c=3)
+        assert (foo.a, foo.b, foo.c) == (1, 2, 3)
+        assert vars(foo) == {'b': 2, '_c': 3}
+
+        with pytest.raises(OrigamiException):
+            Foo.unfold(self.id, None, a=1, c=3)
+
+    def testConstructInvalid(self):
+        with pytest.raises(ValueError):
+            @pattern(crafter=self.id, construct='fast')
+            class Foo(object):
+                folds = 'a=uint:8'
+
 
 class FoldUnfoldTests(unittest.TestCase):
     def setUp(self):
@@ -694,3 +809,1700 @@ class FoldUnfoldTests(unittest.TestCase):
         assert other_foo.c == original_foo.c
 
         assert counter['fold'] == counter['unfold'] == 2
+
+    def testNestedMissingAttribute(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=uint:1'
+            __init__ = init('a')
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'foo=Foo'
+            __init__ = init('foo')
+
+        with pytest.raises(OrigamiException) as excinfo:
+            fold(Bar(Foo(1)), crafter=self.id)
+        assert "'b'" in str(excinfo.value)
+
+    def testNonIdentifierAttributes(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'class=uint:8, b=uint:1'
+            __eq__ = equals('class', 'b')
+
+        foo = Foo()
+        setattr(foo, 'class', 200)
+        foo.b = 1
+
+        data = fold(foo, crafter=self.id)
+        assert unfold(data, Foo, crafter=self.id) == foo
+
+    def testNestedCreasesInOrder(self):
+        calls = []
+
+        def crease(name):
+            return {'fold': lambda v: calls.append(name) or v,
+                    'unfold': lambda v: calls.append(name) or v}
+
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=uint:8'
+            creases = {'a': crease('foo.a'), 'b': crease('foo.b')}
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'a=uint:8, foo=Foo, c=uint:8'
+            creases = {'a': crease('bar.a'), 'c': crease('bar.c')}
+            __init__ = init('a', 'foo', 'c')
+            __eq__ = equals('a', 'foo', 'c')
+
+        bar = Bar(1, Foo(2, 3), 4)
+        data = fold(bar, crafter=self.id)
+        assert unfold(data, Bar, crafter=self.id) == bar
+        order = ['bar.a', 'foo.a', 'foo.b', 'bar.c']
+        assert calls == order + order
+
+
+class LayoutTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+    def testFixedFormatsMatchBitstring(self):
+        fmt = ('uint:3, int:7, uintbe:16, intle:32, uintle:24, intne:16, '
+               'float:32, floatle:64, floatne:32, bool, hex:12, oct:6, '
+               'bin:5, bits:9')
+        values = [5, -64, 65535, -(1 << 31), 1 << 20, -2, 1.5, 0.1, -2.0,
+                  True, 'a0f', '17', '10011', bitstring.Bits('0b101100111')]
+        layout = Layout.from_format(fmt)
+
+        expected = bitstring.pack(fmt, *values)
+        data = bitstring.BitStream(uint=layout.pack(values), length=layout.size)
+        assert data == expected
+        assert layout.size == expected.len
+
+        expected.pos = 0
+        assert layout.unpack(data.uint) == expected.readlist(fmt)
+
+    def testVariableFormatsHaveNoLayout(self):
+        for fmt in ['uint:8, ue', 'se', 'uie', 'sie', 'hex', 'bits, uint:8']:
+            assert Layout.from_format(fmt) is None
+
+    def testFoldCoercedValues(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=hex:8, c=bool'
+            __init__ = init('a', 'b', 'c')
+            __eq__ = equals('a', 'b', 'c')
+
+        # Values bitstring coerces are still folded the same way
+        foo = Foo('12', '0xff', 'True')
+        data = fold(foo, crafter=self.id)
+        assert data == bitstring.pack('uint:8, hex:8, bool', '12', '0xff', 'True')
+        assert unfold(data, Foo, crafter=self.id) == Foo(12, 'ff', True)
+
+    @pytest.mark.skipif(numpy is None, reason='requires numpy')
+    def testFoldNumpyScalars(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'x=uint:9, y=uint:9, z=int:5'
+            __init__ = init('x', 'y', 'z')
+
+        foo = Foo(numpy.uint8(200), numpy.uint8(5), numpy.int8(-3))
+        expected = bitstring.pack('uint:9, uint:9, int:5', 200, 5, -3)
+        assert fold(foo, crafter=self.id) == expected
+        assert fold_many([foo, foo], crafter=self.id) == expected + expected
+
+        buffer = bytearray(4)
+        self.crafter.fold_into(foo, buffer, 3)
+        assert bitstring.Bits(buffer)[3:26] == expected
+
+    def testUnfoldVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=ue, b=uint:8'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        foo = Foo(1000, 3)
+        assert self.crafter.patterns[Foo]['layout'] is None
+        data = fold(foo, crafter=self.id)
+        assert unfold(data, Foo, crafter=self.id) == foo
+
+    def testStructFormat(self):
+        @pattern(crafter=self.id)
+        class Big(object):
+            folds = 'a=uint:8, b=uintbe:32, c=int:16, d=float:64'
+
+        @pattern(crafter=self.id)
+        class Little(object):
+            folds = 'a=int:8, b=uintle:32, c=floatle:32'
+
+        @pattern(crafter=self.id)
+        class Mixed(object):
+            folds = 'a=uintle:16, b=uintbe:16'
+
+        @pattern(crafter=self.id)
+        class Unaligned(object):
+            folds = 'a=uint:8, b=uint:4'
+
+        assert self.crafter.struct_format(Big) == '>BIhd'
+        assert self.crafter.struct_format(Little) == '<bIf'
+        assert self.crafter.struct_format(Mixed) is None
+        assert self.crafter.struct_format(Unaligned) is None
+
+    def testStructFoldMatchesBitstring(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=intle:16, c=floatle:64, d=uintle:64'
+            __init__ = init('a', 'b', 'c', 'd')
+            __eq__ = equals('a', 'b', 'c', 'd')
+
+        foo = Foo(255, -300, 0.1, (1 << 64) - 1)
+        data = fold(foo, crafter=self.id)
+        expected = bitstring.pack(
+            'uint:8, intle:16, floatle:64, uintle:64', 255, -300, 0.1, (1 << 64) - 1)
+        assert data == expected
+        assert unfold(data, Foo, crafter=self.id) == foo
+
+    def testStructFoldOutOfRange(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=uintbe:16'
+            __init__ = init('a', 'b')
+
+        with pytest.raises(OrigamiException):
+            fold(Foo(1, 1 << 16), crafter=self.id)
+
+    def testSizeOf(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:9, b=bool, c=floatle:32'
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'foo=Foo, b=hex:8'
+
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'foo=Foo, b=ue'
+
+        assert self.crafter.size_of(Foo) == 42
+        assert self.crafter.size_of(Foo, in_bytes=True) == 6
+        assert self.crafter.size_of('Bar') == 50
+        assert self.crafter.size_of(Baz) is None
+        assert self.crafter.size_of(Baz, in_bytes=True) is None
+
+
+class BulkTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+    def testFoldManyBitGranular(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:9, b=int:4'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        foos = [Foo(i * 3, i % 8 - 4) for i in range(21)]
+        data = fold_many(iter(foos), crafter=self.id)
+        expected = bitstring.BitStream()
+        for foo in foos:
+            expected += fold(foo, crafter=self.id)
+        assert data == expected
+        assert data.len == 13 * len(foos)
+
+        assert unfold_many(data, Foo, crafter=self.id) == foos
+        assert data.pos == data.len
+
+    def testFoldManyStruct(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8, b=uintle:16'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        foos = [Foo(i, i * 100) for i in range(50)]
+        data = fold_many(foos, crafter=self.id)
+        assert data.len == 24 * len(foos)
+
+        assert unfold_many(data, Foo, count=10, crafter=self.id) == foos[:10]
+        assert unfold_many(data, Foo, crafter=self.id) == foos[10:]
+
+    def testFoldManyMixedPatterns(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:3'
+            __init__ = init('a')
+            __eq__ = equals('a')
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'a=ue, b=uint:8'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        objs = [Foo(1), Bar(300, 2), Foo(7), Bar(0, 255)]
+        data = fold_many(objs, crafter=self.id)
+        assert unfold(data, Foo, crafter=self.id) == objs[0]
+        assert unfold(data, Bar, crafter=self.id) == objs[1]
+        assert unfold(data, Foo, crafter=self.id) == objs[2]
+        assert unfold_many(data, Bar, crafter=self.id) == objs[3:]
+
+    def testFoldManyInvalidValue(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8'
+            __init__ = init('a')
+
+        with pytest.raises(OrigamiException):
+            fold_many([Foo(1), Foo(256)], crafter=self.id)
+
+    def testUnfoldManyTooFewRecords(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:6'
+            __init__ = init('a')
+
+        data = fold_many([Foo(1), Foo(2)], crafter=self.id)
+        with pytest.raises(OrigamiException):
+            unfold_many(data, Foo, count=3, crafter=self.id)
+
+
+class BufferTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:9, b=int:4'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'a=uint:8, b=uintbe:16'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+        self.Foo, self.Bar = Foo, Bar
+
+    def testFoldIntoUnaligned(self):
+        buffer = bytearray(b'\xff' * 4)
+        foo = self.Foo(0, 0)
+        end = self.crafter.fold_into(foo, buffer, 3)
+        assert end == 16
+        # Surrounding bits are untouched
+        assert buffer == bytearray(b'\xe0\x00\xff\xff')
+        assert self.crafter.unfold_from(buffer, 3, self.Foo) == foo
+
+    def testFoldIntoMatchesFold(self):
+        buffer = bytearray(8)
+        foo, bar = self.Foo(300, -3), self.Bar(7, 1000)
+        offset = self.crafter.fold_into(foo, buffer, 5)
+        self.crafter.fold_into(bar, memoryview(buffer), offset)
+
+        expected = bitstring.BitStream(5) + fold(foo, crafter=self.id)
+        expected += fold(bar, crafter=self.id)
+        assert buffer[:6] == expected.tobytes()
+        assert self.crafter.unfold_from(buffer, 5, self.Foo) == foo
+        assert self.crafter.unfold_from(bytes(buffer), 18, self.Bar) == bar
+
+    def testStructIntoMmap(self):
+        buffer = mmap.mmap(-1, 16)
+        bar = self.Bar(255, 65535)
+        assert self.crafter.fold_into(bar, buffer, 64) == 88
+        assert buffer[8:11] == fold(bar, crafter=self.id).bytes
+        assert self.crafter.unfold_from(buffer, 64, self.Bar) == bar
+
+    def testUnfoldFromVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=ue, b=uint:8'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        buffer = bytearray(8)
+        baz = Baz(1000, 3)
+        self.crafter.fold_into(baz, buffer, 7)
+        assert self.crafter.unfold_from(buffer, 7, Baz) == baz
+
+    def testUnfoldFromVariableLittleEndian(self):
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=uintle:16, b=ue'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        buffer = bytearray(8)
+        baz = Baz(0x1234, 77)
+        self.crafter.fold_into(baz, buffer, 3)
+        assert self.crafter.unfold_from(buffer, 3, Baz) == baz
+        projection = self.crafter.projection(Baz, 'a')
+        assert projection.unfold_from(buffer, 3) == {'a': 0x1234}
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_from(buffer[:2], 3, Baz)
+
+    def testUnfoldFromVariableReadsOnlyObject(self):
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=ue, b=uint:8'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        class Buffer(bytearray):
+            def __getitem__(self, key):
+                reads.append(key)
+                return bytearray.__getitem__(self, key)
+
+        reads = []
+        buffer = Buffer(1 << 16)
+        self.crafter.fold_into(Baz(5, 6), buffer, 9)
+        assert self.crafter.unfold_from(buffer, 9, Baz) == Baz(5, 6)
+        # Only bytes near the object are copied, not the rest of the buffer
+        assert reads and all(
+            isinstance(key, int) or key.stop - key.start <= 64
+            for key in reads)
+
+    def testFoldIntoReadOnly(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_into(self.Bar(1, 2), bytes(8), 0)
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_into(self.Foo(1, 2), bytes(8), 1)
+
+    def testBufferOverrun(self):
+        buffer = bytearray(2)
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_into(self.Foo(1, 2), buffer, 4)
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_into(self.Bar(1, 2), buffer, 0)
+        assert len(buffer) == 2
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_from(buffer, 4, self.Foo)
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_from(buffer, 0, self.Bar)
+
+    def testIterUnfoldStraddlesChunks(self):
+        foos = [self.Foo(i * 7, i % 16 - 8) for i in range(40)]
+        data = fold_many(foos, crafter=self.id).tobytes()
+        for chunk_size in (1, 3, 64):
+            stream = io.BytesIO(data)
+            objs = self.crafter.iter_unfold(stream, self.Foo, chunk_size)
+            assert list(objs) == foos
+
+    def testIterUnfoldStruct(self):
+        bars = [self.Bar(i, i * 250) for i in range(100)]
+        stream = io.BytesIO(fold_many(bars, crafter=self.id).bytes)
+        objs = self.crafter.iter_unfold(stream, self.Bar, chunk_size=7)
+        assert list(objs) == bars
+
+    def testIterUnfoldCount(self):
+        foos = [self.Foo(i, 0) for i in range(10)]
+        stream = io.BytesIO(fold_many(foos, crafter=self.id).tobytes())
+        objs = self.crafter.iter_unfold(stream, 'Foo', chunk_size=2, count=4)
+        assert list(objs) == foos[:4]
+
+    def testIterUnfoldVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=ue, b=uint:3'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        bazs = [Baz(i * 1000, i % 8) for i in range(30)]
+        data = fold_many(bazs, crafter=self.id).tobytes()
+        objs = self.crafter.iter_unfold(io.BytesIO(data), Baz, chunk_size=2)
+        assert list(objs) == bazs
+
+    def testIterUnfoldVariableReadsOnce(self):
+        @pattern(crafter=self.id)
+        class Samples(object):
+            folds = 'id=uintle:16, samples=uint:12[*]'
+            __init__ = init('id', 'samples')
+            __eq__ = equals('id', 'samples')
+
+        samples = [Samples(i, [(i + j) % 4096 for j in range(3000)])
+                   for i in range(3)]
+        data = fold_many(samples, crafter=self.id).tobytes()
+        reads = []
+        steps = self.crafter.patterns[Samples]['steps']
+        for layout in [layout for step in steps for layout in step
+                       if isinstance(layout, Layout)]:
+            def unpack_many(*args, unpack_many=layout.unpack_many):
+                reads.append(args[2])
+                return unpack_many(*args)
+            layout.unpack_many = unpack_many
+
+        objs = self.crafter.iter_unfold(io.BytesIO(data), Samples, 100)
+        assert list(objs) == samples
+        # The id, count and elements of each object are each read once
+        assert reads == [1, 1, 3000] * 3
+        objs = self.crafter.iter_unfold(
+            io.BytesIO(data), Samples, 100, count=2, into='tuple')
+        assert [obj[0] for obj in objs] == [0, 1]
+        with pytest.raises(OrigamiException):
+            list(self.crafter.iter_unfold(io.BytesIO(data[:-10]), Samples))
+
+    def testIterUnfoldTruncated(self):
+        bars = [self.Bar(i, i) for i in range(3)]
+        data = fold_many(bars, crafter=self.id).bytes[:-1]
+        objs = self.crafter.iter_unfold(io.BytesIO(data), self.Bar)
+        with pytest.raises(OrigamiException):
+            list(objs)
+
+    def testFoldDecoder(self):
+        foos = [self.Foo(i * 7, i % 16 - 8) for i in range(40)]
+        data = fold_many(foos, crafter=self.id).tobytes()
+        for chunk_size in (1, 3, 64):
+            decoder = FoldDecoder(self.Foo, self.id)
+            objs = []
+            for start in range(0, len(data), chunk_size):
+                objs.extend(decoder.feed(data[start:start + chunk_size]))
+            assert objs == foos
+            # 40 * 13 bits leaves no partial object, just padding
+            assert decoder.pending == 0
+            decoder.close()
+
+    def testFoldDecoderVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=ue, b=uint:3'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        bazs = [Baz(i * 1000, i % 8) for i in range(30)]
+        data = fold_many(bazs, crafter=self.id).tobytes()
+        decoder = FoldDecoder(Baz, self.id)
+        objs = []
+        for start in range(0, len(data), 2):
+            objs.extend(decoder.feed(memoryview(data)[start:start + 2]))
+            assert decoder.pending < 64
+        assert objs == bazs
+
+    def testFoldDecoderTruncated(self):
+        decoder = FoldDecoder(self.Bar, self.id)
+        data = fold_many([self.Bar(1, 2)] * 2, crafter=self.id).bytes
+        assert decoder.feed(data[:-1]) == [self.Bar(1, 2)]
+        assert decoder.pending == 16
+        with pytest.raises(OrigamiException):
+            decoder.close()
+        with pytest.raises(OrigamiException):
+            FoldDecoder(self.Bar(1, 2), self.id)
+
+    def testUnfoldLazy(self):
+        counter, name_creases = count_creases(fold=int, unfold=str)
+
+        @pattern(crafter=self.id)
+        class Action(object):
+            folds = 'id=uint:12, foo=Foo, bar=Bar, tag=uint:8'
+            creases = {'tag': name_creases}
+            __init__ = init('id', 'foo', 'bar', 'tag')
+            __eq__ = equals('id', 'foo', 'bar', 'tag')
+
+        action = Action(4000, self.Foo(300, -3), self.Bar(9, 999), '42')
+        buffer = bytearray(16)
+        self.crafter.fold_into(action, buffer, 3)
+
+        view = self.crafter.unfold_lazy(buffer, Action, 3)
+        assert view.bar.b == 999
+        assert view.foo.b == -3
+        assert counter['unfold'] == 0
+        assert view.tag == '42'
+        assert view.tag == '42'
+        assert counter['unfold'] == 1
+        assert view.id == 4000
+        assert view.foo._unfold() == action.foo
+        assert view._unfold() == action
+        with pytest.raises(AttributeError):
+            view.missing
+
+    def testUnfoldLazyFromStream(self):
+        data = fold_many([self.Foo(1, 2), self.Foo(3, 4)], crafter=self.id)
+        first = self.crafter.unfold_lazy(data, self.Foo)
+        second = self.crafter.unfold_lazy(data, self.Foo)
+        assert (first.a, first.b, second.a, second.b) == (1, 2, 3, 4)
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_lazy(data, self.Foo)
+
+    def testUnfoldLazyOverrun(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_lazy(bytearray(2), self.Foo, 4)
+
+
+class RecordFileTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'records')
+
+        @pattern(crafter=self.id)
+        class Block(object):
+            folds = 'x=uint:5, y=uint:5, type=uint:3'
+            __init__ = init('x', 'y', 'type')
+            __eq__ = equals('x', 'y', 'type')
+        self.Block = Block
+        self.blocks = [Block(i % 32, i // 32, i % 8) for i in range(100)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, objs):
+        with RecordFile(self.path, self.Block, 'w', crafter=self.id) as f:
+            for obj in objs:
+                f.append(obj)
+
+    def testAppendAndRead(self):
+        self.write(self.blocks)
+        # Header plus exactly 100 * 13 bits
+        assert os.path.getsize(self.path) == 24 + 163
+
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            assert len(f) == 100
+            assert f[0] == self.blocks[0]
+            assert f[57] == self.blocks[57]
+            assert f[-1] == self.blocks[-1]
+            assert f[10:20] == self.blocks[10:20]
+            assert f[::7] == self.blocks[::7]
+            assert list(f) == self.blocks
+            with pytest.raises(IndexError):
+                f[100]
+
+    def testOverwrite(self):
+        self.write(self.blocks)
+        with RecordFile(self.path, 'Block', 'r+', crafter=self.id) as f:
+            f[42] = self.Block(31, 31, 7)
+            f.append(self.Block(1, 2, 3))
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            assert f[41] == self.blocks[41]
+            assert f[42] == self.Block(31, 31, 7)
+            assert f[43] == self.blocks[43]
+            assert f[100] == self.Block(1, 2, 3)
+
+    def testReadOnly(self):
+        self.write(self.blocks[:3])
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            with pytest.raises(OrigamiException):
+                f[0] = self.blocks[0]
+            with pytest.raises(OrigamiException):
+                f.append(self.blocks[0])
+
+    def testWrongPattern(self):
+        @pattern(crafter=self.id)
+        class Other(object):
+            folds = 'x=uint:8'
+
+        self.write(self.blocks[:3])
+        with pytest.raises(OrigamiException):
+            RecordFile(self.path, Other, crafter=self.id)
+
+    def testVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Other(object):
+            folds = 'x=ue'
+
+        with pytest.raises(OrigamiException):
+            RecordFile(self.path, Other, 'w', crafter=self.id)
+
+    def testScan(self):
+        self.write(self.blocks)
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            found = list(f.scan({'type': 3, 'y': 2}))
+            assert found == [i for i, block in enumerate(self.blocks)
+                             if block.type == 3 and block.y == 2]
+            assert list(f.scan({'x': 31}, instances=True)) == \
+                [block for block in self.blocks if block.x == 31]
+
+    def testIndex(self):
+        self.write(self.blocks)
+        index_path = self.path + '.idx'
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            index = f.index(('y', 'x'), path=index_path)
+            assert index.lookup((2, 7)) == [71]
+            assert index.lookup((2, 7), instances=True) == [self.blocks[71]]
+            assert index.lookup((9, 9)) == []
+            # Prefix ranges, in key order
+            assert index.range((1,), (2,)) == list(range(32, 64))
+            assert index.range((3, 2)) == [98, 99]
+            assert index.range(high=(0, 2)) == [0, 1]
+
+            by_type = f.index('type', kind='hash')
+            assert by_type.lookup(3) == list(range(3, 100, 8))
+            with pytest.raises(ValueError):
+                by_type.range(0, 2)
+
+    def testIndexMaintenance(self):
+        self.write(self.blocks)
+        index_path = self.path + '.idx'
+        with RecordFile(self.path, self.Block, 'r+', crafter=self.id) as f:
+            index = f.index('x', path=index_path)
+            by_type = f.index('type', kind='hash')
+            f.append(self.Block(4, 30, 1))
+            f[5] = self.Block(4, 0, 7)
+            assert index.lookup(4) == [4, 5, 36, 68, 100]
+            assert index.range(5, 7) == [37, 69, 6, 38, 70]
+            assert by_type.lookup(7) == [5] + list(range(7, 100, 8))
+            assert 5 not in by_type.lookup(5)
+
+        # Reloaded from disk, then brought up to date with a later append
+        with RecordFile(self.path, self.Block, 'r+', crafter=self.id) as f:
+            f.append(self.Block(4, 31, 0))
+            index = f.index('x', path=index_path)
+            assert len(index) == 102
+            assert index.lookup(4) == [4, 5, 36, 68, 100, 101]
+
+    def testIndexStaleAfterOverwrite(self):
+        self.write(self.blocks)
+        index_path = self.path + '.idx'
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            f.index(('type', 'x'), path=index_path)
+        # Overwritten without the index attached
+        with RecordFile(self.path, self.Block, 'r+', crafter=self.id) as f:
+            f[7] = self.blocks[0]
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            index = f.index(('type', 'x'), path=index_path)
+            assert index.lookup((7, 7)) == [39, 71]
+            assert index.lookup((0, 0)) == [0, 7, 32, 64, 96]
+
+    def testIndexPathReused(self):
+        self.write(self.blocks)
+        index_path = self.path + '.idx'
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            f.index('x', path=index_path)
+        # y has the same width as x, but the saved index isn't reused for it
+        with RecordFile(self.path, self.Block, crafter=self.id) as f:
+            index = f.index('y', path=index_path)
+            assert index.lookup(3) == list(range(96, 100))
+            assert index.lookup(5) == []
+
+        @pattern(crafter=self.id)
+        class Other(object):
+            folds = 'y=uint:5, x=uint:5, type=uint:3'
+
+        other_path = os.path.join(self.dir.name, 'other')
+        with RecordFile(other_path, Other, 'w', crafter=self.id) as f:
+            for block in self.blocks:
+                f.append(Other.unfold(self.id, None, x=block.y, y=block.x,
+                                      type=block.type))
+            index = f.index('y', path=index_path)
+            assert index.lookup(3) == list(range(3, 100, 32))
+
+    def testIndexPatternField(self):
+        @pattern(crafter=self.id)
+        class Pair(object):
+            folds = 'a=Block, b=Block'
+
+        with RecordFile(self.path, Pair, 'w', crafter=self.id) as f:
+            with pytest.raises(OrigamiException):
+                f.index('a')
+            assert f.index('a.x').lookup(0) == []
+
+
+@pytest.mark.skipif(numpy is None, reason='requires numpy')
+class ColumnTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=int:7'
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Action(object):
+            folds = ('id=uintle:16, point=Point, ok=bool, '
+                     'speed=floatle:32, t=uint:64')
+            __init__ = init('id', 'point', 'ok', 'speed', 't')
+            __eq__ = equals('id', 'point', 'ok', 'speed', 't')
+        self.Point, self.Action = Point, Action
+        self.actions = [
+            Action(i * 600, Point(i * 11 % 512, i % 128 - 64), i % 3 == 0,
+                   i / 4, (1 << 64) - 1 - i)
+            for i in range(50)]
+
+    def testUnfoldArrayMatchesUnfoldMany(self):
+        data = fold_many(self.actions, crafter=self.id)
+        array = self.crafter.unfold_array(data, self.Action)
+        assert array.dtype.names == (
+            'id', 'point.x', 'point.y', 'ok', 'speed', 't')
+        assert len(array) == len(self.actions)
+        for row, action in zip(array, self.actions):
+            assert row['id'] == action.id
+            assert row['point.x'] == action.point.x
+            assert row['point.y'] == action.point.y
+            assert row['ok'] == action.ok
+            assert row['speed'] == action.speed
+            assert row['t'] == action.t
+
+    def testFoldArrayMatchesFoldMany(self):
+        data = fold_many(self.actions, crafter=self.id)
+        array = self.crafter.unfold_array(data.tobytes(), self.Action)
+        assert self.crafter.fold_array(array, self.Action) == data
+
+        columns = {name: array[name] for name in array.dtype.names}
+        assert self.crafter.fold_array(columns, 'Action') == data
+
+    def testUnfoldArrayCount(self):
+        data = fold_many(self.actions, crafter=self.id)
+        head = self.crafter.unfold_array(data, self.Action, 10)
+        rest = self.crafter.unfold_array(data, self.Action)
+        assert len(head) == 10 and len(rest) == 40
+        assert unfold_many(fold_many(self.actions[10:], crafter=self.id),
+                           self.Action, crafter=self.id) == self.actions[10:]
+        assert list(rest['id']) == [a.id for a in self.actions[10:]]
+
+    def testShortRecordsMatchFoldMany(self):
+        points = [self.Point(i * 37 % 512, i % 128 - 64) for i in range(99)]
+        data = fold_many(points, crafter=self.id)
+        array = self.crafter.unfold_array(data, self.Point)
+        assert list(array['x']) == [p.x for p in points]
+        assert list(array['y']) == [p.y for p in points]
+        assert self.crafter.fold_array(array, self.Point) == data
+
+        # Read from a position that isn't byte-aligned
+        data = bitstring.BitStream('0b101') + data
+        data.pos = 3
+        assert list(self.crafter.unfold_array(data, 'Point')['y']) == \
+            [p.y for p in points]
+
+    def testStructRecords(self):
+        @pattern(crafter=self.id)
+        class Sample(object):
+            folds = 'a=uint:8, b=intle:16, c=floatle:64, d=uintle:64'
+            __init__ = init('a', 'b', 'c', 'd')
+            __eq__ = equals('a', 'b', 'c', 'd')
+
+        samples = [Sample(i, -i * 99, i / 3, (1 << 64) - 1 - i)
+                   for i in range(20)]
+        data = fold_many(samples, crafter=self.id)
+        assert self.crafter.struct_format(Sample) is not None
+        array = self.crafter.unfold_array(data.tobytes(), Sample)
+        assert array.dtype == numpy.dtype(
+            [('a', 'u1'), ('b', 'i2'), ('c', 'f8'), ('d', 'u8')])
+        assert list(array['b']) == [s.b for s in samples]
+        assert list(array['c']) == [s.c for s in samples]
+        assert list(array['d']) == [s.d for s in samples]
+        assert self.crafter.fold_array(array, Sample) == data
+
+        unaligned = bitstring.BitStream('0b1') + data
+        unaligned.pos = 1
+        assert (self.crafter.unfold_array(unaligned, Sample) == array).all()
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_array(
+                {'a': [256], 'b': [0], 'c': [0.0], 'd': [0]}, Sample)
+
+    def testFoldArrayOutOfRange(self):
+        columns = {'x': numpy.array([512]), 'y': numpy.array([0])}
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_array(columns, self.Point)
+
+    def testFoldArrayMissingColumn(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_array({'x': numpy.array([1])}, self.Point)
+
+    def testNonNumericPattern(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=hex:8'
+
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_array(b'\x00', Foo)
+
+
+class ProjectionTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.counter, y_creases = count_creases(fold=int, unfold=str)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            creases = {'y': y_creases}
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Action(object):
+            folds = 'id=uint:16, src=Point, dst=Point, speed=float:32'
+            __init__ = init('id', 'src', 'dst', 'speed')
+            __eq__ = equals('id', 'src', 'dst', 'speed')
+        self.Point, self.Action = Point, Action
+        self.action = Action(7, Point(1, '2'), Point(3, '4'), 0.5)
+
+    def testUnfoldFieldsToDict(self):
+        data = fold(self.action, crafter=self.id)
+        data.append(fold(self.action, crafter=self.id))
+        result = self.crafter.unfold(data, self.Action,
+                                     fields=('id', 'dst.x', 'dst.y'))
+        assert result == {'id': 7, 'dst.x': 3, 'dst.y': '4'}
+        assert self.counter['unfold'] == 1
+        # The whole object was consumed
+        assert unfold(data, self.Action, crafter=self.id) == self.action
+
+    def testUnfoldNestedPattern(self):
+        data = fold(self.action, crafter=self.id)
+        result = self.crafter.unfold(data, 'Action', fields=['src', 'speed'])
+        assert result == {'src': self.Point(1, '2'), 'speed': 0.5}
+
+    def testUnfoldFieldsToInstance(self):
+        projection = self.crafter.projection(
+            self.Action, ('dst.x', 'id'), into='instance')
+        assert self.crafter.projection(
+            self.Action, ('dst.x', 'id'), into='instance') is projection
+
+        buffer = bytearray(16)
+        self.crafter.fold_into(self.action, buffer, 5)
+        action = projection.unfold_from(buffer, 5)
+        assert isinstance(action, self.Action)
+        assert action.id == 7
+        assert action.dst.x == 3
+        assert not hasattr(action, 'src')
+        assert not hasattr(action.dst, 'y')
+
+    def testUnfoldFieldsVariablePattern(self):
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=ue, b=uint:8, c=se'
+            __init__ = init('a', 'b', 'c')
+
+        data = fold(Foo(100, 5, -7), crafter=self.id)
+        assert self.crafter.unfold(data, Foo, fields='c') == {'c': -7}
+        assert data.pos == data.len
+
+    def testUnknownField(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.projection(self.Action, ['src.z'])
+        with pytest.raises(OrigamiException):
+            self.crafter.projection(self.Action, ['id.x'])
+
+
+class ScanTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=int:9'
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Block(object):
+            folds = 'type=uint:3, pos=Point, hot=bool, weight=floatle:32'
+            __init__ = init('type', 'pos', 'hot', 'weight')
+            __eq__ = equals('type', 'pos', 'hot', 'weight')
+        self.Point, self.Block = Point, Block
+        self.blocks = [Block(i % 8, Point(i * 5 % 512, i % 100 - 50),
+                             i % 3 == 0, i / 4) for i in range(300)]
+        self.data = fold_many(self.blocks, crafter=self.id)
+
+    def scan(self, where, **kwargs):
+        self.data.pos = 0
+        return list(self.crafter.scan(self.data, self.Block, where, **kwargs))
+
+    def matching(self, test):
+        return [i for i, block in enumerate(self.blocks) if test(block)]
+
+    def testEquality(self):
+        assert self.scan({'type': 3, 'hot': True}) == self.matching(
+            lambda b: b.type == 3 and b.hot)
+        assert self.scan({'pos.y': -7}) == self.matching(
+            lambda b: b.pos.y == -7)
+        assert self.scan({'weight': 2.5}) == self.matching(
+            lambda b: b.weight == 2.5)
+        # Values that can't be folded match nothing
+        assert self.scan({'type': 9}) == []
+
+    def testRangesSetsAndFunctions(self):
+        assert self.scan({'pos.x': range(0, 64)}) == self.matching(
+            lambda b: b.pos.x < 64)
+        assert self.scan({'pos.y': range(-10, 10, 3)}) == self.matching(
+            lambda b: b.pos.y in range(-10, 10, 3))
+        assert self.scan({'type': [1, 6], 'pos.x': {5, 10, 15}}) == \
+            self.matching(lambda b: b.type in (1, 6) and b.pos.x in (5, 10, 15))
+        assert self.scan({'weight': lambda w: w > 70}) == self.matching(
+            lambda b: b.weight > 70)
+
+    def testInstances(self):
+        assert self.scan({'type': 5}, instances=True) == [
+            b for b in self.blocks if b.type == 5]
+
+    def testBuffer(self):
+        buffer = bytearray(2100)
+        offset = 3
+        for block in self.blocks:
+            offset = self.crafter.fold_into(block, buffer, offset)
+        found = self.crafter.scan(buffer, self.Block, {'type': 2},
+                                  bit_offset=3, count=len(self.blocks))
+        assert list(found) == self.matching(lambda b: b.type == 2)
+
+    def testInvalid(self):
+        with pytest.raises(OrigamiException):
+            self.scan({'pos.z': 1})
+        with pytest.raises(OrigamiException):
+            self.scan({'pos': 1})
+
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=ue'
+
+        with pytest.raises(OrigamiException):
+            self.crafter.scan(fold_many([], crafter=self.id), Foo, {'a': 1})
+
+
+class MemoryWriter(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = self.drains = 0
+
+    def write(self, data):
+        self.data += data
+        self.writes += 1
+
+    async def drain(self):
+        self.drains += 1
+
+
+class AsyncTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:9, b=int:4'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        @pattern(crafter=self.id)
+        class Bar(object):
+            folds = 'a=uint:8, b=uintbe:16'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        @pattern(crafter=self.id)
+        class Baz(object):
+            folds = 'a=ue, b=se'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+        self.Foo, self.Bar, self.Baz = Foo, Bar, Baz
+
+    def roundtrip(self, objs, chunks=None):
+        async def run():
+            writer = MemoryWriter()
+            await write_folded_many(writer, objs, crafter=self.id,
+                                    batch_size=10)
+            reader = asyncio.StreamReader()
+            data = bytes(writer.data)
+            size = chunks or len(data) or 1
+            for start in range(0, len(data), size):
+                reader.feed_data(data[start:start + size])
+            reader.feed_eof()
+            result = [obj async for obj in
+                      read_folded(reader, type(objs[0]), crafter=self.id)]
+            return writer, result
+        return asyncio.run(run())
+
+    def testFixedSizeFrames(self):
+        objs = [self.Foo(i, i % 16 - 8) for i in range(25)]
+        writer, result = self.roundtrip(objs, chunks=3)
+        assert result == objs
+        # Each 13-bit object is padded to a 2-byte frame
+        assert len(writer.data) == 50
+        assert writer.writes == writer.drains == 3
+
+        objs = [self.Bar(i, i * 7) for i in range(25)]
+        writer, result = self.roundtrip(objs)
+        assert result == objs
+        assert bytes(writer.data) == fold_many(objs, crafter=self.id).bytes
+
+    def testLengthPrefixedFrames(self):
+        objs = [self.Baz(i * 100, -i) for i in range(25)]
+        writer, result = self.roundtrip(objs, chunks=5)
+        assert result == objs
+        assert writer.data[:4] == b'\x00\x00\x00\x01'
+
+        @pattern(crafter=self.id)
+        class Qux(object):
+            folds = 'a=uint:3, b=ue, c=uintle:16'
+            __init__ = init('a', 'b', 'c')
+            __eq__ = equals('a', 'b', 'c')
+
+        objs = [Qux(i % 8, i, i * 1000) for i in range(25)]
+        assert self.roundtrip(objs, chunks=3)[1] == objs
+
+    def testWriteFolded(self):
+        async def run():
+            writer = MemoryWriter()
+            await write_folded(writer, self.Foo(3, -1), crafter=self.id)
+            return writer
+        writer = asyncio.run(run())
+        assert bytes(writer.data) == fold(self.Foo(3, -1), crafter=self.id)\
+            .tobytes()
+        assert writer.drains == 1
+
+    def testTruncatedFrame(self):
+        async def run(cls, data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return [obj async for obj in
+                    read_folded(reader, cls, crafter=self.id)]
+
+        with pytest.raises(OrigamiException):
+            asyncio.run(run(self.Bar, b'\x00' * 4))
+        with pytest.raises(OrigamiException):
+            asyncio.run(run(self.Baz, b'\x00\x00\x00\x02\x80'))
+        assert asyncio.run(run(self.Baz, b'')) == []
+
+
+class TaggedTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Move(object):
+            folds = 'x=uint:9, y=uint:9'
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Chat(object):
+            folds = 'length=ue, flag=bool'
+            __init__ = init('length', 'flag')
+            __eq__ = equals('length', 'flag')
+
+        @pattern(crafter=self.id)
+        class Ping(object):
+            folds = 'id=uint:32'
+            __init__ = init('id')
+            __eq__ = equals('id')
+        self.Move, self.Chat, self.Ping = Move, Chat, Ping
+        self.messages = [Move(1, 2), Chat(300, True), Ping(7), Move(3, 4)]
+
+    def testDefaultTags(self):
+        data = fold_tagged(self.Ping(7), crafter=self.id)
+        # Three patterns need a 2-bit tag, and Ping was learned third
+        assert data == bitstring.pack('uint:2, uint:32', 2, 7)
+
+        stream = bitstring.BitStream()
+        for message in self.messages:
+            stream.append(fold_tagged(message, crafter=self.id))
+        objs = [unfold_tagged(stream, crafter=self.id) for _ in self.messages]
+        assert objs == self.messages
+        assert stream.pos == stream.len
+
+    def testDefaultTagsFollowLearning(self):
+        assert fold_tagged(self.Move(0, 0), crafter=self.id).len == 20
+
+        @pattern(crafter=self.id)
+        class Other(object):
+            folds = 'a=uint:1'
+
+        @pattern(crafter=self.id)
+        class Another(object):
+            folds = 'a=uint:1'
+        assert fold_tagged(self.Move(0, 0), crafter=self.id).len == 21
+
+    def testAssignTags(self):
+        tags = self.crafter.assign_tags([self.Ping, 'Move'], width=8)
+        assert tags == {self.Ping: 0, self.Move: 1}
+        data = self.crafter.fold_tagged(self.Move(5, 6))
+        assert data[:8].uint == 1
+        assert self.crafter.unfold_tagged(data) == self.Move(5, 6)
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_tagged(self.Chat(1, False))
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_tagged(bitstring.BitStream('uint:8=5'))
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_tagged(bitstring.BitStream('uint:8=0'))
+        with pytest.raises(ValueError):
+            self.crafter.assign_tags(width=1)
+
+
+class RepeatTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Path(object):
+            folds = 'id=uint:8, points=Point[*:4], samples=uint:12[3]'
+            __init__ = init('id', 'points', 'samples')
+            __eq__ = equals('id', 'points', 'samples')
+        self.Point, self.Path = Point, Path
+        self.path = Path(5, [Point(1, 2), Point(3, 4)], [7, 8, 9])
+
+    def testFixedCount(self):
+        @pattern(crafter=self.id)
+        class Box(object):
+            folds = 'corners=Point[2], samples=uint:12[16]'
+            __init__ = init('corners', 'samples')
+            __eq__ = equals('corners', 'samples')
+
+        box = Box([self.Point(1, 2), self.Point(3, 4)], list(range(16)))
+        data = fold(box, crafter=self.id)
+        assert data == bitstring.pack(
+            '4*uint:9, 16*uint:12', 1, 2, 3, 4, *range(16))
+        assert self.crafter.size_of(Box) == 36 + 192
+        assert unfold(data, Box, crafter=self.id) == box
+        data.pos = 0
+        assert self.crafter.unfold_lazy(data, Box).corners == box.corners
+
+        with pytest.raises(OrigamiException):
+            fold(Box(box.corners, [1, 2]), crafter=self.id)
+
+    def testCountedField(self):
+        data = fold(self.path, crafter=self.id)
+        assert data == bitstring.pack(
+            'uint:8, uint:4, 4*uint:9, 3*uint:12', 5, 2, 1, 2, 3, 4, 7, 8, 9)
+        assert self.crafter.size_of(self.Path) is None
+        assert unfold(data, self.Path, crafter=self.id) == self.path
+
+        empty = self.Path(1, [], [0, 0, 0])
+        assert unfold(fold(empty, crafter=self.id), self.Path,
+                      crafter=self.id) == empty
+        with pytest.raises(OrigamiException):
+            fold(self.Path(1, [self.Point(0, 0)] * 16, [0, 0, 0]),
+                 crafter=self.id)
+
+    def testNestedCountedFields(self):
+        @pattern(crafter=self.id)
+        class Route(object):
+            folds = 'paths=Path[*:8], tag=uint:8'
+            __init__ = init('paths', 'tag')
+            __eq__ = equals('paths', 'tag')
+
+        route = Route([self.path, self.Path(6, [], [1, 2, 3])], 200)
+        routes = [route, Route([], 1)]
+        data = fold_many(routes, crafter=self.id)
+        assert unfold_many(data, Route, crafter=self.id) == routes
+
+        decoder = FoldDecoder(Route, self.id)
+        objs = []
+        for byte in data.tobytes():
+            objs.extend(decoder.feed(bytes([byte])))
+        assert objs == routes
+
+    def testFoldDecoderReadsOnce(self):
+        @pattern(crafter=self.id)
+        class Samples(object):
+            folds = 'id=uint:8, samples=uint:12[*]'
+            __init__ = init('id', 'samples')
+            __eq__ = equals('id', 'samples')
+
+        samples = [Samples(i, list(range(i * 1000, i * 1000 + 3000)))
+                   for i in range(2)]
+        data = fold_many(samples, crafter=self.id).tobytes()
+        decoder = FoldDecoder(Samples, self.id)
+        reads = []
+        layouts = [layout for step in decoder._steps for layout in step
+                   if isinstance(layout, Layout)]
+        for layout in layouts:
+            def unpack_many(*args, unpack_many=layout.unpack_many):
+                reads.append(args[2])
+                return unpack_many(*args)
+            layout.unpack_many = unpack_many
+
+        objs = []
+        for start in range(0, len(data), 100):
+            objs.extend(decoder.feed(data[start:start + 100]))
+        assert objs == samples
+        # The id, count and elements of each object are each read once
+        assert reads == [1, 1, 3000] * 2
+
+    def testElementCreases(self):
+        counter, name_creases = count_creases(fold=int, unfold=str)
+
+        @pattern(crafter=self.id)
+        class Foo(object):
+            folds = 'a=uint:8[*], b=flag[2]'
+            creases = {'a': name_creases,
+                       'flag': {'fmt': 'uint:1', 'fold': int, 'unfold': bool}}
+            __init__ = init('a', 'b')
+
+        foo = unfold(fold(Foo(['1', '2', '3'], [True, False]),
+                          crafter=self.id), Foo, crafter=self.id)
+        assert foo.a == ['1', '2', '3']
+        assert foo.b == [True, False]
+        assert counter == {'fold': 3, 'unfold': 3}
+
+    def testProjection(self):
+        data = fold(self.path, crafter=self.id)
+        assert self.crafter.unfold(data, self.Path, fields=('points',)) == \
+            {'points': self.path.points}
+
+    def testZeroWidthCount(self):
+        for folds in ['a=uint:8[*:0]', 'a=Point[*:00]']:
+            with pytest.raises(InvalidFoldFormatException):
+                self.crafter.learn_pattern(
+                    type('Foo', (object,), {}), None, folds, {})
+
+    def testTokensWithoutWidth(self):
+        for folds in ['a=hex[*]', 'a=bits[3]', 'a=bin[*:4]']:
+            with pytest.raises(OrigamiException):
+                self.crafter.learn_pattern(
+                    type('Foo', (object,), {}), None, folds, {})
+
+        @pattern(crafter=self.id)
+        class Codes(object):
+            folds = 'a=ue[*], b=se[2]'
+            __init__ = init('a', 'b')
+            __eq__ = equals('a', 'b')
+
+        codes = Codes([0, 7, 1000], [-5, 3])
+        assert unfold(fold(codes, crafter=self.id), Codes,
+                      crafter=self.id) == codes
+
+
+class DeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            __init__ = init('x', 'y')
+            __eq__ = equals('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Action(object):
+            folds = 'id=uint:16, point=Point, speed=ue, tags=uint:4[*:3]'
+            __init__ = init('id', 'point', 'speed', 'tags')
+            __eq__ = equals('id', 'point', 'speed', 'tags')
+        self.Point, self.Action = Point, Action
+        self.baseline = Action(7, Point(1, 2), 30, [1, 2])
+
+    def roundtrip(self, obj):
+        data = self.crafter.fold_delta(obj, self.baseline)
+        result = self.crafter.unfold_delta(data, self.baseline)
+        assert data.pos == data.len
+        return data, result
+
+    def testUnchanged(self):
+        action = self.Action(7, self.Point(1, 2), 30, [1, 2])
+        data, result = self.roundtrip(action)
+        assert data == bitstring.BitStream('0b00000')
+        assert result == action
+        assert result is not self.baseline
+
+    def testChangedFields(self):
+        action = self.Action(7, self.Point(1, 300), 30, [1, 2, 3])
+        data, result = self.roundtrip(action)
+        assert data == bitstring.pack(
+            'bin:5, uint:9, uint:3, 3*uint:4', '00101', 300, 3, 1, 2, 3)
+        assert result == action
+        assert self.baseline.point.y == 2
+
+        action = self.Action(8, self.Point(1, 2), 1000, [1, 2])
+        data, result = self.roundtrip(action)
+        assert data == bitstring.pack('bin:5, uint:16, ue', '10010', 8, 1000)
+        assert result == action
+
+    def testErrors(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_delta(self.baseline, self.Point(1, 2))
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_delta(
+                self.Action(70000, self.Point(1, 2), 30, [1, 2]),
+                self.baseline)
+        with pytest.raises(OrigamiException):
+            self.crafter.unfold_delta(
+                bitstring.BitStream('0b10000'), self.baseline)
+
+
+class FoldCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.counter, x_creases = count_creases(fold=int, unfold=int)
+
+        @pattern(crafter=self.id)
+        class Block(object):
+            folds = 'x=uint:9, y=uint:9, tags=uint:4[*:3]'
+            creases = {'x': x_creases}
+            __init__ = init('x', 'y', 'tags', 'version')
+        self.Block = Block
+
+    def testIdentityWithVersion(self):
+        cache = self.crafter.fold_cache = FoldCache(
+            2, key='identity', version='version')
+        block = self.Block(1, 2, [3], 0)
+        data = fold(block, crafter=self.id)
+        assert isinstance(data, bitstring.Bits)
+        assert fold(block, crafter=self.id) is data
+        assert fold(block, crafter=self.id) is data
+        assert (cache.hits, cache.misses) == (2, 1)
+        assert self.counter['fold'] == 1
+
+        block.y, block.version = 5, 1
+        assert unfold(fold(block, crafter=self.id), self.Block,
+                      crafter=self.id).y == 5
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # Least recently used entries are evicted
+        others = [self.Block(i, i, [], 0) for i in range(2)]
+        for other in others:
+            fold(other, crafter=self.id)
+        assert len(cache) == 2
+        fold(block, crafter=self.id)
+        assert cache.misses == 5
+
+    def testValues(self):
+        cache = self.crafter.fold_cache = FoldCache(key='values')
+        fold(self.Block(1, 2, [], 0), crafter=self.id)
+        fold(self.Block(1, 2, [], 0), crafter=self.id)
+        assert (cache.hits, cache.misses) == (0, 2)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            __init__ = init('x', 'y')
+
+        assert fold(Point(1, 2), crafter=self.id) == \
+            fold(Point(1, 2), crafter=self.id)
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def testValuesKeyedByBits(self):
+        @pattern(crafter=self.id)
+        class Reading(object):
+            folds = 'v=float:32'
+            __init__ = init('v')
+
+        self.crafter.fold_cache = FoldCache(key='values')
+        assert fold(Reading(0.0), crafter=self.id).hex == '00000000'
+        assert fold(Reading(-0.0), crafter=self.id).hex == '80000000'
+
+    def testSharedByCrafters(self):
+        other = unique_id()
+
+        @pattern(crafter=self.id)
+        @pattern(crafter=other)
+        class Point(object):
+            folds = {self.id: 'x=uint:8', other: 'x=uint:16'}
+            __init__ = init('x')
+
+        cache = FoldCache(key='values')
+        self.crafter.fold_cache = Crafter(other).fold_cache = cache
+        assert fold(Point(5), crafter=self.id).hex == '05'
+        assert fold(Point(5), crafter=other).hex == '0005'
+        assert cache.misses == 2
+
+    def testHitSkipsPacking(self):
+        @pattern(crafter=self.id)
+        class Reading(object):
+            folds = 'id=ue, v=float:32'
+            __init__ = init('id', 'v')
+
+        blocks = [self.Block(1, 2, [], 0), self.Block(3, 4, [5, 6], 0)]
+        readings = [Reading(1, 0.5), Reading(300, -2.0)]
+        for cache, objs in [
+                (FoldCache(key='identity', version='version'), blocks),
+                (FoldCache(key='values'), readings)]:
+            self.crafter.fold_cache = cache
+            expected = [fold(obj, crafter=self.id) for obj in objs]
+            with unittest.mock.patch.object(
+                    bitstring, 'BitStream',
+                    side_effect=AssertionError('BitStream built')):
+                for _ in range(2):
+                    assert [fold(obj, crafter=self.id)
+                            for obj in objs] == expected
+            assert (cache.hits, cache.misses) == (4, 2)
+        assert unfold(fold(readings[1], crafter=self.id), Reading,
+                      crafter=self.id).id == 300
+
+    def testIdentityRequiresVersion(self):
+        with pytest.raises(ValueError):
+            FoldCache(key='identity')
+
+
+class FoldMultiTests(unittest.TestCase):
+    def testSharedFieldsReadOnce(self):
+        client, disk = unique_id(), unique_id()
+        counter, type_creases = count_creases(fold=int, unfold=int)
+        reads = collections.Counter()
+
+        @pattern(crafter=client)
+        @pattern(crafter=disk)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            __init__ = init('x', 'y')
+
+        @pattern(crafter=client)
+        @pattern(crafter=disk)
+        class Block(object):
+            folds = {
+                client: 'pos=Point, type=uint:8',
+                disk: 'pos=Point, type=uint:8, bonus=bool'
+            }
+            creases = {'type': type_creases}
+
+            def __init__(self, pos, type, bonus):
+                self._values = {'pos': pos, 'type': type, 'bonus': bonus}
+
+            def __getattr__(self, name):
+                reads[name] += 1
+                try:
+                    return self._values[name]
+                except KeyError:
+                    raise AttributeError(name)
+
+        block = Block(Point(3, 4), '7', True)
+        client_data, disk_data = fold_multi(block, crafters=(client, disk))
+        assert reads == {'pos': 1, 'type': 1, 'bonus': 1}
+        assert counter['fold'] == 1
+        assert client_data == fold(block, crafter=client)
+        assert disk_data == fold(block, crafter=disk)
+
+        with pytest.raises(OrigamiException):
+            fold_multi(Point(1, 2), crafters=(client, unique_id()))
+
+
+class ContainerTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.counter, y_creases = count_creases(fold=int, unfold=str)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            creases = {'y': y_creases}
+            __init__ = init('x', 'y')
+
+        def unfold_action(name, instance, **kwargs):
+            raise AssertionError('unfold callback called')
+
+        class Action(object):
+            __init__ = init('id', 'point', 'path')
+        self.crafter.learn_pattern(
+            Action, unfold_action,
+            'id=uint:16, point=Point, path=Point[*:4]', {})
+        self.Point, self.Action = Point, Action
+        self.action = Action(7, Point(1, 2), [Point(3, 4), Point(5, 6)])
+
+    def testContainers(self):
+        data = fold(self.action, crafter=self.id)
+        data.pos = 0
+        assert self.crafter.unfold(data, self.Action, into='tuple') == \
+            (7, (1, '2'), [(3, '4'), (5, '6')])
+        data.pos = 0
+        assert self.crafter.unfold(data, self.Action, into='dict') == {
+            'id': 7, 'point': {'x': 1, 'y': '2'},
+            'path': [{'x': 3, 'y': '4'}, {'x': 5, 'y': '6'}]}
+        data.pos = 0
+        action = self.crafter.unfold(data, self.Action, into='namedtuple')
+        assert action.point.y == '2'
+        assert type(action.path[0]) is type(action.point)
+        assert action._fields == ('id', 'point', 'path')
+
+        with pytest.raises(ValueError):
+            self.crafter.unfold(data, self.Action, into='list')
+
+    def testBulk(self):
+        points = [self.Point(i, i + 1) for i in range(20)]
+        data = fold_many(points, crafter=self.id)
+        expected = [(i, str(i + 1)) for i in range(20)]
+        assert unfold_many(data, self.Point, crafter=self.id,
+                           into='tuple') == expected
+        stream = io.BytesIO(data.tobytes())
+        assert list(self.crafter.iter_unfold(
+            stream, self.Point, chunk_size=3, into='tuple')) == expected
+        assert self.crafter.unfold_from(
+            data.tobytes(), 18, self.Point, into='dict') == {'x': 1, 'y': '2'}
+
+        data = fold_many([self.action] * 3, crafter=self.id)
+        assert [a.id for a in self.crafter.unfold_many(
+            data, self.Action, into='namedtuple')] == [7, 7, 7]
+
+
+class FoldValuesTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.counter, y_creases = count_creases(fold=int, unfold=str)
+
+        @pattern(crafter=self.id)
+        class Point(object):
+            folds = 'x=uint:9, y=uint:9'
+            creases = {'y': y_creases}
+            __init__ = init('x', 'y')
+
+        @pattern(crafter=self.id)
+        class Block(object):
+            folds = 'id=uint:8, pos=Point, samples=uint:4[2], path=Point[*:3]'
+            __init__ = init('id', 'pos', 'samples', 'path')
+        self.Point, self.Block = Point, Block
+        self.block = Block(5, Point(1, '2'), [3, 4], [Point(5, '6')])
+
+    def testFoldValues(self):
+        expected = fold(self.block, crafter=self.id)
+        assert self.crafter.fold_values(
+            self.Block, 5, (1, '2'), [3, 4], [{'x': 5, 'y': '6'}]) == expected
+        assert self.crafter.fold_values(self.Block, {
+            'id': 5, 'pos': self.Point(1, '2'), 'samples': (3, 4),
+            'path': [(5, '6')]}) == expected
+        assert self.crafter.fold_values('Point', 1, '2') == \
+            fold(self.Point(1, '2'), crafter=self.id)
+
+    def testFoldRows(self):
+        points = [self.Point(i, str(i)) for i in range(10)]
+        rows = ((i, str(i)) for i in range(10))
+        assert self.crafter.fold_rows(self.Point, rows) == \
+            fold_many(points, crafter=self.id)
+
+        blocks = [self.block, self.Block(6, self.Point(0, '0'), [0, 0], [])]
+        rows = [(5, (1, '2'), [3, 4], [(5, '6')]),
+                {'id': 6, 'pos': (0, '0'), 'samples': [0, 0], 'path': []}]
+        assert self.crafter.fold_rows(self.Block, rows) == \
+            fold_many(blocks, crafter=self.id)
+
+    def testInvalidValues(self):
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_values(self.Point, 1)
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_values(self.Point, {'x': 1})
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_values(self.Point, 1000, '1')
+        with pytest.raises(OrigamiException):
+            self.crafter.fold_values(
+                self.Block, 5, (1, '2'), [3], [])
+
+
+class RecordTests(unittest.TestCase):
+    def setUp(self):
+        self.id = unique_id()
+        self.crafter = Crafter(self.id)
+        self.Point = record('Point', 'x=uint:9, y=uint:9', crafter=self.id)
+
+    def testRecordClass(self):
+        point = self.Point(3, 4)
+        assert (point.x, point.y) == (3, 4)
+        assert point == self.Point(3, 4)
+        assert point != self.Point(4, 3)
+        assert repr(point) == 'Point(x=3, y=4)'
+        assert not hasattr(point, '__dict__')
+        assert self.Point.__module__ == __name__
+        assert self.Point in self.crafter.patterns
+
+    def testFoldUnfold(self):
+        point = self.Point(3, 4)
+        data = fold(point, crafter=self.id)
+        assert unfold(data, self.Point, crafter=self.id) == point
+
+        other = self.Point(0, 0)
+        data.pos = 0
+        assert self.crafter.unfold(data, other) is other
+        assert other == point
+
+    def testNestedRecords(self):
+        Path = record('Path', 'id=uint:8, start=Point, points=Point[*:4]',
+                      crafter=self.id)
+        path = Path(7, self.Point(1, 2), [self.Point(3, 4)] * 3)
+        data = fold(path, crafter=self.id)
+        assert unfold(data, Path, crafter=self.id) == path
+
+    def testFieldNames(self):
+        Odd = record('Odd', 'self=uint:8, unfold=uint:8', crafter=self.id)
+        odd = Odd(1, 2)
+        assert unfold(fold(odd, crafter=self.id), Odd,
+                      crafter=self.id) == odd
+
+    def testInvalidNames(self):
+        with pytest.raises(OrigamiException):
+            record('Bad', 'a b=uint:8', crafter=self.id)
+        with pytest.raises(OrigamiException):
+            record('Bad', '__a=uint:8', crafter=self.id)
+        with pytest.raises(OrigamiException):
+            record('Bad', 'a=uint:8, a=uint:8', crafter=self.id)
+        with pytest.raises(OrigamiException):
+            record('Bad', '', crafter=self.id)
+        with pytest.raises(OrigamiException):
+            record('Point', 'a=uint:8', crafter=self.id)
+
+
+class ParallelTests(unittest.TestCase):
+    def setUp(self):
+        self.crafter = Crafter(_parallel)
+        self.blocks = [ParallelBlock(i % 32, ParallelPoint(i, 511 - i), i % 8)
+                       for i in range(101)]
+
+    def testFoldMany(self):
+        data = fold_many(self.blocks, crafter=_parallel)
+        assert fold_many(self.blocks, crafter=_parallel, workers=3) == data
+        assert self.crafter.fold_many([], workers=2) == bitstring.BitStream()
+
+    def testUnfoldMany(self):
+        data = fold_many(self.blocks, crafter=_parallel)
+        assert unfold_many(data, ParallelBlock, crafter=_parallel,
+                           workers=3) == self.blocks
+
+        values = self.crafter.unfold_many(
+            data.tobytes(), ParallelBlock, count=10, into='tuple', workers=4)
+        assert values == [(b.id, (b.pos.x, b.pos.y), b.tag)
+                          for b in self.blocks[:10]]
+
+    def testDescribe(self):
+        # A Crafter learns the described patterns as a worker would
+        other = Crafter(unique_id())
+        parallel._learn(
+            other.name, parallel.describe(self.crafter, [ParallelBlock]))
+        data = fold_many(self.blocks, crafter=_parallel)
+        assert fold_many(self.blocks, crafter=other.name) == data
+        assert unfold_many(data, ParallelBlock,
+                           crafter=other.name) == self.blocks
+
+    def testInvalid(self):
+        crafter = unique_id()
+        Varying = record('Varying', 'a=ue', crafter=crafter)
+        with pytest.raises(OrigamiException):
+            unfold_many(bitstring.BitStream(), Varying, crafter=crafter,
+                        workers=2)
+        with pytest.raises(ValueError):
+            self.crafter.fold_many(self.blocks, workers=0)
+
+    def testSpawnedWorkers(self):
+        spawn = functools.partial(
+            concurrent.futures.ProcessPoolExecutor,
+            mp_context=multiprocessing.get_context('spawn'))
+        crafter = unique_id()
+        pattern(crafter=crafter)(ParallelReading)
+
+        @pattern(crafter=crafter)
+        class Pair(object):
+            folds = 'a=ParallelReading, b=ParallelReading'
+            __init__ = init('a', 'b')
+
+        with unittest.mock.patch.object(
+                concurrent.futures, 'ProcessPoolExecutor', spawn):
+            # Spawned workers learn the described patterns
+            data = fold_many(self.blocks, crafter=_parallel)
+            assert fold_many(self.blocks, crafter=_parallel,
+                             workers=2) == data
+            # Lambda creases can't be sent to them
+            with pytest.raises(OrigamiException, match="crease 'v'"):
+                fold_many([ParallelReading(4)] * 3, crafter=crafter,
+                          workers=2)
+            with pytest.raises(OrigamiException, match='ParallelReading'):
+                unfold_many(bitstring.BitStream(16), Pair, crafter=crafter,
+                            workers=2)
+            # Nor can classes that can't be imported
+            Local = record('Local', 'a=uint:8', crafter=crafter)
+            with pytest.raises(OrigamiException, match='Local'):
+                fold_many([Local(1)] * 3, crafter=crafter, workers=2)
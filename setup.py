@@ -26,5 +26,6 @@ setup(
     license='MIT',
     description='Lightweight bit packing for classes',
     long_description=long_description,
-    install_requires=["bitstring"]
+    install_requires=["bitstring"],
+    extras_require={"numpy": ["numpy"]}
 )